@@ -0,0 +1,89 @@
+""" Times the start of a worker process: importing parts of sibunlabs in a
+    fresh interpreter, and tracing a cell with and without cv2 installed
+    (cv2 is hidden from the interpreter for the latter), eg.
+
+        python benchmarks/import_benchmark.py --repeat 5
+
+    Writes one JSON object per line and case with the best wall time of
+    --repeat fresh interpreters in seconds, their peak memory in MiB and the
+    heavy modules (cv2, PIL, scipy) they loaded.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Traces a synthetic cell (drawn with numpy, synthetic needs cv2)
+TRACE = """
+import sibunlabs.pathfinder
+y, x = np.mgrid[:256,:256]
+image = 100 + 80*np.exp(-((np.hypot(y - 128, x - 120) - 70)/4)**2)
+pathfinder = sibunlabs.pathfinder.Pathfinder(image)
+pathfinder.getPath()
+result["report"] = pathfinder._report
+result["length"] = len(pathfinder._path)
+"""
+
+# Code run by the fresh interpreter of every case
+CASES = {
+    "python" : "pass",
+    "import sibunlabs" : "import sibunlabs",
+    "import sibunlabs.special" : "import sibunlabs.special",
+    "special.rfa" : "from sibunlabs import special; special.rfa(np.ones(64), np.arange(64)*360/64)",
+    "import sibunlabs.pathfinder" : "import sibunlabs.pathfinder",
+    "trace" : TRACE,
+    "trace without cv2" : TRACE,
+}
+
+# Runs in the fresh interpreter: times the case and prints the result
+RUNNER = """
+import json, resource, sys, time
+if %(hide_cv2)r:
+    sys.modules["cv2"] = None
+t0 = time.perf_counter()
+import numpy as np
+result = {}
+%(code)s
+result["seconds"] = time.perf_counter() - t0
+result["peak_mib"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1024
+result["modules"] = sorted(m for m in ("cv2", "PIL", "scipy") if sys.modules.get(m) is not None)
+print(json.dumps(result))
+"""
+
+def runCase(name, code, repeat):
+    """ Runs one case in repeat fresh interpreters and returns the result of
+        the fastest one
+    """
+    source = RUNNER % {"hide_cv2" : name.endswith("without cv2"), "code" : code}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH = os.pathsep.join(filter(None, [root, os.environ.get("PYTHONPATH")])))
+    runs = []
+    for i in range(0, repeat):
+        output = subprocess.run([sys.executable, "-c", source], env = env, check = True,
+            stdout = subprocess.PIPE).stdout
+        runs.append(json.loads(output.decode().strip().splitlines()[-1]))
+    result = min(runs, key = lambda run: run["seconds"])
+    result["case"] = name
+    return result
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--cases", nargs = "+", default = list(CASES))
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--output", default = None, help = "file to write to instead of stdout")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for name in args.cases:
+            result = runCase(name, CASES[name], args.repeat)
+            out.write(json.dumps(result, sort_keys = True) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
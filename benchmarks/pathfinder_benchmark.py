@@ -0,0 +1,111 @@
+""" Times every stage of the path search on synthetic cells of different
+    kinds and sizes and writes one JSON object per line and case, eg.
+
+        python benchmarks/pathfinder_benchmark.py --sizes 256 512 1024 > bench_output.txt
+
+    Every timing is the best of --repeat runs in seconds.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import sibunlabs
+from sibunlabs import geometry, special, synthetic
+
+STAGES = ("applySobel", "whiteness", "_searchStartpoint", "_findPath",
+    "getRadialPath", "rfa", "rfaBatch")
+
+def best(function, repeat):
+    """ Returns the best time of repeat calls of function and its last result """
+    times = []
+    for i in range(0, repeat):
+        t0 = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+def benchmarkCase(kind, size, noise, repeat):
+    image, truth = synthetic.syntheticCell(kind, size, noise = noise)
+    timings = {}
+
+    def prepare():
+        pathfinder = sibunlabs.Pathfinder(image, sobel = False)
+        pathfinder.max_iterations = 100*size
+        return pathfinder
+
+    def sobel():
+        pathfinder = prepare()
+        pathfinder.applySobel()
+        return pathfinder
+    timings["applySobel"], pathfinder = best(sobel, repeat)
+
+    # The whiteness field of the whole image; the path search only
+    # calculates the tiles along the path
+    timings["whiteness"], _ = best(lambda: sibunlabs.pathfinder.whitenessField(pathfinder._image,
+        pathfinder._weight, pathfinder._weightcount), repeat)
+
+    start = (pathfinder.width//2, pathfinder.height//2)
+    timings["_searchStartpoint"], _ = best(lambda: pathfinder._searchStartpoint(*start), repeat)
+
+    def trace():
+        pathfinder._path = None
+        pathfinder._centroid = None
+        try:
+            pathfinder._findPath()
+        except sibunlabs.pathfinder.PathfinderException:
+            pass
+    timings["_findPath"], _ = best(trace, repeat)
+    # _findPath includes the start point search
+    timings["tracing"] = max(timings["_findPath"] - timings["_searchStartpoint"], 0.0)
+
+    result = {
+        "kind" : kind,
+        "size" : size,
+        "noise" : noise,
+        "report" : pathfinder._report,
+        "length" : int(len(pathfinder._path)),
+        "true_perimeter" : float(truth["perimeter"]),
+    }
+
+    if pathfinder._report == "OK":
+        timings["getRadialPath"], radial_path = best(pathfinder.getRadialPath, repeat)
+        timings["rfa"], _ = best(lambda: special.rfa(radial_path[:,0], radial_path[:,1]), repeat)
+        timings["rfaBatch"], _ = best(lambda: special.rfaBatch([radial_path[:,0]],
+            [radial_path[:,1]], n_angles = 360), repeat)
+
+        centroid = pathfinder.getCentroid()
+        result["centroid_error"] = float(np.hypot(centroid[0] - truth["centroid"][0],
+            centroid[1] - truth["centroid"][1]))
+        result["area_ratio"] = float(geometry.area(pathfinder.getPath())/truth["area"])
+        result["steps_per_second"] = len(pathfinder._path)/max(timings["tracing"], 1e-9)
+
+    result["timings"] = timings
+    return result
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--kinds", nargs = "+", default = list(synthetic.KINDS))
+    parser.add_argument("--sizes", nargs = "+", type = int, default = [256, 512, 1024, 2048])
+    parser.add_argument("--noise", nargs = "+", type = float, default = [0.0, 5.0])
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--output", default = None, help = "file to write to instead of stdout")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for kind in args.kinds:
+            for size in args.sizes:
+                for noise in args.noise:
+                    result = benchmarkCase(kind, size, noise, args.repeat)
+                    out.write(json.dumps(result, sort_keys = True) + "\n")
+                    out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+""" Times the innermost loop of the path search, one tracing step, against
+    the if/elif implementation it replaced, and checks that both find the
+    same paths, eg.
+
+        python benchmarks/step_benchmark.py --sizes 256 1024
+
+    Writes one JSON object per line and case with the time per step of whole
+    traces and of _searchNextpoint alone, in microseconds (best of --repeat
+    runs), and the speedups.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+import numpy as np
+
+import sibunlabs
+from sibunlabs import synthetic
+from sibunlabs.pathfinder import PathfinderException, PathStore
+
+class ReferencePathfinder(sibunlabs.Pathfinder):
+    """ Pathfinder with the previous tracing step: an if/elif chain for the
+        direction, float slopes and a Python scan for the whitest candidate
+    """
+    def _searchNextpoint(self, d, path):
+        # Get newest point
+        yi, xi = path[-1]
+
+        # Get the default direction
+        if d == 0:
+            default_direction = self.DIRECTION_RIGHT
+        elif d == 1:
+            default_direction = self.DIRECTION_DOWN
+        elif d == 2:
+            default_direction = self.DIRECTION_LEFT
+        else:
+            default_direction = self.DIRECTION_UP
+
+        # Get points which have to be searched in order to determine the direction
+        directionMask, direction = self._getDirectionMask(path, default_direction = default_direction)
+
+        # Calculate the whiteness of those points
+        whitesearch_intensities = []
+        for point in directionMask:
+            whitesearch_intensities.append(self._getWhiteness(y=point[0], x=point[1]))
+
+        # Get the most white point
+        maxwhite = max(whitesearch_intensities)
+
+        # Get the actual point by the biggest intensity (the whitest point)
+        nextPoint = (0, 0)
+        for i in range(0, len(directionMask)):
+            if whitesearch_intensities[i] == maxwhite:
+                nextPoint = directionMask[i]
+
+        # Return next point
+        return nextPoint
+
+    def _getDirectionMask(self, path, default_direction = None):
+        if default_direction is None:
+            default_direction = self.DIRECTION_UP
+
+        # Calculate direction or use default direction
+        if len(path) >= self.inflexibility:
+            # Get the last 10 points
+            slopseq = path[-self.inflexibility:]
+            # Get difference in y and x direction
+            y_diff = slopseq[-1][0] - slopseq[0][0]
+            x_diff = slopseq[-1][1] - slopseq[0][1]
+            # Get direction
+            if x_diff == 0:
+                if y_diff < 0:
+                    direction = self.DIRECTION_UP
+                else:
+                    direction = self.DIRECTION_DOWN
+            elif y_diff == 0:
+                if x_diff > 0:
+                    direction = self.DIRECTION_RIGHT
+                else:
+                    direction = self.DIRECTION_LEFT
+            else:
+                s = y_diff/x_diff
+                if x_diff > 0 and y_diff < 0:
+                    # s is negative
+                    if s < -2:
+                        direction = self.DIRECTION_UP
+                    elif s >= -2 and s <= -0.5:
+                        direction = self.DIRECTION_UPRIGHT
+                    else:
+                        direction = self.DIRECTION_RIGHT
+                elif x_diff > 0 and y_diff > 0:
+                    # s is positive
+                    if s < 0.5:
+                        direction = self.DIRECTION_RIGHT
+                    elif s >= 0.5 and s <= 2:
+                        direction = self.DIRECTION_DOWNRIGHT
+                    else:
+                        direction = self.DIRECTION_DOWN
+                elif x_diff < 0 and y_diff > 0:
+                    # s is negative
+                    if s < -2:
+                        direction = self.DIRECTION_DOWN
+                    elif s >= -2 and s <= -0.5:
+                        direction = self.DIRECTION_DOWNLEFT
+                    else:
+                        direction = self.DIRECTION_LEFT
+                else:
+                    # s is positive again
+                    if s < 0.5:
+                        direction = self.DIRECTION_LEFT
+                    elif s >= 0.5 and s <= 2:
+                        direction = self.DIRECTION_UPLEFT
+                    else:
+                        direction = self.DIRECTION_UP
+        else:
+            direction = default_direction
+
+
+        yi, xi = path[-1]
+
+        # Get direction mask
+        if direction == self.DIRECTION_UP:
+            blacksearch_points = [
+                (yi-1, xi-1), # top-left
+                (yi-1, xi), # top
+                (yi-1, xi+1), # top-right
+            ]
+        elif direction == self.DIRECTION_UPRIGHT:
+            blacksearch_points = [
+                (yi-1, xi), # top
+                (yi-1, xi+1), # top-right
+                (yi, xi+1), # right
+            ]
+        elif direction == self.DIRECTION_RIGHT:
+            blacksearch_points = [
+                (yi-1, xi+1), # top-right
+                (yi, xi+1), # right
+                (yi+1, xi+1), # bottom-right
+            ]
+        elif direction == self.DIRECTION_DOWNRIGHT:
+            blacksearch_points = [
+                (yi, xi+1), # right
+                (yi+1, xi+1), # bottom-right
+                (yi+1, xi), # bottom
+            ]
+        elif direction == self.DIRECTION_DOWN:
+            blacksearch_points = [
+                (yi+1, xi+1), # bottom-right
+                (yi+1, xi), # bottom
+                (yi+1, xi-1), # bottom-left
+            ]
+        elif direction == self.DIRECTION_DOWNLEFT:
+            blacksearch_points = [
+                (yi+1, xi), # bottom
+                (yi+1, xi-1), # bottom-left
+                (yi, xi-1), # left
+            ]
+        elif direction == self.DIRECTION_LEFT:
+            blacksearch_points = [
+                (yi+1, xi-1), # bottom-left
+                (yi, xi-1), # left
+                (yi-1, xi-1), # top-left
+            ]
+        elif direction == self.DIRECTION_UPLEFT:
+            blacksearch_points = [
+                (yi, xi-1), # left
+                (yi-1, xi-1), # top-left
+                (yi-1, xi), # top
+            ]
+
+        return blacksearch_points, direction
+
+def tracePath(pathfinder):
+    """ Runs the path search of pathfinder from scratch and returns the path """
+    pathfinder._path = None
+    try:
+        pathfinder._findPath()
+    except PathfinderException:
+        pass
+    return pathfinder._path
+
+def timeSteps(pathfinder, repeat):
+    """ Returns the best time per tracing step of repeat path searches in
+        microseconds, the number of steps and the path
+    """
+    times = []
+    for i in range(0, repeat):
+        pathfinder.stats = sibunlabs.PathfinderStats()
+        path = tracePath(pathfinder)
+        stats = pathfinder.stats
+        steps = stats.counters.get("steps", 0) + stats.counters.get("reverse_steps", 0)
+        seconds = stats.timings.get("tracing", 0.0) + stats.timings.get("reverse", 0.0)
+        times.append(seconds/max(steps, 1)*1e6)
+    pathfinder.stats = None
+    return min(times), steps, path
+
+def timeKernel(pathfinder, path, repeat, number = 2000):
+    """ Returns the best time of one _searchNextpoint call in microseconds,
+        continuing the first half of path
+    """
+    store = PathStore(pathfinder._shape, len(path), path[:max(len(path)//2, 1)])
+    times = []
+    for i in range(0, repeat):
+        t0 = time.perf_counter()
+        for k in range(0, number):
+            pathfinder._searchNextpoint(3, store)
+        times.append((time.perf_counter() - t0)/number*1e6)
+    return min(times)
+
+def benchmarkCase(kind, size, noise, repeat):
+    image, truth = synthetic.syntheticCell(kind, size, noise = noise)
+    result = {"kind" : kind, "size" : size, "noise" : noise}
+
+    for name, cls in (("reference", ReferencePathfinder), ("table", sibunlabs.Pathfinder)):
+        pathfinder = cls(image)
+        pathfinder.max_iterations = 100*size
+        result[name + "_us_per_step"], result["steps"], path = timeSteps(pathfinder, repeat)
+        result[name + "_report"] = pathfinder._report
+        if name == "reference":
+            reference_path = path
+        else:
+            result["same_path"] = bool(np.array_equal(path, reference_path))
+        result[name + "_us_per_call"] = timeKernel(pathfinder, reference_path, repeat)
+
+    result["speedup"] = result["reference_us_per_step"]/max(result["table_us_per_step"], 1e-9)
+    result["kernel_speedup"] = result["reference_us_per_call"]/max(result["table_us_per_call"], 1e-9)
+    return result
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split("\n")[0])
+    parser.add_argument("--kinds", nargs = "+", default = list(synthetic.KINDS))
+    parser.add_argument("--sizes", nargs = "+", type = int, default = [256, 512, 1024])
+    parser.add_argument("--noise", nargs = "+", type = float, default = [0.0, 5.0])
+    parser.add_argument("--repeat", type = int, default = 5)
+    parser.add_argument("--output", default = None, help = "file to write to instead of stdout")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    try:
+        for kind in args.kinds:
+            for size in args.sizes:
+                for noise in args.noise:
+                    result = benchmarkCase(kind, size, noise, args.repeat)
+                    out.write(json.dumps(result, sort_keys = True) + "\n")
+                    out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+if __name__ == "__main__":
+    main()
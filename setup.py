@@ -8,9 +8,12 @@ config = {
     'author': 'Basilius Sauter',
     'url': 'https://github.com/sibunlabs/sibunlabs',
     'version': '0.1',
-    'install_requires': ['nose', 'numpy', 'cv2'],
+    'install_requires': ['nose', 'numpy', 'cv2', 'Pillow'],
     'packages': ['sibunlabs'],
     'scripts': [],
+    'entry_points': {
+        'console_scripts': ['sibunlabs-batch = sibunlabs.batch:main'],
+    },
     'name': 'sibunlabs'
 }
 
@@ -13,7 +13,41 @@
 #   You should have received a copy of the GNU Lesser General Public License
 #   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
 
-from sibunlabs.pathfinder import Pathfinder, \
-    NoClosedPathFound, MaxIterationReached, OutOfBoundaryError
+""" Submodules are imported when they are first used, so eg. importing
+    sibunlabs.special loads numpy only, not cv2 or PIL. The classes below
+    can still be used as sibunlabs.Pathfinder etc.
+"""
 
-from sibunlabs import special
\ No newline at end of file
+import importlib
+
+# The classes exported by the package, by the submodule defining them
+_EXPORTS = {
+    "pathfinder" : ("Pathfinder", "PathfinderStats", "BoundedTrace", "NoClosedPathFound",
+        "MaxIterationReached", "OutOfBoundaryError"),
+    "field" : ("Field", "Cell"),
+    "tracker" : ("Tracker",),
+    "pyramid" : ("PyramidPathfinder",),
+    "descriptors" : ("DescriptorStore",),
+    "pipeline" : ("Pipeline",),
+    "cache" : ("Cache",),
+    "chaincode" : ("ContourStore",),
+}
+_ATTRIBUTES = {name : module for module, names in _EXPORTS.items() for name in names}
+
+_SUBMODULES = ("pathfinder", "field", "tracker", "pyramid", "descriptors", "pipeline",
+    "cache", "chaincode", "features", "special", "geometry", "synthetic", "sweep", "stacks", "batch")
+
+__all__ = sorted(_ATTRIBUTES) + list(_SUBMODULES)
+
+def __getattr__(name):
+    if name in _ATTRIBUTES:
+        value = getattr(importlib.import_module("sibunlabs." + _ATTRIBUTES[name]), name)
+    elif name in _SUBMODULES:
+        value = importlib.import_module("sibunlabs." + name)
+    else:
+        raise AttributeError("module 'sibunlabs' has no attribute %r" % name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
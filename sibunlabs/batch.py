@@ -0,0 +1,297 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Traces the cells of many images in parallel and writes one CSV row per
+    image, with the centroid, the path length, the status and the radial
+    Fourier coefficients of the path. Images already contained in the output
+    file are skipped, so an interrupted run can be resumed.
+
+    With --stacks, every frame of multi-page TIFF files (and, with
+    --raw-shape, of raw stacks) is traced like an image and named
+    file#frame.
+"""
+
+import argparse
+import csv
+import glob
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from PIL import Image
+
+from sibunlabs import special, stacks
+from sibunlabs.pathfinder import Pathfinder, PathfinderException
+
+EXTENSIONS = (".png", ".tif", ".tiff", ".jpg", ".jpeg", ".bmp")
+RAW_EXTENSIONS = (".raw", ".bin")
+
+# Stacks opened by a worker process, by file
+_stacks = {}
+
+def findImages(inputs, extensions = EXTENSIONS):
+    """ Returns the sorted image files given by a list of files, directories
+        and glob patterns
+    """
+    files = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for name in os.listdir(pattern):
+                if name.lower().endswith(extensions):
+                    files.add(os.path.join(pattern, name))
+        else:
+            files.update(f for f in glob.glob(pattern) if os.path.isfile(f))
+    return sorted(files)
+
+def expandStacks(files, raw = None):
+    """ Replaces multi-page TIFF files and, if raw is a dict with the shape,
+        dtype and offset of raw stacks, files with RAW_EXTENSIONS by one
+        (file, frame) item per frame
+    """
+    items = []
+    for file in files:
+        is_raw = raw is not None and file.lower().endswith(RAW_EXTENSIONS)
+        if is_raw or file.lower().endswith((".tif", ".tiff")):
+            with openStack(file, raw) as stack:
+                n = len(stack)
+            # Single page TIFF files stay images
+            if is_raw or n != 1:
+                items.extend((file, i) for i in range(n))
+                continue
+        items.append(file)
+    return items
+
+def itemName(item):
+    """ Returns the name of an image file or (file, frame) item """
+    if isinstance(item, tuple):
+        return "%s#%i" % item
+    return item
+
+def openStack(file, raw = None):
+    """ Opens file as stack, using the raw stack layout raw if given """
+    if raw is None:
+        return stacks.TiffStack(file)
+    return stacks.openStack(file, raw["shape"], dtype = raw["dtype"], offset = raw["offset"])
+
+def loadFrame(file, frame, raw = None):
+    """ Returns one frame of a stack, keeping a few stacks open """
+    if file not in _stacks:
+        while len(_stacks) >= 4:
+            _stacks.pop(next(iter(_stacks))).close()
+        _stacks[file] = openStack(file, raw)
+    return _stacks[file][frame]
+
+def columns(harmonics):
+    """ Returns the column names of the output table """
+    return ["file", "status", "centroid_x", "centroid_y", "length"] + \
+        ["c%i" % j for j in range(harmonics)] + ["phi%i" % j for j in range(harmonics)]
+
+def checkColumns(output, harmonics):
+    """ Returns the column names for harmonics and raises ValueError if the
+        existing file output has other columns, so that a resumed run does
+        not append rows which do not fit the header
+    """
+    names = columns(harmonics)
+    if not os.path.exists(output):
+        return names
+    with open(output, newline = "") as f:
+        line = f.readline()
+    # A header cut off by a crash is removed by finishedFiles
+    if not line.endswith("\n"):
+        return names
+    header = next(csv.reader([line]))
+    if header != names:
+        raise ValueError("%s has %i columns, not those of %i harmonics; "
+            "resume it with the same harmonics" % (output, len(header), harmonics))
+    return names
+
+def processImage(item, settings):
+    """ Traces the cell of one image file or (file, frame) item and returns
+        its row as a dict
+    """
+    row = {"file" : itemName(item), "status" : "OK"}
+
+    try:
+        if isinstance(item, tuple):
+            pathfinder = Pathfinder(loadFrame(item[0], item[1], settings.get("raw")))
+        else:
+            im = Image.open(item)
+            try:
+                pathfinder = Pathfinder(im.convert("I"))
+            finally:
+                im.close()
+    except (IOError, OSError, ValueError, IndexError) as e:
+        row["status"] = "error: %s" % e
+        return row
+
+    pathfinder.max_iterations = settings["max_iterations"]
+    pathfinder.inflexibility = settings["inflexibility"]
+    pathfinder.multi_seed = settings["multi_seed"]
+    pathfinder.bidirectional = settings.get("bidirectional", False)
+
+    # The status is the report of the path search ("self_bite", "max_it" or
+    # "oob" if it failed), like in the other modules
+    try:
+        path = pathfinder.getPath()
+    except PathfinderException:
+        row["status"] = pathfinder._report
+        return row
+
+    centroid = pathfinder.getCentroid()
+    row["centroid_x"] = centroid[0]
+    row["centroid_y"] = centroid[1]
+    row["length"] = len(path)
+
+    harmonics = settings["harmonics"]
+    radial_path = pathfinder.getRadialPath()
+    cj, phij = special.rfaBatch([radial_path[:,0]], [radial_path[:,1]],
+        n_angles = max(2*harmonics, 360))
+    for j in range(harmonics):
+        row["c%i" % j] = cj[0,j]
+        row["phi%i" % j] = phij[0,j]
+
+    return row
+
+def finishedFiles(output):
+    """ Returns the files already contained in output. A last row cut off by a
+        crash is removed from the file, and so are the rows of images that
+        could not be read (status "error: ..."), so that they are retried.
+        Images whose path search failed are finished, tracing them again
+        gives the same result.
+    """
+    if not os.path.exists(output) or os.path.getsize(output) == 0:
+        return set()
+
+    with open(output, "rb+") as f:
+        data = f.read()
+        if not data.endswith(b"\n"):
+            f.truncate(data.rfind(b"\n") + 1)
+
+    with open(output, newline = "") as f:
+        reader = csv.DictReader(f)
+        rows = list(reader)
+    kept = [row for row in rows if not row["status"].startswith("error")]
+    if len(kept) < len(rows):
+        # Replace the file at once, a crash keeps the old one
+        handle, temporary = tempfile.mkstemp(dir = os.path.dirname(os.path.abspath(output)),
+            suffix = ".tmp")
+        try:
+            with os.fdopen(handle, "w", newline = "") as f:
+                writer = csv.DictWriter(f, reader.fieldnames)
+                writer.writeheader()
+                writer.writerows(kept)
+            os.replace(temporary, output)
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+
+    return set(row["file"] for row in kept)
+
+def run(files, output, settings, workers = None):
+    """ Processes files (image files or (file, frame) items) with a pool of
+        workers processes and appends every result to the CSV file output as
+        soon as it is available. Returns the number of processed files. Raises
+        ValueError if output has the columns of another number of harmonics.
+    """
+    names = checkColumns(output, settings["harmonics"])
+    done = finishedFiles(output)
+    todo = [f for f in files if itemName(f) not in done]
+    new = not os.path.exists(output) or os.path.getsize(output) == 0
+
+    with open(output, "a", newline = "") as f:
+        writer = csv.DictWriter(f, names, restval = "")
+        if new:
+            writer.writeheader()
+            f.flush()
+
+        if workers == 1:
+            for file in todo:
+                writer.writerow(processImage(file, settings))
+                f.flush()
+            return len(todo)
+
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            # Keep a bounded number of images in flight
+            limit = 4*(workers or os.cpu_count() or 1)
+            pending = set()
+            for file in todo:
+                pending.add(executor.submit(processImage, file, settings))
+                if len(pending) < limit:
+                    continue
+                finished, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in finished:
+                    writer.writerow(future.result())
+                f.flush()
+            for future in wait(pending)[0]:
+                writer.writerow(future.result())
+            f.flush()
+
+    return len(todo)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(prog = "sibunlabs-batch",
+        description = __doc__.split("\n\n")[0].replace("\n    ", " "))
+    parser.add_argument("inputs", nargs = "+", help = "image files, directories or glob patterns")
+    parser.add_argument("-o", "--output", default = "sibunlabs.csv", help = "CSV file to append to")
+    parser.add_argument("-j", "--workers", type = int, default = None,
+        help = "number of worker processes (default: number of CPUs)")
+    parser.add_argument("--harmonics", type = int, default = 16,
+        help = "number of Fourier coefficients to write")
+    parser.add_argument("--max-iterations", type = int, default = Pathfinder.max_iterations)
+    parser.add_argument("--inflexibility", type = int, default = Pathfinder.inflexibility)
+    parser.add_argument("--multi-seed", action = "store_true", help = "trace from all four start points")
+    parser.add_argument("--bidirectional", action = "store_true",
+        help = "trace in both directions from the start point at once")
+    parser.add_argument("--stacks", action = "store_true", help = "trace every frame of multi-page TIFF files")
+    parser.add_argument("--raw-shape", type = int, nargs = 2, metavar = ("HEIGHT", "WIDTH"),
+        help = "frame shape of raw stacks (%s files), implies --stacks" % ", ".join(RAW_EXTENSIONS))
+    parser.add_argument("--raw-dtype", default = "uint16", help = "pixel type of raw stacks")
+    parser.add_argument("--raw-offset", type = int, default = 0, help = "header bytes of raw stacks")
+    args = parser.parse_args(argv)
+
+    raw = None
+    extensions = EXTENSIONS
+    if args.raw_shape is not None:
+        raw = {"shape" : tuple(args.raw_shape), "dtype" : args.raw_dtype, "offset" : args.raw_offset}
+        extensions = EXTENSIONS + RAW_EXTENSIONS
+
+    files = findImages(args.inputs, extensions)
+    if args.stacks or raw is not None:
+        files = expandStacks(files, raw)
+    if len(files) == 0:
+        parser.error("no images found")
+
+    settings = {
+        "max_iterations" : args.max_iterations,
+        "inflexibility" : args.inflexibility,
+        "multi_seed" : args.multi_seed,
+        "bidirectional" : args.bidirectional,
+        "harmonics" : args.harmonics,
+        "raw" : raw,
+    }
+    try:
+        checkColumns(args.output, args.harmonics)
+    except ValueError as e:
+        parser.error(str(e))
+    n = run(files, args.output, settings, workers = args.workers)
+    print("%i of %i images processed, results in %s" % (n, len(files), args.output), file = sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+""" An on-disk cache of edge maps and traced paths, keyed by a hash of the
+    image content and the parameters they depend on. Pass it to Pathfinder
+    with the cache argument to skip the Sobel filter and the path search for
+    images seen before.
+
+    Every entry is one .npy file, written to a temporary file and renamed, so
+    several processes can share one cache directory: readers see either a
+    complete entry or none. Entries are memory-mapped when read. The cache
+    is kept below max_bytes by removing the least recently used entries
+    (by modification time, which is updated on every hit).
+"""
+
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+# Report codes of cached paths
+REPORTS = ("OK", "self_bite", "max_it", "oob")
+
+def contentHash(array, *parameters):
+    """ Returns a hex digest of the content, shape and dtype of array and the
+        repr() of parameters
+    """
+    array = np.ascontiguousarray(array)
+    # SHA-1 is not used for security here, only because it is fast
+    digest = hashlib.sha1()
+    digest.update(repr((array.shape, array.dtype.str, parameters)).encode())
+    digest.update(memoryview(array).cast("B"))
+    return digest.hexdigest()
+
+class Cache:
+    """ Cache of edge maps and paths in directory, see the module
+        documentation
+    """
+    # The following members are okay to modify
+    # Maximum size of all entries in bytes
+    max_bytes = 1 << 30
+
+    def __init__(self, directory, max_bytes = None):
+        self.directory = directory
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok = True)
+
+    def _file(self, kind, key):
+        return os.path.join(self.directory, "%s-%s.npy" % (kind, key))
+
+    def _get(self, kind, key):
+        """ Returns the memory-mapped array of an entry or None """
+        file = self._file(kind, key)
+        try:
+            array = np.load(file, mmap_mode = "r")
+            # Mark the entry as recently used
+            os.utime(file, None)
+        except (FileNotFoundError, ValueError, OSError):
+            # Removed by another process, or not complete
+            return None
+        return array
+
+    def _put(self, kind, key, array):
+        """ Stores an entry and removes old entries if the cache is full """
+        handle, temporary = tempfile.mkstemp(dir = self.directory, suffix = ".tmp")
+        try:
+            with os.fdopen(handle, "wb") as f:
+                np.save(f, np.ascontiguousarray(array))
+            os.replace(temporary, self._file(kind, key))
+        except BaseException:
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+            raise
+        self.evict()
+
+    def getEdges(self, key):
+        """ Returns the cached edge map of key (see Pathfinder) or None """
+        return self._get("edges", key)
+
+    def putEdges(self, key, edges):
+        self._put("edges", key, edges)
+
+    def getPath(self, key):
+        """ Returns the cached (path, report, seed) of key or None """
+        entry = self._get("path", key)
+        if entry is None:
+            return None
+        seed, report = entry[0]
+        return np.array(entry[1:]), REPORTS[report], (None if seed < 0 else int(seed))
+
+    def putPath(self, key, path, report, seed):
+        # The first row holds the seed and the report
+        entry = np.zeros((len(path) + 1, 2), dtype = np.int32)
+        entry[0] = (-1 if seed is None else seed, REPORTS.index(report))
+        entry[1:] = path
+        self._put("path", key, entry)
+
+    def entries(self):
+        """ Returns a list of (modification time, size, file) of all entries """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".npy"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def size(self):
+        """ Returns the size of all entries in bytes """
+        return sum(size for mtime, size, file in self.entries())
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache is not
+            larger than max_bytes
+        """
+        entries = self.entries()
+        total = sum(size for mtime, size, file in entries)
+        for mtime, size, file in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(file)
+            except OSError:
+                # Removed by another process, or still in use (Windows)
+                pass
+            total -= size
+
+    def clear(self):
+        """ Removes all entries """
+        for mtime, size, file in self.entries():
+            try:
+                os.remove(file)
+            except OSError:
+                pass
@@ -0,0 +1,336 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Freeman chain codes of paths and an append-only store of many contours
+    as chain codes, memory-mapped like descriptors.DescriptorStore.
+
+    Every point of a traced path is an 8-connected neighbour of the previous
+    one, so a path is fully described by its start point and one of eight
+    codes (3 bits) per step, instead of 16 bytes per point. Codes count
+    counterclockwise from east in image coordinates (y pointing down), see
+    STEPS. The closing step from the last point back to the first is not
+    stored.
+
+    A store is a directory with three files:
+
+        header.json  the version of the format
+        codes.bin    the packed codes of every contour, 3 bits per code,
+                     every contour starting at a new byte
+        index.bin    one record per contour: the byte offset of its codes,
+                     the number of codes and the start point (x, y)
+
+    Decoded contours are returned like in the geometry module: the
+    concatenated (x, y) points of all contours and their offsets.
+"""
+
+import json
+import os
+
+import numpy as np
+
+HEADER = "header.json"
+CODES = "codes.bin"
+INDEX = "index.bin"
+
+# (dx, dy) of the codes 0 to 7
+STEPS = np.array([(1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1), (1, 1)],
+    dtype = np.int64)
+
+# Code of a step by 3*(dy+1) + dx+1, 8 for no step
+_CODES = np.array([3, 2, 1, 4, 8, 0, 5, 6, 7], dtype = np.uint8)
+
+def indexType():
+    """ Returns the dtype of one index record """
+    return np.dtype([
+        ("offset", "<i8"),
+        ("length", "<i4"),
+        ("start", "<i4", (2,)),
+    ])
+
+def _integer(points):
+    """ Returns the points as int64 array, rounding float points """
+    points = np.asarray(points)
+    if points.dtype.kind not in "iu":
+        points = np.rint(points)
+    return points.astype(np.int64, copy = False)
+
+def _stepCodes(steps):
+    """ Returns the codes of (dx, dy) steps """
+    if len(steps) and (steps.min() < -1 or steps.max() > 1):
+        raise ValueError("consecutive points of the path are not neighbours")
+    codes = _CODES[3*steps[:,1] + steps[:,0] + 4]
+    if np.any(codes == 8):
+        raise ValueError("the path repeats points")
+    return codes
+
+def encode(path):
+    """ Returns the start point (x, y) and the uint8 chain codes of the (N, 2)
+        integer path of (x, y) points, eg. Pathfinder.getPath(). Raises a
+        ValueError if two consecutive points are not 8-connected neighbours.
+    """
+    path = _integer(path).reshape(-1, 2)
+    if len(path) == 0:
+        raise ValueError("the path is empty")
+    return path[0], _stepCodes(np.diff(path, axis = 0))
+
+def encodeMany(paths):
+    """ Encodes many paths at once and returns the (M, 2) start points, the
+        concatenated codes and their offsets, see decodeMany()
+    """
+    paths = [np.asarray(path).reshape(-1, 2) for path in paths]
+    lengths = np.array([len(path) for path in paths], dtype = np.int64)
+    if np.any(lengths == 0):
+        raise ValueError("a path is empty")
+    offsets = np.zeros(len(paths)+1, dtype = np.int64)
+    np.cumsum(lengths - 1, out = offsets[1:])
+    if len(paths) == 0:
+        return np.zeros((0, 2), dtype = np.int64), np.zeros(0, dtype = np.uint8), offsets
+
+    points = _integer(np.concatenate(paths))
+    first = np.cumsum(lengths) - lengths
+    # The steps within the paths, without those from one path to the next
+    within = np.ones(len(points) - 1, dtype = bool)
+    within[first[1:] - 1] = False
+    return points[first], _stepCodes(np.diff(points, axis = 0)[within]), offsets
+
+def decode(start, codes):
+    """ Returns the (N, 2) path of (x, y) points of a start point and chain
+        codes
+    """
+    path = np.empty((len(codes)+1, 2), dtype = np.int64)
+    path[0] = start
+    path[1:] = STEPS[np.asarray(codes, dtype = np.intp)]
+    return np.cumsum(path, axis = 0, out = path)
+
+def decodeMany(starts, codes, offsets):
+    """ Decodes many contours at once: starts is an (M, 2) array of start
+        points, codes the concatenated codes of all contours, where contour i
+        has the codes codes[offsets[i]:offsets[i+1]]. Returns the concatenated
+        (x, y) points and their offsets, see the geometry module.
+    """
+    starts = np.asarray(starts, dtype = np.int64).reshape(-1, 2)
+    offsets = np.asarray(offsets, dtype = np.int64)
+    lengths = np.diff(offsets) + 1
+    point_offsets = np.zeros(len(lengths)+1, dtype = np.int64)
+    np.cumsum(lengths, out = point_offsets[1:])
+
+    # The steps of all contours, with the start point in front of every one;
+    # one cumulative sum over all of them, minus the sum before every contour
+    first = point_offsets[:-1]
+    is_step = np.ones(point_offsets[-1], dtype = bool)
+    is_step[first] = False
+    points = np.empty((point_offsets[-1], 2), dtype = np.int64)
+    points[first] = starts
+    points[is_step] = STEPS[np.asarray(codes, dtype = np.intp)]
+    np.cumsum(points, axis = 0, out = points)
+    base = points[first] - starts
+    points -= np.repeat(base, lengths, axis = 0)
+    return points, point_offsets
+
+def packedSize(n):
+    """ Returns the number of bytes of n packed codes """
+    return (3*n + 7)//8
+
+def packCodes(codes, offsets = None):
+    """ Returns the codes packed into 3 bits each, as uint8 array. With
+        offsets (see decodeMany()), the codes of every contour start at a new
+        byte.
+    """
+    codes = np.asarray(codes, dtype = np.uint8)
+    bits = np.unpackbits(codes[:,np.newaxis], axis = 1)[:,5:]
+    if offsets is None:
+        return np.packbits(bits.ravel())
+
+    lengths = np.diff(np.asarray(offsets, dtype = np.int64))
+    sizes = packedSize(lengths)
+    padded = np.zeros(8*sizes.sum(), dtype = np.uint8)
+    padded[_ranges(8*(np.cumsum(sizes) - sizes), 3*lengths)] = bits.ravel()
+    return np.packbits(padded)
+
+def unpackCodes(packed, n):
+    """ Returns the first n codes of packed codes """
+    bits = np.unpackbits(np.asarray(packed, dtype = np.uint8), count = 3*n).reshape(n, 3)
+    return (bits[:,0] << 2) | (bits[:,1] << 1) | bits[:,2]
+
+def _ranges(starts, lengths):
+    """ Returns the concatenated ranges starts[i] to starts[i]+lengths[i] """
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(ends - lengths - starts, lengths)
+
+class ContourStore:
+    """ Append-only store of many contours as chain codes, see the module
+        documentation.
+
+        Opened read-only, the codes and the index are memory maps of the
+        files, nothing is read before it is used. Opened with writable =
+        True, the store is created if needed and append() adds contours at
+        the end; other processes opened before see them after refresh().
+    """
+    # Never modifiy these members
+    _path = None
+    _writable = False
+    _codes = None
+    _index = None
+    _files = None
+
+    @property
+    def index(self):
+        """ Structured array with the fields offset, length (the number of
+            codes, one less than the number of points) and start
+        """
+        return self._index
+
+    @property
+    def lengths(self):
+        """ Number of points of every contour """
+        return self._index["length"] + 1
+
+    def __init__(self, path, writable = False):
+        self._path = path
+        self._writable = writable
+        header_file = os.path.join(path, HEADER)
+
+        if not os.path.exists(header_file):
+            if not writable:
+                raise IOError("no contour store at %s" % path)
+            os.makedirs(path, exist_ok = True)
+            with open(header_file, "w") as f:
+                json.dump({"version" : 1}, f)
+            for name in (CODES, INDEX):
+                open(os.path.join(path, name), "ab").close()
+
+        with open(header_file) as f:
+            header = json.load(f)
+        if header["version"] != 1:
+            raise IOError("unknown contour store version %s" % header["version"])
+
+        if writable:
+            self._truncate()
+            self._files = (open(os.path.join(path, CODES), "ab"),
+                open(os.path.join(path, INDEX), "ab"))
+        self.refresh()
+
+    def __len__(self):
+        return len(self._index)
+
+    def __getitem__(self, i):
+        """ Returns the (N, 2) path of (x, y) points of contour i """
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("contour %i out of range" % i)
+        offset, length, start = self._index[i]
+        return decode(start, unpackCodes(self._codes[offset:offset+packedSize(length)], length))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _count(self):
+        """ Returns the number of complete contours in the files """
+        return os.path.getsize(os.path.join(self._path, INDEX))//indexType().itemsize
+
+    def _truncate(self):
+        """ Removes the parts of a contour cut off by a crash while appending """
+        n = self._count()
+        index_file = os.path.join(self._path, INDEX)
+        codes_file = os.path.join(self._path, CODES)
+        end = 0
+        if n > 0:
+            index = np.fromfile(index_file, dtype = indexType(), count = n)
+            end = int(index["offset"][-1]) + packedSize(int(index["length"][-1]))
+        for file, size in ((index_file, n*indexType().itemsize), (codes_file, end)):
+            if os.path.getsize(file) != size:
+                with open(file, "rb+") as f:
+                    f.truncate(size)
+
+    def refresh(self):
+        """ Maps the files again, to see contours appended since the store was
+            opened
+        """
+        if self._files is not None:
+            for f in self._files:
+                f.flush()
+
+        n = self._count()
+        if n == 0:
+            # Empty files cannot be mapped
+            self._index = np.zeros(0, dtype = indexType())
+            self._codes = np.zeros(0, dtype = np.uint8)
+            return
+
+        self._index = np.memmap(os.path.join(self._path, INDEX), dtype = indexType(),
+            mode = "r", shape = (n,))
+        size = os.path.getsize(os.path.join(self._path, CODES))
+        self._codes = np.zeros(0, dtype = np.uint8) if size == 0 else \
+            np.memmap(os.path.join(self._path, CODES), dtype = np.uint8, mode = "r", shape = (size,))
+
+    def close(self):
+        """ Closes the files of a writable store """
+        if self._files is not None:
+            for f in self._files:
+                f.close()
+            self._files = None
+
+    def append(self, paths):
+        """ Appends a list of (N, 2) paths of (x, y) points, see encode().
+            Returns the index of the first new contour.
+        """
+        if self._files is None:
+            raise IOError("the store is not writable")
+
+        starts, codes, offsets = encodeMany(paths)
+        lengths = np.diff(offsets)
+        sizes = packedSize(lengths)
+        records = np.zeros(len(starts), dtype = indexType())
+        records["offset"] = self._files[0].tell() + np.cumsum(sizes) - sizes
+        records["length"] = lengths
+        records["start"] = starts
+
+        first = self._count()
+        # Codes first: a crash in between leaves codes without an index
+        # record, which are removed on the next writable open
+        self._files[0].write(packCodes(codes, offsets).tobytes())
+        self._files[0].flush()
+        self._files[1].write(records.tobytes())
+        self._files[1].flush()
+        self.refresh()
+        return first
+
+    def appendPathfinder(self, pathfinder):
+        """ Appends the path found by pathfinder """
+        return self.append([pathfinder.getPath()])
+
+    def paths(self, indices = None):
+        """ Decodes the contours indices (all if None) at once and returns
+            the concatenated (x, y) points and their offsets, see the
+            geometry module
+        """
+        index = self._index if indices is None else self._index[np.asarray(indices)]
+        lengths = index["length"].astype(np.int64)
+        sizes = packedSize(lengths)
+
+        # All bytes of the contours, then the first 3*length bits of each
+        data = self._codes[_ranges(index["offset"], sizes)]
+        bits = np.unpackbits(data)
+        bit_starts = 8*(np.cumsum(sizes) - sizes)
+        bits = bits[_ranges(bit_starts, 3*lengths)].reshape(-1, 3)
+        codes = (bits[:,0] << 2) | (bits[:,1] << 1) | bits[:,2]
+
+        offsets = np.zeros(len(index)+1, dtype = np.int64)
+        np.cumsum(lengths, out = offsets[1:])
+        return decodeMany(index["start"], codes, offsets)
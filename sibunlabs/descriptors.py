@@ -0,0 +1,284 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+""" An append-only store of shape descriptors (radial Fourier amplitudes) of
+    many cells, memory-mapped so that it opens instantly and can be shared
+    read-only by many processes, with a batched k-nearest-neighbour search.
+
+    A store is a directory with three files:
+
+        header.json      the number of harmonics and the metadata layout
+        descriptors.f32  one row of float32 amplitudes per cell
+        metadata.bin     one record per cell: centroid (x, y), label, name
+"""
+
+import json
+import os
+
+import numpy as np
+
+from sibunlabs import special
+
+HEADER = "header.json"
+DESCRIPTORS = "descriptors.f32"
+METADATA = "metadata.bin"
+
+NAME_LENGTH = 32
+
+def metadataType(name_length = NAME_LENGTH):
+    """ Returns the dtype of one metadata record """
+    return np.dtype([
+        ("centroid", "<f8", (2,)),
+        ("label", "<i8"),
+        ("name", "S%i" % name_length),
+    ])
+
+def describe(pathfinder, harmonics, normalize = False):
+    """ Returns the descriptor of the path found by pathfinder, the first
+        harmonics amplitudes cj of special.rfaBatch() of its radial path,
+        resampled to max(2*harmonics, 360) angles like sibunlabs-batch and
+        features.features(), and its centroid (x, y). If normalize is True,
+        the amplitudes are divided by c0, the mean radius, which makes the
+        descriptor independent of the size of the cell.
+    """
+    radial_path = pathfinder.getRadialPath()
+    cj, phij = special.rfaBatch([radial_path[:,0]], [radial_path[:,1]],
+        n_angles = max(2*harmonics, 360))
+
+    descriptor = np.zeros(harmonics, dtype = np.float32)
+    n = min(harmonics, cj.shape[1])
+    descriptor[:n] = cj[0,:n]
+    if normalize and descriptor[0] > 0:
+        descriptor /= descriptor[0]
+
+    return descriptor, pathfinder.getCentroid()
+
+class DescriptorStore:
+    """ Append-only store of fixed length float32 descriptors and the
+        metadata of every cell, see the module documentation.
+
+        Opened read-only, descriptors and metadata are memory maps of the
+        files, nothing is read before it is used. Opened with writable = True,
+        the store is created if needed (harmonics is then required) and
+        append() adds cells at the end; other processes opened before see
+        them after refresh().
+    """
+    # Never modifiy these members
+    _path = None
+    _harmonics = None
+    _meta_dtype = None
+    _writable = False
+    _descriptors = None
+    _metadata = None
+    _files = None
+
+    # The following members are okay to modify
+    # Number of distances calculated at once by query(), divided among the
+    # query vectors
+    chunk_size = 1 << 22
+
+    @property
+    def harmonics(self): return self._harmonics
+
+    @property
+    def descriptors(self):
+        """ (N, harmonics) float32 array of all descriptors """
+        return self._descriptors
+
+    @property
+    def metadata(self):
+        """ Structured array with the fields centroid, label and name """
+        return self._metadata
+
+    def __init__(self, path, harmonics = None, writable = False):
+        self._path = path
+        self._writable = writable
+        header_file = os.path.join(path, HEADER)
+
+        if not os.path.exists(header_file):
+            if not writable:
+                raise IOError("no descriptor store at %s" % path)
+            if harmonics is None:
+                raise ValueError("harmonics is required to create a store")
+            os.makedirs(path, exist_ok = True)
+            header = {"version" : 1, "harmonics" : int(harmonics), "name_length" : NAME_LENGTH}
+            with open(header_file, "w") as f:
+                json.dump(header, f)
+            for name in (DESCRIPTORS, METADATA):
+                open(os.path.join(path, name), "ab").close()
+
+        with open(header_file) as f:
+            header = json.load(f)
+        if harmonics is not None and harmonics != header["harmonics"]:
+            raise ValueError("the store has %i harmonics" % header["harmonics"])
+        self._harmonics = header["harmonics"]
+        self._meta_dtype = metadataType(header["name_length"])
+
+        if writable:
+            self._truncate()
+            self._files = (open(os.path.join(path, DESCRIPTORS), "ab"),
+                open(os.path.join(path, METADATA), "ab"))
+        self.refresh()
+
+    def __len__(self):
+        return len(self._descriptors)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _count(self):
+        """ Returns the number of complete cells in the files """
+        row = 4*self._harmonics
+        return min(os.path.getsize(os.path.join(self._path, DESCRIPTORS))//row,
+            os.path.getsize(os.path.join(self._path, METADATA))//self._meta_dtype.itemsize)
+
+    def _truncate(self):
+        """ Removes the parts of a cell cut off by a crash while appending """
+        n = self._count()
+        for name, size in ((DESCRIPTORS, 4*self._harmonics), (METADATA, self._meta_dtype.itemsize)):
+            file = os.path.join(self._path, name)
+            if os.path.getsize(file) != n*size:
+                with open(file, "rb+") as f:
+                    f.truncate(n*size)
+
+    def refresh(self):
+        """ Maps the files again, to see cells appended since the store was
+            opened
+        """
+        if self._files is not None:
+            for f in self._files:
+                f.flush()
+
+        n = self._count()
+        if n == 0:
+            # Empty files cannot be mapped
+            self._descriptors = np.zeros((0, self._harmonics), dtype = np.float32)
+            self._metadata = np.zeros(0, dtype = self._meta_dtype)
+            return
+
+        self._descriptors = np.memmap(os.path.join(self._path, DESCRIPTORS), dtype = "<f4",
+            mode = "r", shape = (n, self._harmonics))
+        self._metadata = np.memmap(os.path.join(self._path, METADATA), dtype = self._meta_dtype,
+            mode = "r", shape = (n,))
+
+    def close(self):
+        """ Closes the files of a writable store """
+        if self._files is not None:
+            for f in self._files:
+                f.close()
+            self._files = None
+
+    def append(self, descriptors, centroids = None, labels = None, names = None):
+        """ Appends cells to the store. descriptors is one descriptor or an
+            (n, harmonics) array (longer descriptors, eg. the complete cj of
+            special.rfa(), are cut off). centroids, labels and names are
+            optional sequences with one entry per cell; missing centroids are
+            NaN, missing labels -1. Returns the index of the first new cell.
+        """
+        if self._files is None:
+            raise IOError("the store is not writable")
+
+        descriptors = np.atleast_2d(np.asarray(descriptors, dtype = np.float32))
+        n = len(descriptors)
+        if descriptors.shape[1] < self._harmonics:
+            raise ValueError("descriptors need at least %i harmonics" % self._harmonics)
+
+        records = np.zeros(n, dtype = self._meta_dtype)
+        records["centroid"] = np.nan if centroids is None else np.reshape(centroids, (n, 2))
+        records["label"] = -1 if labels is None else labels
+        if names is not None:
+            records["name"] = [str(name).encode("utf-8")[:self._meta_dtype["name"].itemsize] for name in names]
+
+        first = self._count()
+        # Descriptors first: a crash in between leaves a cell without metadata,
+        # which is not counted and removed on the next writable open
+        self._files[0].write(np.ascontiguousarray(descriptors[:,:self._harmonics], dtype = "<f4").tobytes())
+        self._files[0].flush()
+        self._files[1].write(records.tobytes())
+        self._files[1].flush()
+        self.refresh()
+        return first
+
+    def appendPathfinder(self, pathfinder, label = -1, name = "", normalize = False):
+        """ Appends the cell found by pathfinder, see describe() """
+        descriptor, centroid = describe(pathfinder, self._harmonics, normalize = normalize)
+        return self.append(descriptor, [centroid], [label], [name])
+
+    def query(self, vectors, k = 5):
+        """ Returns the k nearest stored descriptors (euclidean distance) of
+            every vector as two (len(vectors), k) arrays: the distances in
+            ascending order and the indices into the store. The store is read
+            chunk by chunk, it is never loaded into memory as a whole. If the
+            store has less than k cells, k is reduced.
+        """
+        vectors = np.atleast_2d(np.asarray(vectors, dtype = np.float32))[:,:self._harmonics]
+        m = len(vectors)
+        n = len(self)
+        k = min(k, n)
+
+        best_d = np.full((m, k), np.inf, dtype = np.float32)
+        best_i = np.zeros((m, k), dtype = np.int64)
+        # Rank by |b|^2 - 2ab, the squared distance |a - b|^2 without the
+        # constant |a|^2 of every query vector, using a matrix product
+        scaled = -2*vectors
+        rows = np.arange(m)[:,np.newaxis]
+
+        # Keep the distance matrix of one chunk at about chunk_size values
+        step = max(self.chunk_size//max(m, 1), k+1)
+        for start in range(0, n, step):
+            chunk = np.asarray(self._descriptors[start:start+step])
+            d = scaled.dot(chunk.T)
+            d += (chunk**2).sum(axis = 1)
+
+            if start == 0:
+                # The k nearest of the first chunk
+                if d.shape[1] > k:
+                    i = np.argpartition(d, k-1, axis = 1)[:,:k]
+                else:
+                    i = np.broadcast_to(np.arange(k), (m, k))
+                best_d = d[rows, i]
+                best_i = i.astype(np.int64)
+                continue
+
+            # Only distances below the k-th best so far can change the result;
+            # after the first chunks these are very few
+            found = np.flatnonzero(d < best_d.max(axis = 1)[:,np.newaxis])
+            if len(found) == 0:
+                continue
+            r, c = np.divmod(found, d.shape[1])
+            all_r = np.concatenate((np.repeat(np.arange(m), k), r))
+            all_d = np.concatenate((best_d.ravel(), d[r, c]))
+            all_i = np.concatenate((best_i.ravel(), c + start))
+            order = np.lexsort((all_d, all_r))
+            # The first k of every row, the rows are sorted
+            counts = np.bincount(all_r, minlength = m)
+            rank = np.arange(len(order)) - np.repeat(np.cumsum(counts) - counts, counts)
+            keep = order[rank < k]
+            best_d = all_d[keep].reshape(m, k)
+            best_i = all_i[keep].reshape(m, k)
+
+        if k == 0:
+            return np.zeros((m, 0)), best_i
+
+        # The expansion above loses precision for close vectors, so calculate
+        # the distances of the found neighbours again
+        difference = self._descriptors[best_i.ravel()].reshape(m, k, -1).astype(np.float64) - \
+            vectors[:,np.newaxis,:]
+        distances = np.sqrt((difference**2).sum(axis = 2))
+        order = np.argsort(distances, axis = 1, kind = "stable")
+        return distances[rows, order], best_i[rows, order]
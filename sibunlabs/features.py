@@ -0,0 +1,175 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Shape features of many contours at once, computed with segmented numpy
+    reductions over the concatenated points instead of a Python loop per
+    cell. The result is a table (numpy structured array) with one row per
+    contour, see featureType().
+
+    Contours are given like in the geometry module, as a list of (N, 2)
+    paths of (x, y) points (eg. Pathfinder.getPath()) or as concatenated
+    points and offsets (eg. chaincode.ContourStore.paths()).
+"""
+
+import numpy as np
+
+from sibunlabs import geometry, special
+
+# Columns without the harmonics
+COLUMNS = (
+    "points", "perimeter", "area", "circularity", "centroid_x", "centroid_y",
+    "x_min", "y_min", "x_max", "y_max", "mu20", "mu11", "mu02",
+    "major_axis", "minor_axis", "eccentricity", "orientation",
+    "r_mean", "r_std", "r_min", "r_max",
+)
+
+def featureType(harmonics = 0):
+    """ Returns the dtype of one row of the feature table: the columns of
+        COLUMNS, followed by the amplitudes c0, c1, ... and phases phi0,
+        phi1, ... of the first harmonics harmonics of special.rfaBatch()
+    """
+    fields = [(name, "<i8" if name == "points" else "<f8") for name in COLUMNS]
+    fields += [("c%i" % j, "<f8") for j in range(harmonics)]
+    fields += [("phi%i" % j, "<f8") for j in range(harmonics)]
+    return np.dtype(fields)
+
+def features(paths, offsets = None, harmonics = 0, n_angles = None, chunk_size = 1 << 20):
+    """ Returns the feature table of the contours given by paths (a list of
+        paths) or by paths and offsets (concatenated points).
+
+        points is the number of points, perimeter, area and the line centroid
+        are those of the geometry module (the centroid is the one of
+        Pathfinder.getCentroid()) and circularity is 4*pi*area/perimeter**2.
+        mu20, mu11 and mu02 are the second central moments of the enclosed
+        area, major_axis and minor_axis the axis lengths of the ellipse with
+        the same moments, and orientation the angle of its major axis against
+        the x axis in radians. The r columns are statistics of the distances
+        of the points to the centroid.
+
+        With harmonics > 0, the radial profiles are analysed with
+        special.rfaBatch() on n_angles uniform angles (by default
+        max(2*harmonics, 360), like sibunlabs-batch). Missing harmonics of
+        short contours are NaN.
+
+        The contours are processed in chunks of about chunk_size points, to
+        limit the memory used for intermediate results.
+    """
+    if offsets is None:
+        coords, offsets = geometry.concatenatePaths(paths)
+    else:
+        coords = np.asarray(paths).reshape(-1, 2)
+        offsets = np.asarray(offsets, dtype = np.int64)
+    n = len(offsets) - 1
+
+    table = np.zeros(n, dtype = featureType(harmonics))
+    if n == 0:
+        return table
+    if np.diff(offsets).min() < 1:
+        raise ValueError("every contour needs at least one point")
+    if n_angles is None:
+        n_angles = max(2*harmonics, 360)
+
+    # The first contour of every chunk
+    bounds = np.unique(np.searchsorted(offsets, np.arange(0, offsets[-1], chunk_size), side = "right") - 1)
+    bounds = np.append(bounds, n)
+    for a, b in zip(bounds[:-1], bounds[1:]):
+        chunk_offsets = offsets[a:b+1] - offsets[a]
+        chunk = np.asarray(coords[offsets[a]:offsets[b]], dtype = np.float64)
+        _features(table[a:b], chunk, chunk_offsets, harmonics, n_angles)
+    return table
+
+def _features(table, coords, offsets, harmonics, n_angles):
+    """ Fills the rows of table with the features of the contours given by
+        coords and offsets (every contour with at least one point)
+    """
+    first = offsets[:-1]
+    last = offsets[1:] - 1
+    lengths = np.diff(offsets)
+    table["points"] = lengths
+
+    def total(values):
+        # Sum of values per contour, the contours are contiguous
+        return np.add.reduceat(values, first)
+
+    # Shift every contour to its first point, for precision
+    p = coords - np.repeat(coords[first], lengths, axis = 0)
+    # The following point of every point, the first one after the last one
+    q = np.empty_like(p)
+    q[:-1] = p[1:]
+    q[last] = p[first]
+
+    d = np.hypot(q[:,0] - p[:,0], q[:,1] - p[:,1])
+    cross = p[:,0]*q[:,1] - q[:,0]*p[:,1]
+    perimeter = total(d)
+    signed_area = total(cross)/2
+    area = np.abs(signed_area)
+    table["perimeter"] = perimeter
+    table["area"] = area
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        table["circularity"] = 4*np.pi*area/perimeter**2
+
+    # The line centroid like geometry.lineCentroid(), the mean of the points
+    # for contours of length 0
+    s = p + q
+    centroid = np.column_stack((total(s[:,0]*d), total(s[:,1]*d)))
+    degenerated = perimeter == 0
+    centroid[~degenerated] /= 2*perimeter[~degenerated,np.newaxis]
+    if degenerated.any():
+        mean = np.column_stack((total(p[:,0]), total(p[:,1])))/lengths[:,np.newaxis]
+        centroid[degenerated] = mean[degenerated]
+    table["centroid_x"] = centroid[:,0] + coords[first,0]
+    table["centroid_y"] = centroid[:,1] + coords[first,1]
+
+    table["x_min"], table["y_min"] = np.minimum.reduceat(coords, first, axis = 0).T
+    table["x_max"], table["y_max"] = np.maximum.reduceat(coords, first, axis = 0).T
+
+    # Second moments of the area (Green's theorem) around the area centroid
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        A = signed_area
+        cx = total(s[:,0]*cross)/(6*A)
+        cy = total(s[:,1]*cross)/(6*A)
+        mu20 = total((p[:,0]**2 + p[:,0]*q[:,0] + q[:,0]**2)*cross)/(12*A) - cx**2
+        mu02 = total((p[:,1]**2 + p[:,1]*q[:,1] + q[:,1]**2)*cross)/(12*A) - cy**2
+        mu11 = total((2*p[:,0]*p[:,1] + p[:,0]*q[:,1] + q[:,0]*p[:,1] + 2*q[:,0]*q[:,1])*cross)/(24*A) - cx*cy
+    flat = A == 0
+    for name, m in (("mu20", mu20), ("mu11", mu11), ("mu02", mu02)):
+        m[flat] = np.nan
+        table[name] = m
+
+    # The ellipse of the same second moments has the semi-axes 2*sqrt(l)
+    # of the eigenvalues l of the moment matrix
+    mean = (mu20 + mu02)/2
+    spread = np.hypot((mu20 - mu02)/2, mu11)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        table["major_axis"] = 4*np.sqrt(mean + spread)
+        table["minor_axis"] = 4*np.sqrt(np.maximum(mean - spread, 0))
+        table["eccentricity"] = np.sqrt(2*spread/(mean + spread))
+    table["orientation"] = np.arctan2(2*mu11, mu20 - mu02)/2
+
+    dp = p - np.repeat(centroid, lengths, axis = 0)
+    r = np.hypot(dp[:,0], dp[:,1])
+    r_mean = total(r)/lengths
+    table["r_mean"] = r_mean
+    table["r_std"] = np.sqrt(total((r - np.repeat(r_mean, lengths))**2)/lengths)
+    table["r_min"] = np.minimum.reduceat(r, first)
+    table["r_max"] = np.maximum.reduceat(r, first)
+
+    if harmonics > 0:
+        # The angles of Pathfinder.getRadialPath()
+        phi = np.arctan2(dp[:,0], dp[:,1])*(-180/np.pi) + 180
+        cj, phij = special.rfaBatch(r, phi, n_angles = n_angles, offsets = offsets)
+        for j in range(harmonics):
+            table["c%i" % j] = cj[:,j] if j < cj.shape[1] else np.nan
+            table["phi%i" % j] = phij[:,j] if j < phij.shape[1] else np.nan
@@ -0,0 +1,194 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import cv2
+
+from sibunlabs import geometry
+from sibunlabs.pathfinder import Pathfinder, PathfinderException
+
+class Cell:
+    """ A cell found in a field of view. path is an (N, 2) integer array of
+        (x, y) points in image coordinates, like Pathfinder.getPath(), and
+        report is the report of its trace ("OK" for a closed path).
+    """
+    def __init__(self, label, bbox, path, report):
+        self.label = label
+        self.bbox = bbox
+        self.path = path
+        self.report = report
+        self.centroid = (np.nan, np.nan)
+        self.perimeter = np.nan
+        self.area = np.nan
+
+    @property
+    def closed(self): return self.report == "OK"
+
+    def __repr__(self):
+        return "<Cell %i %s at (%.1f, %.1f)>" % (self.label, self.report,
+            self.centroid[0], self.centroid[1])
+
+class Field:
+    """ Finds and traces all cells in a field of view. The Sobel filter and
+        the normalization are applied once to the whole image, then every cell
+        is traced on a crop of the shared edge map.
+    """
+    # Never modifiy these members
+    _pathfinder = None
+    _labels = None
+    _stats = None
+
+    # The following members are okay to modify
+    # Edge intensity (after normalization) used to find the cells
+    level = 0.1
+    # Radius used to close gaps in the edges of a cell before labelling
+    closing = 2
+    # Minimum width and height of a cell in pixels
+    min_size = 10
+    # Pixels added around the bounding box of a cell to get its crop
+    margin = 5
+    max_iterations = 1000
+    inflexibility = 5
+    multi_seed = False
+    bidirectional = False
+
+    @property
+    def width(self): return self._pathfinder.width
+
+    @property
+    def height(self): return self._pathfinder.height
+
+    def __init__(self, image, sobel = True):
+        self._pathfinder = Pathfinder(image, sobel = sobel)
+
+    def getEdges(self):
+        """ Returns the normalized edge map shared by all cells """
+        return self._pathfinder._image
+
+    def detect(self):
+        """ Labels the edges of the image and returns a list of (label, bbox)
+            tuples, one per cell, with bbox = (x, y, width, height). Edge
+            groups lying completely within the bounding box of a bigger one
+            (eg. structures inside of a cell) are left out.
+        """
+        binary = (self.getEdges() > self.level).astype(np.uint8)
+        if self.closing > 0:
+            size = 2*self.closing + 1
+            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+            binary = cv2.dilate(binary, kernel)
+
+        n, labels, stats, centroids = cv2.connectedComponentsWithStats(binary, connectivity = 8)
+        self._labels = labels
+        self._stats = stats
+
+        # Label 0 is the background
+        candidates = np.arange(1, n)
+        x, y, w, h = [stats[candidates, k] for k in range(4)]
+        big_enough = (w >= self.min_size) & (h >= self.min_size)
+        candidates, x, y, w, h = [a[big_enough] for a in (candidates, x, y, w, h)]
+
+        # Drop every candidate contained in the bounding box of another one
+        inside = (x[:,np.newaxis] >= x[np.newaxis,:]) & (y[:,np.newaxis] >= y[np.newaxis,:]) & \
+            (x[:,np.newaxis] + w[:,np.newaxis] <= x[np.newaxis,:] + w[np.newaxis,:]) & \
+            (y[:,np.newaxis] + h[:,np.newaxis] <= y[np.newaxis,:] + h[np.newaxis,:])
+        np.fill_diagonal(inside, False)
+        keep = ~inside.any(axis = 1)
+
+        return [(int(candidates[i]), (int(x[i]), int(y[i]), int(w[i]), int(h[i])))
+            for i in np.flatnonzero(keep)]
+
+    def trace(self, workers = None):
+        """ Detects and traces all cells and returns them as a list of Cell
+            objects. Edge pixels claimed by the other cells are masked in the
+            crop of every cell, so that neighbouring cells can not capture each
+            other, which also makes the traces independent of each other. If
+            workers is bigger than 1, the traces are spread over that many
+            processes.
+        """
+        cells = self.detect()
+        edges = self.getEdges()
+        settings = (self.max_iterations, self.inflexibility, self.multi_seed,
+            self.bidirectional, self._pathfinder._weight)
+
+        tasks = []
+        for label, bbox in cells:
+            x0, y0, w, h = bbox
+            x0, y0 = max(x0 - self.margin, 0), max(y0 - self.margin, 0)
+            x1 = min(bbox[0] + w + self.margin, self.width)
+            y1 = min(bbox[1] + h + self.margin, self.height)
+
+            crop = edges[y0:y1, x0:x1].copy()
+            claimed = self._labels[y0:y1, x0:x1]
+            crop[(claimed != 0) & (claimed != label)] = 0
+
+            seed = (bbox[0] + w//2 - x0, bbox[1] + h//2 - y0)
+            tasks.append((crop, seed, (x0, y0), settings))
+
+        if workers is not None and workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(max_workers = workers) as executor:
+                results = list(executor.map(_traceCrop, tasks,
+                    chunksize = max(1, len(tasks)//(4*workers))))
+        else:
+            results = [_traceCrop(task) for task in tasks]
+
+        found = [Cell(label, bbox, path, report)
+            for (label, bbox), (path, report) in zip(cells, results)]
+        _measure([cell for cell in found if cell.closed])
+
+        return found
+
+def _traceCrop(task):
+    """ Traces the cell in one crop of the edge map and returns its path as
+        (x, y) points in image coordinates together with the report
+    """
+    crop, seed, origin, settings = task
+    max_iterations, inflexibility, multi_seed, bidirectional, weight = settings
+
+    pathfinder = Pathfinder.fromEdges(crop)
+    pathfinder.setWeight(weight)
+    pathfinder.max_iterations = max_iterations
+    pathfinder.inflexibility = inflexibility
+    pathfinder.multi_seed = multi_seed
+    pathfinder.bidirectional = bidirectional
+    pathfinder.start_x = int(seed[0])
+    pathfinder.start_y = int(seed[1])
+
+    try:
+        pathfinder._findPath()
+    except PathfinderException:
+        pass
+
+    path = np.zeros((0, 2), dtype = np.int32)
+    if pathfinder._path is not None and len(pathfinder._path) > 0:
+        path = pathfinder._path[:,::-1] + np.array(origin, dtype = np.int32)
+
+    return path, pathfinder._report
+
+def _measure(cells):
+    """ Calculates centroid, perimeter and area of all cells at once """
+    if len(cells) == 0:
+        return
+
+    coords, offsets = geometry.concatenatePaths([cell.path for cell in cells])
+    centroids = geometry.lineCentroid(coords, offsets)
+    perimeters = geometry.perimeter(coords, offsets)
+    areas = geometry.area(coords, offsets)
+
+    for i, cell in enumerate(cells):
+        cell.centroid = (centroids[i,0], centroids[i,1])
+        cell.perimeter = perimeters[i]
+        cell.area = areas[i]
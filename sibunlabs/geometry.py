@@ -0,0 +1,119 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Vectorized geometry of closed paths.
+
+    Every function takes either a single path as an (N, 2) array, or many
+    paths as their concatenated (M, 2) coordinates together with an offsets
+    array, where path i consists of coords[offsets[i]:offsets[i+1]]. The
+    closing segment from the last to the first point is always included. The
+    order of the two coordinate columns does not matter, results are returned
+    in the same order.
+"""
+
+import numpy as np
+
+def concatenatePaths(paths):
+    """ Concatenates a list of (N, 2) paths and returns the coordinates
+        together with the offsets of every path
+    """
+    offsets = np.zeros(len(paths)+1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in paths])
+    if offsets[-1] == 0:
+        return np.zeros((0, 2)), offsets
+    coords = np.concatenate([np.asarray(p, dtype = np.float64).reshape(-1, 2) for p in paths])
+    return coords, offsets
+
+def _segments(coords, offsets):
+    """ Returns the coordinates, the index of the following point of every
+        point (wrapping around at the end of each path) and the path index of
+        every point
+    """
+    coords = np.asarray(coords, dtype = np.float64)
+    if offsets is None:
+        nxt = np.roll(np.arange(len(coords)), -1)
+        return coords, nxt, np.zeros(len(coords), dtype = np.int64), 1
+
+    offsets = np.asarray(offsets, dtype = np.int64)
+    lengths = np.diff(offsets)
+    n_paths = len(lengths)
+    rows = np.repeat(np.arange(n_paths), lengths)
+    nxt = np.arange(len(coords)) + 1
+    ends = offsets[1:][lengths > 0] - 1
+    nxt[ends] = offsets[:-1][lengths > 0]
+    return coords, nxt, rows, n_paths
+
+def _sum(values, rows, n_paths):
+    """ Sums up values per path """
+    return np.bincount(rows, weights = values, minlength = n_paths)
+
+def _result(values, offsets):
+    """ Unpacks the result of a single path """
+    if offsets is None:
+        return values[0]
+    return values
+
+def perimeter(coords, offsets = None):
+    """ Returns the length of the closed path(s) """
+    coords, nxt, rows, n_paths = _segments(coords, offsets)
+    d = np.hypot(*(coords[nxt] - coords).T)
+    return _result(_sum(d, rows, n_paths), offsets)
+
+def area(coords, offsets = None):
+    """ Returns the area enclosed by the path(s), using the shoelace formula """
+    coords, nxt, rows, n_paths = _segments(coords, offsets)
+    cross = coords[:,0]*coords[nxt,1] - coords[nxt,0]*coords[:,1]
+    return _result(np.abs(_sum(cross, rows, n_paths))/2, offsets)
+
+def lineCentroid(coords, offsets = None):
+    """ Returns the centroid of the path(s) as a line: the midpoints of all
+        segments weighted by the segment lengths. Paths of length 0 return
+        the mean of their points.
+    """
+    coords, nxt, rows, n_paths = _segments(coords, offsets)
+    d = np.hypot(*(coords[nxt] - coords).T)
+    mid = (coords + coords[nxt])/2
+
+    L = _sum(d, rows, n_paths)
+    c = np.column_stack((_sum(mid[:,0]*d, rows, n_paths), _sum(mid[:,1]*d, rows, n_paths)))
+
+    degenerated = L == 0
+    c[~degenerated] /= L[~degenerated,np.newaxis]
+
+    # Fall back to the mean of the points for degenerated paths
+    if degenerated.any():
+        n = np.maximum(np.bincount(rows, minlength = n_paths), 1)
+        mean = np.column_stack((_sum(coords[:,0], rows, n_paths), _sum(coords[:,1], rows, n_paths)))
+        c[degenerated] = mean[degenerated]/n[degenerated,np.newaxis]
+
+    return _result(c, offsets)
+
+def polygonCentroid(coords, offsets = None):
+    """ Returns the centroid of the area enclosed by the path(s), using the
+        shoelace formula. Paths enclosing no area return their line centroid.
+    """
+    coords, nxt, rows, n_paths = _segments(coords, offsets)
+    cross = coords[:,0]*coords[nxt,1] - coords[nxt,0]*coords[:,1]
+    s = coords + coords[nxt]
+
+    A = _sum(cross, rows, n_paths)/2
+    c = np.column_stack((_sum(s[:,0]*cross, rows, n_paths), _sum(s[:,1]*cross, rows, n_paths)))
+
+    flat = A == 0
+    c[~flat] /= 6*A[~flat,np.newaxis]
+    if flat.any():
+        c[flat] = np.atleast_2d(lineCentroid(coords, offsets))[flat]
+
+    return _result(c, offsets)
@@ -13,14 +13,72 @@
 #   You should have received a copy of the GNU Lesser General Public License
 #   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
 
+import time
+from contextlib import contextmanager
+
 import numpy as np
-import cv2
+try:
+    import cv2
+except ImportError:
+    # The edge map is then calculated with numpy (slower)
+    cv2 = None
+
+from sibunlabs import geometry
+from sibunlabs.cache import contentHash
+
+# Sobel kernels of derivative order 0 (smoothing) and 1
+_SOBEL_KERNELS = ((1, 2, 1), (-1, 0, 1))
+
+# Reports of a path search stopped by a limit of Pathfinder.trace()
+LIMIT_REPORTS = ("deadline", "budget", "radius")
+
+def sobel(im, x = 0, y = 0, out = None):
+    """ Applies the 3x3 sobel filter in x,y direction and returns the float32
+        result, using cv2 or, if it is not installed, numpySobel()
+    """
+    if cv2 is None:
+        return numpySobel(im, x, y, out = out)
+    return cv2.Sobel(im, cv2.CV_32F, x, y, dst = out)
+
+def numpySobel(im, x = 0, y = 0, out = None):
+    """ Same as cv2.Sobel(im, cv2.CV_32F, x, y) with derivative orders x, y
+        of 0 or 1, including the border handling of cv2 (reflected without
+        repeating the border pixel)
+    """
+    if x not in (0, 1) or y not in (0, 1):
+        raise ValueError("numpySobel supports derivative orders 0 and 1")
+    padded = np.pad(np.asarray(im, dtype = np.float32), 1, mode = "reflect")
+    height, width = padded.shape[0]-2, padded.shape[1]-2
+
+    # The kernel is separable: filter in y direction, then in x direction
+    rows = None
+    for i, k in enumerate(_SOBEL_KERNELS[y]):
+        if k != 0:
+            term = k*padded[i:i+height]
+            rows = term if rows is None else rows + term
+    if out is None:
+        out = np.empty((height, width), dtype = np.float32)
+    out[:] = 0
+    for i, k in enumerate(_SOBEL_KERNELS[x]):
+        if k != 0:
+            out += k*rows[:,i:i+width]
+    return out
+
+def thresholdToZero(im, threshold):
+    """ Sets all values of the float32 array im not above threshold to 0, in
+        place (cv2.THRESH_TOZERO)
+    """
+    if cv2 is None or not im.flags.c_contiguous:
+        im[im <= threshold] = 0
+    else:
+        cv2.threshold(im, threshold, 1.0, cv2.THRESH_TOZERO, dst = im)
+    return im
 
 def absSobel(im, x = 0, y = 0):
     """ Applies the sobel filter in x,y direction and returns the absolute
         value
     """
-    return abs(cv2.Sobel(im, cv2.CV_32F, x, y))
+    return abs(sobel(im, x, y))
 
 def absSobelX(im):
     """ Applies the sobel filter in x-direction and returns the absolute value
@@ -32,6 +90,120 @@ def absSobelY(im):
     """
     return absSobel(im, y=1)
 
+def edgeRange(im, step = 1):
+    """ Returns the (min, max) tuple of absSobelX(im) + absSobelY(im), which is
+        used to normalize the edge map. With step > 1, only every step-th row
+        and column (leaving out the border) is evaluated, which gives a cheap
+        estimate of the range.
+    """
+    if step <= 1:
+        im = np.asarray(im, dtype = np.float32)
+        edges = absSobelX(im) + absSobelY(im)
+        return edges.min(), edges.max()
+
+    im = np.asarray(im)
+    height, width = im.shape
+    ys = np.arange(1, height-1, step)
+    xs = np.arange(1, width-1, step)
+
+    def at(dy, dx):
+        return im[np.ix_(ys+dy, xs+dx)].astype(np.float32)
+
+    gx = at(-1, 1) + 2*at(0, 1) + at(1, 1) - at(-1, -1) - 2*at(0, -1) - at(1, -1)
+    gy = at(1, -1) + 2*at(1, 0) + at(1, 1) - at(-1, -1) - 2*at(-1, 0) - at(-1, 1)
+    edges = abs(gx) + abs(gy)
+    return edges.min(), edges.max()
+
+def quantizeEdges(edges, dtype, levels = None, out = None, scratch = None):
+    """ Returns the normalized edge map edges (values from 0 to 1) scaled to
+        the range of the unsigned integer dtype (uint8 or uint16) and rounded
+        down. Zeros stay zeros and all values above the threshold of
+        Pathfinder._normalize() stay above zero.
+
+        levels is the range of the edge map before the normalization. If it
+        was integer (as for integer images) and fits into dtype, every step
+        of it is mapped to the same integer step instead, which keeps equal
+        edges and sums of edges equal and so gives the same paths as the
+        float32 edge map. scratch can be a float32 array of the shape of
+        edges used for intermediate results.
+    """
+    maximum = np.iinfo(dtype).max
+    if out is None:
+        out = np.empty(edges.shape, dtype = dtype)
+
+    if levels is not None and levels == int(levels) and 0 < levels <= maximum:
+        if scratch is None:
+            scratch = np.empty(edges.shape, dtype = np.float32)
+        np.multiply(edges, np.float32(levels), out = scratch)
+        rounded = np.rint(scratch, out = out, casting = "unsafe")
+        # The edges are steps of 1/levels if rounding changed almost nothing
+        np.subtract(scratch, rounded, out = scratch)
+        if np.abs(scratch).max() < 1e-2:
+            np.multiply(out, maximum//int(levels), out = out, casting = "unsafe")
+            return out
+
+    np.multiply(edges, maximum, out = out, casting = "unsafe")
+    return out
+
+def whitenessType(dtype, weight):
+    """ Returns the dtype of the whiteness field of an edge map of dtype: an
+        integer type for integer edge maps and weights (the whiteness is then
+        not divided by the weight count, which does not change its order),
+        float64 otherwise
+    """
+    if np.dtype(dtype).kind != "u" or not np.array_equal(weight, np.rint(weight)):
+        return np.dtype(np.float64)
+    if np.iinfo(dtype).max*np.abs(weight).sum() < 2**31:
+        return np.dtype(np.int32)
+    return np.dtype(np.int64)
+
+def whitenessField(im, weight, weightcount, out = None, scratch = None):
+    """ Calculates the whiteness of every point of im at once and returns it as
+        an array of the same shape and of whitenessType(). Points whose weight
+        window contains a 0 get a whiteness of 0, points too close to the
+        border to fit the window are left at 0.
+
+        out can be an array of the shape of im and of whitenessType() to store
+        the result in, scratch a tuple of such an array and two bool arrays of
+        that shape used for intermediate results. If both are given, nothing
+        gets allocated.
+    """
+    height, width = im.shape
+    ry, rx = weight.shape[0]//2, weight.shape[1]//2
+    dtype = whitenessType(im.dtype, weight)
+    integer = dtype.kind == "i"
+    if integer:
+        weight = np.rint(weight).astype(dtype)
+    if out is None:
+        out = np.zeros(im.shape, dtype = dtype)
+    else:
+        out[...] = 0
+    if height <= 2*ry or width <= 2*rx:
+        return out
+
+    inner_shape = (height-2*ry, width-2*rx)
+    if scratch is None:
+        scratch = (np.empty(inner_shape, dtype = dtype), np.empty(inner_shape, dtype = bool),
+            np.empty(inner_shape, dtype = bool))
+    tmp, zeros, is_zero = [a[:inner_shape[0], :inner_shape[1]] for a in scratch]
+
+    # Accumulate the weighted window by shifting the image once per weight
+    inner = out[ry:height-ry, rx:width-rx]
+    zeros[...] = False
+    for dy in range(weight.shape[0]):
+        for dx in range(weight.shape[1]):
+            window = im[dy:dy+height-2*ry, dx:dx+width-2*rx]
+            np.equal(window, 0, out = is_zero)
+            np.logical_or(zeros, is_zero, out = zeros)
+            if weight[dy, dx] != 0:
+                np.multiply(window, weight[dy, dx], out = tmp)
+                if not integer:
+                    np.divide(tmp, weightcount, out = tmp)
+                np.add(inner, tmp, out = inner)
+    inner[zeros] = 0
+
+    return out
+
 def isAdjacent(point_A, point_B):
     """ Tests if point_A is adjacent to point_B """
     if abs(point_A[0] - point_B[0]) <= 1 and abs(point_A[1] - point_B[1]) <= 1:
@@ -49,6 +221,8 @@ class Pathfinder:
     _shape = (None, None)
     _path = None
     _centroid = None
+    _seed = None
+    _report = None
 
     _start_x = None
     _start_y = None
@@ -58,6 +232,20 @@ class Pathfinder:
 
     _weight = None
     _weightcount = 1
+    _integer_weight = None
+    _whiteness = None
+
+    _buffers = None
+    _stores = None
+
+    _lazy = False
+    _raw = None
+    _edge_dtype = None
+    _edge_levels = None
+    _cache_key = None
+    _edge_range = None
+    _edge_tiles = None
+    _whiteness_tiles = None
 
     DIRECTION_UP = 0
     DIRECTION_UPRIGHT = 1
@@ -68,9 +256,51 @@ class Pathfinder:
     DIRECTION_LEFT = 6
     DIRECTION_UPLEFT = 7
 
+    # Direction of a path by [sign(y_diff)+1][sign(x_diff)+1][bucket] of its
+    # last points, with bucket 0 if |x_diff| > 2|y_diff| (mostly horizontal),
+    # 2 if |y_diff| > 2|x_diff| (mostly vertical) and 1 otherwise (diagonal)
+    _DIRECTIONS = (
+        ((6, 7, 0), (0, 0, 0), (2, 1, 0)), # up
+        ((6, 6, 6), (4, 4, 4), (2, 2, 2)), # neither up nor down
+        ((6, 5, 4), (4, 4, 4), (2, 3, 4)), # down
+    )
+    # (y, x) offsets of the three candidates for the next point by direction
+    _CANDIDATES = (
+        ((-1, -1), (-1, 0), (-1, 1)), # up: top-left, top, top-right
+        ((-1, 0), (-1, 1), (0, 1)), # up-right: top, top-right, right
+        ((-1, 1), (0, 1), (1, 1)), # right: top-right, right, bottom-right
+        ((0, 1), (1, 1), (1, 0)), # down-right: right, bottom-right, bottom
+        ((1, 1), (1, 0), (1, -1)), # down: bottom-right, bottom, bottom-left
+        ((1, 0), (1, -1), (0, -1)), # down-left: bottom, bottom-left, left
+        ((1, -1), (0, -1), (-1, -1)), # left: bottom-left, left, top-left
+        ((0, -1), (-1, -1), (-1, 0)), # up-left: left, top-left, top
+    )
+    # (min y, max y, min x, max x) of the candidate offsets by direction
+    _EXTENTS = tuple((min(y for y, x in c), max(y for y, x in c),
+        min(x for y, x in c), max(x for y, x in c)) for c in _CANDIDATES)
+    # Default direction of the start points north, east, south and west
+    _DEFAULT_DIRECTIONS = (2, 4, 6, 0)
+
     # The following members are okay to modify
     max_iterations = 1000
     inflexibility = 5
+    # If True, the whiteness is calculated once per tile of the image reached
+    # by the path search (see tile_size) instead of on every step
+    precompute_whiteness = True
+    # If True, the path is traced from all four start points at once and the
+    # best one is kept, instead of only tracing from the west start point
+    multi_seed = False
+    # If True, the path is traced in both directions from the start point at
+    # once until the two halves meet, instead of tracing in one direction and
+    # tracing again in the other one after a self bite
+    bidirectional = False
+    # A PathfinderStats object collecting timings and counters, or None
+    stats = None
+    # Size of the tiles in which the whiteness field and, in lazy mode, the
+    # edge map are calculated, has to be set before the path search
+    tile_size = 64
+    # A cache.Cache object storing edge maps and paths, or None
+    cache = None
 
     @property
     def width(self): return self._shape[1]
@@ -97,26 +327,189 @@ class Pathfinder:
     def start_y(self, value):
         if isinstance(value, int) == False:
             raise ValueError("value must be an valid integer")
-        if value >= self.width:
+        if value >= self.height:
             raise ValueError("value must be within the image boundaries")
 
         self._start_y = value
 
-    def __init__(self, image, sobel = True):
+    def __init__(self, image, sobel = True, lazy = False, edge_range = None, stats = None, cache = None,
+        edge_dtype = np.float32):
         """ Converts the image given by the argument image and converts it to a
-            numpy array with dtype = float64. """
-        self._image = np.array(image, dtype = np.float32)
+            numpy array with dtype = float64.
 
-        shape = self._image.shape
-        if len(shape) != 2:
-            raise ValueError("image has to be a 2-dimensional image")
-        self._shape = shape
+            If lazy is True, the edge map is not calculated for the whole image
+            at once, but tile by tile whenever the path search reaches a new
+            region. The image is then normalized with edge_range, a (min, max)
+            tuple as returned by edgeRange(). If edge_range is not given, it is
+            estimated from every 4th row and column of the image.
 
-        if sobel:
-            self.applySobel()
+            stats can be a PathfinderStats object to record the time spent in
+            every stage and some counters of the path search.
+
+            cache can be a cache.Cache object: the edge map is then taken from
+            the cache if the same image was filtered before, and so is the
+            path if it was searched with the same parameters. It is not used
+            in lazy mode.
+
+            edge_dtype can be np.uint8 or np.uint16 to store the edge map in 1
+            or 2 instead of 4 bytes per pixel (see quantizeEdges()). The
+            whiteness is then calculated with integers as well.
+        """
+        self.stats = stats
+        self.cache = cache
+        edge_dtype = np.dtype(edge_dtype)
+        if edge_dtype != np.float32:
+            if edge_dtype not in (np.uint8, np.uint16):
+                raise ValueError("edge_dtype must be float32, uint8 or uint16")
+            if not sobel:
+                raise ValueError("edge_dtype needs sobel = True")
+            self._edge_dtype = edge_dtype
+        if lazy:
+            if not sobel:
+                raise ValueError("lazy mode needs sobel = True")
+            raw = np.asarray(image)
+            self._setImage(np.zeros(raw.shape, dtype = self._edge_dtype or np.float32))
+            self._raw = raw
+            self._lazy = True
+            if edge_range is None:
+                edge_range = edgeRange(raw, step = 4)
+            self._edge_range = (np.float32(edge_range[0]), np.float32(edge_range[1]))
+        else:
+            self._setImage(np.array(image, dtype = np.float32))
+            self._loadEdges(sobel)
 
         self._setDefaultWeight()
 
+    @classmethod
+    def fromEdges(cls, edges):
+        """ Creates a Pathfinder working on an already calculated edge map (eg,
+            the _image of another Pathfinder after applySobel()). The edge map
+            is used as it is, without copying it if it is a float32, uint8 or
+            uint16 array (see quantizeEdges()), and is only read during the
+            path search.
+        """
+        pathfinder = cls.__new__(cls)
+        edges = np.asarray(edges)
+        if edges.dtype in (np.uint8, np.uint16):
+            pathfinder._edge_dtype = edges.dtype
+        else:
+            edges = np.asarray(edges, dtype = np.float32)
+        pathfinder._setImage(edges)
+        pathfinder._setDefaultWeight()
+        return pathfinder
+
+    def reset(self, image, sobel = True):
+        """ Replaces the image by another one of the same shape and forgets the
+            found path, reusing the image array and all buffers of the
+            preprocessing and the path search. Use it to process a stream of
+            images with one Pathfinder without allocating any image sized
+            arrays per image.
+        """
+        if self._lazy:
+            raise ValueError("reset is not supported in lazy mode")
+        image = np.asarray(image)
+        if image.shape != self._shape:
+            raise ValueError("image must have the shape %s" % (self._shape,))
+
+        if self._buffers is None:
+            # The current image might be shared (fromEdges), so start with own
+            # buffers
+            if self._edge_dtype is None:
+                self._image = np.empty(self._shape, dtype = np.float32)
+            self._buffers = {}
+            self._stores = {}
+        if self._edge_dtype is not None:
+            # Filter in a float32 buffer, then quantize into another one
+            self._image = self._buffer("image")
+        np.copyto(self._image, image, casting = 'unsafe')
+
+        self._path = None
+        self._centroid = None
+        self._seed = None
+        self._report = None
+        self._whiteness = None
+
+        self._loadEdges(sobel)
+
+    def _loadEdges(self, sobel):
+        """ Applies the sobel filter to the image in _image (if sobel is True)
+            and quantizes the edge map (if _edge_dtype is set), or copies the
+            edge map from the cache
+        """
+        if self.cache is None:
+            if sobel:
+                self.applySobel()
+                self._quantize()
+            return
+
+        self._cache_key = contentHash(self._image, sobel, self._edge_dtype and self._edge_dtype.str)
+        if not sobel:
+            return
+        edges = self.cache.getEdges(self._cache_key)
+        if edges is None:
+            self.applySobel()
+            self._quantize()
+            self.cache.putEdges(self._cache_key, self._image)
+        else:
+            if self.stats is not None:
+                self.stats.count("edge_cache_hits")
+            if self._buffers is None:
+                # The memory-mapped edge map is only read
+                self._image = edges
+            elif self._edge_dtype is None:
+                np.copyto(self._image, edges)
+            else:
+                self._image = self._buffer("quantized", self._edge_dtype)
+                np.copyto(self._image, edges)
+
+    def _quantize(self):
+        """ Converts the normalized edge map to _edge_dtype, if it is set """
+        if self._edge_dtype is None:
+            return
+        if self._buffers is None:
+            out = scratch = None
+        else:
+            out = self._buffer("quantized", self._edge_dtype)
+            scratch = self._buffer("scratch_quantize")
+        self._image = quantizeEdges(self._image, self._edge_dtype, levels = self._edge_levels,
+            out = out, scratch = scratch)
+
+    def _pathKey(self):
+        """ Returns the cache key of the path, which depends on the edge map
+            and the parameters of the path search
+        """
+        return contentHash(np.asarray(self._weight), self._cache_key, self._image.dtype.str, self.max_iterations,
+            self.inflexibility, self.multi_seed, self.bidirectional, self.start_x, self.start_y)
+
+    def _buffer(self, name, dtype = np.float32):
+        """ Returns the reusable image sized buffer name (reset mode only) """
+        if name not in self._buffers:
+            self._buffers[name] = np.empty(self._shape, dtype = dtype)
+        return self._buffers[name]
+
+    def _newPathStore(self, key, capacity, points):
+        """ Returns a PathStore containing points. After reset() was used, the
+            stores are kept and reused by key.
+        """
+        if self._stores is None:
+            return PathStore(self._shape, capacity, points)
+
+        if key not in self._stores:
+            self._stores[key] = PathStore(self._shape, capacity)
+        store = self._stores[key]
+        store.clear()
+        for point in points:
+            store.append(point)
+        return store
+
+    def _setImage(self, image):
+        """ Sets the image array and its shape """
+        shape = image.shape
+        if len(shape) != 2:
+            raise ValueError("image has to be a 2-dimensional image")
+        self._image = image
+        self._shape = shape
+
     def _setDefaultWeight(self):
         """ Sets the default weight to a useful size """
         self.setWeight(np.array([
@@ -138,6 +531,19 @@ class Pathfinder:
 
         self._weight = weight
         self._weightcount = self.calcWeightcount(weight)
+        self._whiteness = None
+        self._selectWhiteness()
+
+    def _selectWhiteness(self):
+        """ Chooses how _getWhiteness calculates the whiteness of a point for
+            the current edge map and weight, so that it is not decided on
+            every call: with _integer_weight for integer edge maps (see
+            whitenessType()), or with floats if it is None
+        """
+        if whitenessType(self._image.dtype, self._weight).kind == "i":
+            self._integer_weight = np.rint(self._weight).astype(np.int64)
+        else:
+            self._integer_weight = None
 
     def calcWeightcount(self, weight_matrix):
         """ Calculates how many actual weights are contained in the array. 0s
@@ -153,8 +559,112 @@ class Pathfinder:
         """ Applies the sobel filter in x and in y direction to the image and
             then normalizes the image
         """
-        self._image =  absSobelX(self._image) + absSobelY(self._image)
-        self._normalize()
+        with self._timed("preprocessing"):
+            if self._lazy:
+                # Calculate the whole edge map at once
+                self._ensureEdges(0, self.height, 0, self.width)
+                return
+
+            if self._buffers is None:
+                self._image =  absSobelX(self._image) + absSobelY(self._image)
+            else:
+                # Same as above, but in place
+                sobel_x = self._buffer("sobel_x")
+                sobel_y = self._buffer("sobel_y")
+                sobel(self._image, 1, 0, out = sobel_x)
+                sobel(self._image, 0, 1, out = sobel_y)
+                np.abs(sobel_x, out = sobel_x)
+                np.abs(sobel_y, out = sobel_y)
+                np.add(sobel_x, sobel_y, out = self._image)
+            self._normalize()
+            self._whiteness = None
+
+    def _timed(self, stage):
+        """ Returns a context manager recording the time spent in stage, if
+            stats are collected
+        """
+        if self.stats is None:
+            return _NOT_TIMED
+        return self.stats.timed(stage)
+
+    def _prepareWhiteness(self):
+        """ Allocates the whiteness field used by _getWhiteness for the current
+            image and weight. It gets calculated tile by tile whenever the
+            path search reaches a new tile, so only the tiles along the path
+            are calculated.
+        """
+        dtype = whitenessType(self._image.dtype, self._weight)
+        with self._timed("whiteness"):
+            if self._buffers is not None:
+                # Tiles are written before they are read
+                self._whiteness = self._buffer("whiteness_" + dtype.str, dtype)
+            else:
+                self._whiteness = np.zeros(self._shape, dtype = dtype)
+            self._whiteness_tiles = np.zeros(self._tileGrid(), dtype = bool)
+
+    def _tileGrid(self):
+        """ Returns the number of tiles in y and x direction """
+        t = self.tile_size
+        return (-(-self.height//t), -(-self.width//t))
+
+    def _ensureEdges(self, y0, y1, x0, x1):
+        """ Makes sure that the edge map is calculated for the region
+            [y0:y1, x0:x1] (lazy mode only)
+        """
+        if self._edge_tiles is None:
+            self._edge_tiles = np.zeros(self._tileGrid(), dtype = bool)
+
+        t = self.tile_size
+        y0, x0 = max(y0, 0), max(x0, 0)
+        y1, x1 = min(y1, self.height), min(x1, self.width)
+        for ty in range(y0//t, -(-y1//t)):
+            for tx in range(x0//t, -(-x1//t)):
+                if not self._edge_tiles[ty, tx]:
+                    self._computeEdgeTile(ty, tx)
+
+    def _computeEdgeTile(self, ty, tx):
+        """ Calculates and normalizes the edge map of one tile """
+        t = self.tile_size
+        y0, x0 = ty*t, tx*t
+        y1, x1 = min(y0+t, self.height), min(x0+t, self.width)
+
+        # Add one pixel around the tile for the sobel filter, unless the tile
+        # is at the border of the image
+        ya, xa = max(y0-1, 0), max(x0-1, 0)
+        yb, xb = min(y1+1, self.height), min(x1+1, self.width)
+        sub = np.array(self._raw[ya:yb, xa:xb], dtype = np.float32)
+        edges = absSobelX(sub) + absSobelY(sub)
+        edges = edges[y0-ya:y0-ya+y1-y0, x0-xa:x0-xa+x1-x0]
+
+        lo, hi = self._edge_range
+        edges -= lo
+        edges /= (hi - lo)
+        thresholdToZero(edges, 0.02)
+
+        if self._edge_dtype is None:
+            self._image[y0:y1, x0:x1] = edges
+        else:
+            # The estimated edge_range can be exceeded
+            np.minimum(edges, 1, out = edges)
+            quantizeEdges(edges, self._edge_dtype, out = self._image[y0:y1, x0:x1])
+        self._edge_tiles[ty, tx] = True
+
+    def _computeWhitenessTile(self, ty, tx):
+        """ Calculates the whiteness field of one tile """
+        t = self.tile_size
+        ry, rx = self._weight.shape[0]//2, self._weight.shape[1]//2
+        y0, x0 = ty*t, tx*t
+        y1, x1 = min(y0+t, self.height), min(x0+t, self.width)
+
+        # The weight window reaches over the border of the tile
+        ya, xa = max(y0-ry, 0), max(x0-rx, 0)
+        yb, xb = min(y1+ry, self.height), min(x1+rx, self.width)
+        if self._lazy:
+            self._ensureEdges(ya, yb, xa, xb)
+
+        field = whitenessField(self._image[ya:yb, xa:xb], self._weight, self._weightcount)
+        self._whiteness[y0:y1, x0:x1] = field[y0-ya:y0-ya+y1-y0, x0-xa:x0-xa+x1-x0]
+        self._whiteness_tiles[ty, tx] = True
 
     def getPath(self, centered = False):
         """ Returns a list of (x,y) integer points describing the path found by
@@ -182,26 +692,7 @@ class Pathfinder:
             returns an (y, x) array with its coordinates as floats.
         """
         if self._centroid is None:
-            a = (0,0)
-            N = self._path.shape[0]
-            L = 0
-            for i in range(0, N):
-                pm = self._path[i-1]
-                p0 = self._path[i]
-                try:
-                    pp = self._path[i+1]
-                except IndexError:
-                    pp = self._path[0]
-                dm = calculateDistance(pm, p0)
-                di = calculateDistance(p0, pp)
-                x = a[0] + p0[0]*(dm)
-                y = a[1] + p0[1]*(di)
-                a = (y, x)
-                L = L + di
-
-            a = np.array(a)
-            c = a*1/(L)
-            self._centroid = c
+            self._centroid = geometry.lineCentroid(self._path)
 
         return self._centroid
 
@@ -232,12 +723,77 @@ class Pathfinder:
     def _normalize(self):
         """ Normalizes the image array to have a value between 0.0 and 1.0 """
         self._image -= self._image.min()
+        self._edge_levels = float(self._image.max())
         self._image /= self._image.max()
 
-        ret, self._image = cv2.threshold(self._image, 0.02, 1.0, 3)
+        thresholdToZero(self._image, 0.02)
 
     def _findPath(self):
         """ Tries to find the path """
+        if not self._loadCachedPath():
+            self._searchPath()
+
+        if self._report == "self_bite":
+            raise NoClosedPathFound
+        elif self._report == "max_it":
+            raise MaxIterationReached
+        elif self._report == "oob":
+            raise OutOfBoundaryError
+
+    def trace(self, timeout = None, budget = None, max_radius = None):
+        """ Searches the path like getPath(), but never raises and stops as
+            soon as one of the limits is reached:
+
+            timeout     wall time of the search in seconds
+            budget      number of tracing steps of all traces together,
+                        including the reverse traces repairing a self bite
+            max_radius  distance of the contour from the cross hair (start_x,
+                        start_y or the image center) in pixels
+
+            Returns a BoundedTrace with the report of the search or the limit
+            that stopped it, the contour found so far and the stage in which
+            the search ended. The path of a stopped search is kept like the
+            path of a failed one. Bounded searches are not cached. The limits are checked
+            after every step and before tracing; the edge map and the
+            whiteness field are not interrupted (lazy mode computes only the
+            tiles the path touches).
+        """
+        t0 = time.perf_counter()
+        deadline = None if timeout is None else t0 + timeout
+        stage, steps = self._boundedSearch(deadline, budget, max_radius)
+
+        return BoundedTrace(self._report, self.getPath(), stage, steps,
+            time.perf_counter() - t0, self._seed)
+
+    def _boundedSearch(self, deadline = None, budget = None, max_radius = None):
+        """ Loads the path from the cache or searches it with the limits of
+            trace(), deadline being a time.perf_counter() value. Returns the
+            stage in which the search ended and the number of tracing steps.
+        """
+        if self._loadCachedPath():
+            return "cache", 0
+        return self._searchPath(deadline, budget, max_radius)
+
+    def _loadCachedPath(self):
+        """ Loads the path from the cache and returns True, if it is cached """
+        if self._cache_key is None:
+            return False
+
+        cached = self.cache.getPath(self._pathKey())
+        if cached is None:
+            return False
+
+        self._path, self._report, self._seed = cached
+        if self.stats is not None:
+            self.stats.count("path_cache_hits")
+        return True
+
+    def _searchPath(self, deadline = None, budget = None, max_radius = None):
+        """ Searches the path and sets _path, _report and _seed. deadline is a
+            time.perf_counter() value, budget and max_radius are the limits of
+            trace(). Returns the stage in which the search ended and the
+            number of tracing steps.
+        """
         # Get the "cross hair" to find the starting point. If not changed, the
         # image center is used.
         if self.start_x == None:
@@ -250,233 +806,396 @@ class Pathfinder:
         else:
             start_y = self.start_y
 
+        self._selectWhiteness()
+
         # Search possibles start points
-        startpoints = self._searchStartpoint(start_x, start_y)
-
-        # path storages
-        path_fragments = []
-        path_reports = []
-        for sp in startpoints:
-            path_fragments.append([sp])
-            path_reports.append(None)
-        n_frags = len(path_fragments)
-
-        # look for the path
-        j = 3
-        i = 0
-        while True:
-            try:
-                next_point = self._searchNextpoint(j, path_fragments[j])
-            except OutOfBoundaryError:
-                path_reports[j] = "oob"
-                break
-            path_fragments[j].append(next_point)
-            # Max Iteration abort condition
-            if i > self.max_iterations:
-                path_reports[j] = "max_it"
-                break
-            # Real abortion only after 10 points
-            if i > 10:
-                if next_point in path_fragments[j][:-1]:
-                    path_reports[j] = "self_bite"
+        with self._timed("startpoint"):
+            startpoints = self._searchStartpoint(start_x, start_y)
+
+        if deadline is not None and time.perf_counter() >= deadline:
+            return self._stopSearch("startpoint")
+
+        if (self.precompute_whiteness or self._lazy) and self._whiteness is None:
+            self._prepareWhiteness()
+            if deadline is not None and time.perf_counter() >= deadline:
+                return self._stopSearch("whiteness")
+
+        # look for the path, either from the west start point only or from
+        # all start points at once
+        if self.multi_seed:
+            seeds = list(range(len(startpoints)))
+        else:
+            seeds = [3]
+
+        # path storages, only for the traced start points
+        capacity = self.max_iterations + 3
+        path_fragments = dict((j, self._newPathStore(j, capacity, [startpoints[j]])) for j in seeds)
+        path_reports = dict((j, None) for j in seeds)
+
+        # Advance all traces by one step in turn. As soon as one of them is
+        # closed or a limit is reached, the others are stopped.
+        center = None if max_radius is None else (start_y, start_x, max_radius**2)
+        if self.bidirectional:
+            tracePath = self._traceBidirectional
+        else:
+            tracePath = self._tracePath
+        traces = [(j, tracePath(j, path_fragments[j], center)) for j in seeds]
+        stages = dict((j, "tracing") for j in seeds)
+        stats = self.stats
+        paths = {}
+        n_steps = 0
+        stopped = None
+        while traces and stopped is None:
+            for trace in list(traces):
+                j, steps = trace
+                # No step beyond the budget
+                if budget is not None and n_steps >= budget:
+                    stopped = "budget"
                     break
-                if isAdjacent(next_point, path_fragments[j][0]):
-                    path_reports[j] = "OK"
+                try:
+                    if stats is None:
+                        stages[j] = next(steps)
+                    else:
+                        t0 = time.perf_counter()
+                        try:
+                            stages[j] = next(steps)
+                        finally:
+                            stats.addTime(stages[j], time.perf_counter() - t0)
+                except StopIteration as stop:
+                    paths[j], path_reports[j] = stop.value
+                    traces.remove(trace)
+                    continue
+                n_steps += 1
+                if deadline is not None and time.perf_counter() >= deadline:
+                    stopped = "deadline"
                     break
-            i+=1
+            if "OK" in path_reports.values():
+                break
 
-        if path_reports[j] == "self_bite" and len(path_fragments[j]) > self.inflexibility:
-            reverse_path = [path_fragments[j][k-1] for k in range(self.inflexibility, 0, -1)]
-            i = 0
+        # The unfinished traces compete with their forward path so far, like
+        # the traces whose repair failed
+        for j, steps in traces:
+            steps.close()
+            paths[j] = path_fragments[j].toArray()
+
+        # Keep the best of the traces
+        j = max(paths, key = lambda k: (path_reports[k] == "OK", self._scorePath(paths[k])))
+        self._path = paths[j]
+        self._seed = j
+        self._report = path_reports[j]
+        # The stage of the kept trace, like its path
+        stage = stages[j]
+        if stopped is not None and self._report != "OK":
+            self._report = stopped
+        # The limits can change the result, eg. which seed wins, even if the
+        # search was not stopped
+        bounded = deadline is not None or budget is not None or max_radius is not None
+        if self._cache_key is not None and not bounded:
+            self.cache.putPath(self._pathKey(), self._path, self._report, self._seed)
+
+        if stats is not None:
+            stats.count("paths")
+            stats.count("report_%s" % self._report)
+
+        return stage, n_steps
+
+    def _stopSearch(self, stage):
+        """ Ends a search stopped by the deadline before tracing """
+        self._path = np.zeros((0, 2), dtype = np.int32)
+        self._seed = None
+        self._report = "deadline"
+        return stage, 0
+
+    def _tracePath(self, j, path_fragment, center = None):
+        """ Traces the path starting with the points in path_fragment, using the
+            default direction of start point j. This is a generator yielding
+            the name of the current stage ("tracing" or "reverse") after every
+            step, its return value is a tuple of the found path and the report
+            of the trace ("OK", "self_bite", "max_it", "oob" or "radius"). If
+            center is a tuple (y, x, squared radius), the trace is abandoned
+            as soon as it leaves that circle.
+        """
+        report = None
+        i = 0
+        # The steps are counted in finally, so a trace closed by the
+        # scheduler before it ends is counted as well
+        try:
             while True:
                 try:
-                    next_point = self._searchNextpoint(j, reverse_path)
+                    next_point = self._searchNextpoint(j, path_fragment)
                 except OutOfBoundaryError:
-                    path_reports[j] = "oob"
+                    report = "oob"
+                    break
+                bitten = next_point in path_fragment
+                path_fragment.append(next_point)
+                # Abandon a trace leaving the radius around the cross hair
+                if center is not None and (next_point[0] - center[0])**2 + \
+                    (next_point[1] - center[1])**2 > center[2]:
+                    report = "radius"
                     break
-                reverse_path.append(next_point)
                 # Max Iteration abort condition
                 if i > self.max_iterations:
-                    path_reports[j] = "max_it"
+                    report = "max_it"
                     break
                 # Real abortion only after 10 points
                 if i > 10:
-                    if next_point in reverse_path[j]:
-                        path_reports[j] = "self_bite"
+                    if bitten:
+                        report = "self_bite"
+                        break
+                    if isAdjacent(next_point, path_fragment[0]):
+                        report = "OK"
                         break
-                    if next_point in path_fragments[j]:
-                        path_reports[j] = "OK"
-                        new_path = []
-                        for p in path_fragments[j]:
-                            if p == next_point:
-                                break
-                            new_path.append(p)
-                        for k in range(len(reverse_path), 0, -1):
-                            p = reverse_path[k-1]
-                            if p == path_fragments[0]:
-                                break
-                            new_path.append(p)
-                        path_fragments[j] = new_path
                 i+=1
-
-        self._path = np.array(path_fragments[j])
-
-        if path_reports[j] == "self_bite":
-            raise NoClosedPathFound
-        elif path_fragments[j] == "max_it":
-            raise MaxIterationReached
-        elif path_fragments[j] == "oob":
-            raise OutOfBoundaryError
-
-    def _searchNextpoint(self, d, path):
-        # Get newest point
-        yi, xi = path[-1]
-
-        # Get the default direction
-        if d == 0:
-            default_direction = self.DIRECTION_RIGHT
-        elif d == 1:
-            default_direction = self.DIRECTION_DOWN
-        elif d == 2:
-            default_direction = self.DIRECTION_LEFT
+                yield "tracing"
+        finally:
+            if self.stats is not None:
+                self._countSteps("steps", len(path_fragment) - 1, report)
+
+        path = path_fragment.toArray()
+
+        if report == "self_bite" and len(path_fragment) > self.inflexibility:
+            # Trace again from the start point, but in the other direction. The
+            # first points of the reverse path are the first points of the
+            # path in reversed order, ending with the start point.
+            reverse_path = self._newPathStore(("reverse", j), self.max_iterations + 3,
+                [path_fragment[k-1] for k in range(self.inflexibility, 0, -1)])
+            i = 0
+            try:
+                while True:
+                    try:
+                        next_point = self._searchNextpoint(j, reverse_path)
+                    except OutOfBoundaryError:
+                        report = "oob"
+                        break
+                    bitten = next_point in reverse_path
+                    reverse_path.append(next_point)
+                    # Abandon a trace leaving the radius around the cross hair
+                    if center is not None and (next_point[0] - center[0])**2 + \
+                        (next_point[1] - center[1])**2 > center[2]:
+                        report = "radius"
+                        break
+                    # Max Iteration abort condition
+                    if i > self.max_iterations:
+                        report = "max_it"
+                        break
+                    # Real abortion only after 10 points
+                    if i > 10:
+                        if bitten:
+                            report = "self_bite"
+                            break
+                        if next_point in path_fragment:
+                            report = "OK"
+                            # Join the path up to the meeting point with the
+                            # reversed reverse path, leaving out the start point
+                            k = path_fragment.index(next_point)
+                            path = np.concatenate((
+                                path_fragment[:k],
+                                reverse_path[self.inflexibility:][::-1]
+                            ))
+                            break
+                    i+=1
+                    yield "reverse"
+            finally:
+                if self.stats is not None:
+                    self.stats.count("reverse_repairs")
+                    self._countSteps("reverse_steps", len(reverse_path) - self.inflexibility, report)
+
+        return path, report
+
+    def _traceBidirectional(self, j, path_fragment, center = None):
+        """ Traces the path from the start point in path_fragment in both
+            directions, one step each in turn: forward with the default
+            direction of start point j and backward with the opposite one. The
+            backward half shares the labels of path_fragment with negative
+            indices, so a step reaching the other half is found by one lookup
+            and the path is closed by joining the forward half with the
+            reversed backward half. A half which fails ("self_bite", "oob" or
+            "radius") stops, while the other one goes on and can still meet
+            it. max_iterations limits the steps of both halves together.
+
+            Like _tracePath, this is a generator yielding "tracing" after every
+            step and returning the found path and the report. The path of a
+            failed trace is the open chain from the end of the backward half
+            through the start point to the end of the forward half.
+        """
+        backward = PathStore(None, self.max_iterations + 3, path_fragment[:1],
+            labels = path_fragment._labels, sign = -1)
+        halves = (path_fragment, backward)
+        default_direction = self._DEFAULT_DIRECTIONS[j]
+        directions = (default_direction, (default_direction + 4) % 8)
+        start = path_fragment[0]
+        reports = [None, None]
+        report = None
+        path = None
+        i = 0
+        try:
+            while path is None and None in reports:
+                for h in (0, 1):
+                    if reports[h] is not None:
+                        continue
+                    half = halves[h]
+                    try:
+                        next_point = self._searchNextpoint(j, half, directions[h])
+                    except OutOfBoundaryError:
+                        reports[h] = report = "oob"
+                        continue
+                    # Abandon a half leaving the radius around the cross hair
+                    if center is not None and (next_point[0] - center[0])**2 + \
+                        (next_point[1] - center[1])**2 > center[2]:
+                        reports[h] = report = "radius"
+                        continue
+                    # Real abortion only after 10 points
+                    if len(half) > 11:
+                        label = half.label(next_point)
+                        if label > 0:
+                            reports[h] = report = "self_bite"
+                            continue
+                        if label < 0:
+                            # Met the other half at its point -label - 1
+                            report = "OK"
+                            if h == 0:
+                                path = np.concatenate((path_fragment[:], backward[1:-label][::-1]))
+                            else:
+                                path = np.concatenate((path_fragment[:-label], backward[1:][::-1]))
+                            break
+                        if isAdjacent(next_point, start):
+                            # Closed without the other half
+                            report = "OK"
+                            half.append(next_point)
+                            if h == 0:
+                                path = path_fragment.toArray()
+                            else:
+                                path = np.concatenate((backward[:1], backward[1:][::-1]))
+                            break
+                    half.append(next_point)
+                    # Max Iteration abort condition
+                    i += 1
+                    if i > self.max_iterations:
+                        reports = ["max_it", "max_it"]
+                        report = "max_it"
+                        break
+                    yield "tracing"
+
+            if path is None:
+                path = np.concatenate((backward[1:][::-1], path_fragment[:]))
+        finally:
+            # Also count the steps of a trace closed by the scheduler
+            if self.stats is not None:
+                self._countSteps("steps", i, report)
+            # Remove the labels of the backward half from the shared grid
+            backward.clear()
+
+        return path, report
+
+    def _countSteps(self, name, steps, report):
+        """ Counts the steps of one stage of a trace and how it ended. The
+            report is None for a trace stopped before its end.
+        """
+        self.stats.count(name, steps)
+        # Every step evaluates three candidates, so does an aborted step
+        self.stats.count("whiteness_evaluations", 3*(steps + (report == "oob")))
+        if report not in ("OK", None):
+            self.stats.count(report)
+
+    def _scorePath(self, path):
+        """ Returns the mean whiteness of the points of path, used to rank the
+            paths found from different start points
+        """
+        if len(path) == 0:
+            return 0.0
+        if self.precompute_whiteness or self._lazy:
+            if self._whiteness is None:
+                self._prepareWhiteness()
+            if self._whiteness_tiles is not None:
+                t = self.tile_size
+                for ty, tx in set(zip(path[:,0]//t, path[:,1]//t)):
+                    if not self._whiteness_tiles[ty, tx]:
+                        self._computeWhitenessTile(ty, tx)
+            return self._whiteness[path[:,0], path[:,1]].mean()
+
+        whiteness = []
+        for p in path:
+            try:
+                whiteness.append(self._getWhiteness(y = p[0], x = p[1]))
+            except OutOfBoundaryError:
+                whiteness.append(0.0)
+        return np.mean(whiteness)
+
+    def _searchNextpoint(self, d, path, default_direction = None):
+        """ Returns the next (y, x) point of path, the whitest of the three
+            candidates in the direction of the path. If several candidates are
+            equally white, the last one wins. d is the index of the start
+            point, whose default direction is used for short paths unless
+            default_direction is given.
+        """
+        if default_direction is None:
+            default_direction = self._DEFAULT_DIRECTIONS[d]
+        direction, yi, xi = self._getDirection(path, default_direction)
+        (ya, xa), (yb, xb), (yc, xc) = self._CANDIDATES[direction]
+        ya += yi; yb += yi; yc += yi
+        xa += xi; xb += xi; xc += xi
+
+        # All candidates lie within the extents of the direction around the
+        # newest point; only if one of them is out of bounds, let
+        # _getWhiteness raise the error
+        y0, y1, x0, x1 = self._EXTENTS[direction]
+        r = self._weight.shape[0]//2
+        if yi + y0 < r or yi + y1 >= self.height - r - 1 or \
+            xi + x0 < r or xi + x1 >= self.width - r - 1:
+            for y, x in ((ya, xa), (yb, xb), (yc, xc)):
+                self._getWhiteness(x = x, y = y)
+
+        if self.precompute_whiteness or self._lazy:
+            if self._whiteness is None:
+                self._prepareWhiteness()
+            if self._whiteness_tiles is not None:
+                t = self.tile_size
+                for y, x in ((ya, xa), (yb, xb), (yc, xc)):
+                    if not self._whiteness_tiles[y//t, x//t]:
+                        self._computeWhitenessTile(y//t, x//t)
+            whiteness = self._whiteness
+            a = whiteness[ya, xa]
+            b = whiteness[yb, xb]
+            c = whiteness[yc, xc]
         else:
-            default_direction = self.DIRECTION_UP
-
-        # Get points which have to be searched in order to determine the direction
-        directionMask, direction = self._getDirectionMask(path, default_direction = default_direction)
-
-        # Calculate the whiteness of those points
-        whitesearch_intensities = []
-        for point in directionMask:
-            whitesearch_intensities.append(self._getWhiteness(y=point[0], x=point[1]))
-
-        # Get the most white point
-        maxwhite = max(whitesearch_intensities)
-
-        # Get the actual point by the biggest intensity (the whitest point)
-        nextPoint = (0, 0)
-        for i in range(0, len(directionMask)):
-            if whitesearch_intensities[i] == maxwhite:
-                nextPoint = directionMask[i]
-
-        #print(path[-1], self._getWhiteness(y=path[-1][0], x=path[-1][1]), directionMask, direction)
-
-        # Return next point
-        return nextPoint
-
-    def _getDirectionMask(self, path, default_direction = None):
+            a = self._getWhiteness(x = xa, y = ya)
+            b = self._getWhiteness(x = xb, y = yb)
+            c = self._getWhiteness(x = xc, y = yc)
+
+        # The last of the whitest candidates
+        if c >= a and c >= b:
+            return (yc, xc)
+        elif b >= a:
+            return (yb, xb)
+        return (ya, xa)
+
+    def _getDirection(self, path, default_direction = None):
+        """ Returns the direction of path and its newest point as a tuple
+            (direction, y, x). The direction is looked up from the signs and
+            the slope of the last inflexibility points, or is default_direction
+            for shorter paths.
+        """
         if default_direction is None:
             default_direction = self.DIRECTION_UP
 
-        # Calculate direction or use default direction
-        if len(path) >= self.inflexibility:
-            # Get the last 10 points
-            slopseq = path[-self.inflexibility:]
-            # Get difference in y and x direction
-            y_diff = slopseq[-1][0] - slopseq[0][0]
-            x_diff = slopseq[-1][1] - slopseq[0][1]
-            # Get direction
-            if x_diff == 0:
-                if y_diff < 0:
-                    direction = self.DIRECTION_UP
-                else:
-                    direction = self.DIRECTION_DOWN
-            elif y_diff == 0:
-                if x_diff > 0:
-                    direction = self.DIRECTION_RIGHT
-                else:
-                    direction = self.DIRECTION_LEFT
-            else:
-                s = y_diff/x_diff
-                if x_diff > 0 and y_diff < 0:
-                    # s is negative
-                    if s < -2:
-                        direction = self.DIRECTION_UP
-                    elif s >= -2 and s <= -0.5:
-                        direction = self.DIRECTION_UPRIGHT
-                    else:
-                        direction = self.DIRECTION_RIGHT
-                elif x_diff > 0 and y_diff > 0:
-                    # s is positive
-                    if s < 0.5:
-                        direction = self.DIRECTION_RIGHT
-                    elif s >= 0.5 and s <= 2:
-                        direction = self.DIRECTION_DOWNRIGHT
-                    else:
-                        direction = self.DIRECTION_DOWN
-                elif x_diff < 0 and y_diff > 0:
-                    # s is negative
-                    if s < -2:
-                        direction = self.DIRECTION_DOWN
-                    elif s >= -2 and s <= -0.5:
-                        direction = self.DIRECTION_DOWNLEFT
-                    else:
-                        direction = self.DIRECTION_LEFT
-                else:
-                    # s is positive again
-                    if s < 0.5:
-                        direction = self.DIRECTION_LEFT
-                    elif s >= 0.5 and s <= 2:
-                        direction = self.DIRECTION_UPLEFT
-                    else:
-                        direction = self.DIRECTION_UP
+        if len(path) < self.inflexibility:
+            yi, xi = path[-1].tolist()
+            return default_direction, yi, xi
+
+        points = path[-self.inflexibility:].tolist()
+        yi, xi = points[-1]
+        y_diff = yi - points[0][0]
+        x_diff = xi - points[0][1]
+        a = abs(x_diff)
+        b = abs(y_diff)
+        if b > 2*a:
+            bucket = 2
+        elif 2*b < a:
+            bucket = 0
         else:
-            direction = default_direction
-
-
-        yi, xi = path[-1]
-
-        # Get direction mask
-        if direction == self.DIRECTION_UP:
-            blacksearch_points = [
-                (yi-1, xi-1), # top-left
-                (yi-1, xi), # top
-                (yi-1, xi+1), # top-right
-            ]
-        elif direction == self.DIRECTION_UPRIGHT:
-            blacksearch_points = [
-                (yi-1, xi), # top
-                (yi-1, xi+1), # top-right
-                (yi, xi+1), # right
-            ]
-        elif direction == self.DIRECTION_RIGHT:
-            blacksearch_points = [
-                (yi-1, xi+1), # top-right
-                (yi, xi+1), # right
-                (yi+1, xi+1), # bottom-right
-            ]
-        elif direction == self.DIRECTION_DOWNRIGHT:
-            blacksearch_points = [
-                (yi, xi+1), # right
-                (yi+1, xi+1), # bottom-right
-                (yi+1, xi), # bottom
-            ]
-        elif direction == self.DIRECTION_DOWN:
-            blacksearch_points = [
-                (yi+1, xi+1), # bottom-right
-                (yi+1, xi), # bottom
-                (yi+1, xi-1), # bottom-left
-            ]
-        elif direction == self.DIRECTION_DOWNLEFT:
-            blacksearch_points = [
-                (yi+1, xi), # bottom
-                (yi+1, xi-1), # bottom-left
-                (yi, xi-1), # left
-            ]
-        elif direction == self.DIRECTION_LEFT:
-            blacksearch_points = [
-                (yi+1, xi-1), # bottom-left
-                (yi, xi-1), # left
-                (yi-1, xi-1), # top-left
-            ]
-        elif direction == self.DIRECTION_UPLEFT:
-            blacksearch_points = [
-                (yi, xi-1), # left
-                (yi-1, xi-1), # top-left
-                (yi-1, xi), # top
-            ]
-
-        return blacksearch_points, direction
+            bucket = 1
+        direction = self._DIRECTIONS[(y_diff > 0) - (y_diff < 0) + 1][(x_diff > 0) - (x_diff < 0) + 1][bucket]
+        return direction, yi, xi
 
     def _searchStartpoint(self, start_x, start_y):
         points = {
@@ -486,6 +1205,11 @@ class Pathfinder:
             "west" : ((-1, -1), 0.0),
         }
 
+        if self._lazy:
+            # Only the cross hair is needed
+            self._ensureEdges(start_y, start_y+1, self._lim_x, self.width-self._lim_x)
+            self._ensureEdges(self._lim_y, self.height-self._lim_y, start_x, start_x+1)
+
         for d in points:
             for point in self._searchMaxPoint((start_y, start_x), direction = d):
                 whiteness = self._image[point]
@@ -505,7 +1229,7 @@ class Pathfinder:
             for x in range(start[1], self._lim_x-1, -1):
                 yield (start[0], x)
         elif direction == "east":
-            for x in range(start[0], self.width-self._lim_x, 1):
+            for x in range(start[1], self.width-self._lim_x, 1):
                 yield (start[0], x)
 
     def _getWhiteness(self, x, y):
@@ -518,6 +1242,14 @@ class Pathfinder:
         if y < weight_y_dim or y >= (self.height - weight_y_dim - 1)  or x  < weight_x_dim or x >= (self.width - weight_x_dim - 1):
             raise OutOfBoundaryError("Out of boundary: (%i,%i)" %(x,y))
 
+        if self.precompute_whiteness or self._lazy:
+            if self._whiteness is None:
+                self._prepareWhiteness()
+            if self._whiteness_tiles is not None and \
+                not self._whiteness_tiles[y//self.tile_size, x//self.tile_size]:
+                self._computeWhitenessTile(y//self.tile_size, x//self.tile_size)
+            return self._whiteness[y, x]
+
         try:
             subMatrix = (self._image[y-weight_y_dim:y+weight_y_dim+1,x-weight_x_dim:x+weight_x_dim+1])
         except IndexError:
@@ -525,10 +1257,168 @@ class Pathfinder:
         if 0 in subMatrix:
             #print("Zero!")
             r = 0
+        elif self._integer_weight is not None:
+            # Like whitenessField(), integer whiteness is not divided
+            r = (subMatrix.astype(np.int64)*self._integer_weight).sum()
         else:
             r = ((subMatrix*self._weight)/self._weightcount).sum()
         return r
 
+class PathfinderStats:
+    """ Collects the wall time spent in every stage of the path search and
+        counters like the number of steps. Pass it to one or many Pathfinder
+        objects with the stats argument; stats of several objects can also be
+        added up with + or merge().
+
+        Stages: preprocessing, whiteness, startpoint, tracing, reverse
+        Counters: steps, reverse_steps, reverse_repairs, whiteness_evaluations,
+            oob, self_bite, max_it, radius (traces ending that way), paths and
+            report_<report> (final result of every path search),
+            edge_cache_hits and path_cache_hits
+    """
+    def __init__(self):
+        self.timings = {}
+        self.counters = {}
+
+    def addTime(self, stage, seconds):
+        """ Adds seconds to the time spent in stage """
+        self.timings[stage] = self.timings.get(stage, 0.0) + seconds
+
+    def count(self, name, n = 1):
+        """ Increases the counter name by n """
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    @contextmanager
+    def timed(self, stage):
+        """ Context manager adding the time spent within to stage """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.addTime(stage, time.perf_counter() - t0)
+
+    def merge(self, other):
+        """ Adds the timings and counters of other to this object """
+        for stage, seconds in other.timings.items():
+            self.addTime(stage, seconds)
+        for name, n in other.counters.items():
+            self.count(name, n)
+        return self
+
+    def __add__(self, other):
+        return PathfinderStats().merge(self).merge(other)
+
+    def __radd__(self, other):
+        # Allows sum() over a list of stats
+        if other == 0:
+            return PathfinderStats().merge(self)
+        return NotImplemented
+
+    def __repr__(self):
+        return "PathfinderStats(timings=%r, counters=%r)" % (self.timings, self.counters)
+
+class BoundedTrace:
+    """ Result of Pathfinder.trace(). status is the report of the path search
+        ("OK", "self_bite", "max_it" or "oob") or the limit that stopped it
+        ("deadline", "budget" or "radius"), path the (x, y) points of the
+        contour found so far like Pathfinder.getPath(), stage the stage in
+        which the search ended ("cache", "startpoint", "whiteness", "tracing",
+        "reverse" or, for PyramidPathfinder, "refine"), steps the number of tracing steps, seconds the wall
+        time and seed the index of the start point of the path.
+    """
+    def __init__(self, status, path, stage, steps, seconds, seed = None):
+        self.status = status
+        self.path = path
+        self.stage = stage
+        self.steps = steps
+        self.seconds = seconds
+        self.seed = seed
+
+    @property
+    def closed(self): return self.status == "OK"
+
+    @property
+    def stopped(self): return self.status in LIMIT_REPORTS
+
+    def __repr__(self):
+        return "<BoundedTrace %s in %s after %i steps, %.4f s>" % (self.status,
+            self.stage, self.steps, self.seconds)
+
+class _NotTimed:
+    """ Context manager doing nothing, used if no stats are collected """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+_NOT_TIMED = _NotTimed()
+
+class PathStore:
+    """ Stores the (y, x) points of a path in a preallocated int32 array and
+        labels every stored point in a grid of the image size, so that testing
+        if a point is part of the path and looking up its index does not
+        depend on the length of the path. Two stores can share one grid by
+        passing labels and opposite signs; each of them labels its points
+        with its sign and only counts those as its own.
+    """
+    def __init__(self, shape, capacity, points = (), labels = None, sign = 1):
+        self._points = np.zeros((max(capacity, 1), 2), dtype = np.int32)
+        if labels is None:
+            labels = np.zeros(shape, dtype = np.int32)
+        self._labels = labels
+        self._sign = sign
+        self._length = 0
+
+        for point in points:
+            self.append(point)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, key):
+        return self._points[:self._length][key]
+
+    def __contains__(self, point):
+        return self._labels[point[0], point[1]]*self._sign > 0
+
+    def append(self, point):
+        """ Appends a point to the path. A point already contained keeps the
+            index of its first occurence, a point of the other store sharing
+            the grid keeps its label.
+        """
+        if self._length == self._points.shape[0]:
+            self._points = np.concatenate((self._points, np.zeros_like(self._points)))
+
+        self._points[self._length] = point
+        self._length += 1
+        if self._labels[point[0], point[1]] == 0:
+            self._labels[point[0], point[1]] = self._sign*self._length
+
+    def index(self, point):
+        """ Returns the index of the first occurence of point """
+        label = self._labels[point[0], point[1]]*self._sign
+        if label <= 0:
+            raise ValueError("point is not part of the path")
+        return label - 1
+
+    def label(self, point):
+        """ Returns index + 1 of point if it is part of the path, -(index + 1)
+            if it is part of the other store sharing the grid and 0 otherwise
+        """
+        return int(self._labels[point[0], point[1]])*self._sign
+
+    def toArray(self):
+        """ Returns a copy of the stored points as an (N, 2) array """
+        return self._points[:self._length].copy()
+
+    def clear(self):
+        """ Removes all points while keeping the allocated storage """
+        points = self._points[:self._length]
+        own = self._labels[points[:,0], points[:,1]]*self._sign > 0
+        self._labels[points[own,0], points[own,1]] = 0
+        self._length = 0
+
 class PathfinderException(Exception):
     pass
 
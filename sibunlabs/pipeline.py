@@ -0,0 +1,193 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Traces many images with overlapping stages: decoding and the Sobel
+    filter run in a thread pool (PIL and cv2 release the GIL), the path
+    search runs in a process pool. Bounded queues between the stages keep
+    the number of images in memory limited, whatever the number of images.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from sibunlabs import geometry
+from sibunlabs.pathfinder import Pathfinder, PathfinderException
+
+# End of the items of a queue
+_DONE = object()
+
+class TraceResult:
+    """ The result of one image of a Pipeline. index is the position of the
+        image in the sources, path the (x, y) path like Pathfinder.getPath()
+        (None if decoding failed) and report the report of the trace, or
+        "error: ..." if the image could not be processed.
+    """
+    def __init__(self, index, source, path, report, centroid = (np.nan, np.nan)):
+        self.index = index
+        self.source = source
+        self.path = path
+        self.report = report
+        self.centroid = centroid
+
+    @property
+    def closed(self): return self.report == "OK"
+
+    def __repr__(self):
+        return "<TraceResult %i %s at (%.1f, %.1f)>" % (self.index, self.report,
+            self.centroid[0], self.centroid[1])
+
+class _Failed:
+    """ Passed on by the stages instead of a value if a stage failed """
+    def __init__(self, error):
+        self.error = error
+
+class Pipeline:
+    """ Traces a stream of images with overlapping stages, see the module
+        documentation. run() is an async generator of TraceResult objects in
+        the order they are finished, trace() runs it and returns all results
+        in the order of the sources.
+
+        At most about 3*queue_size + threads + workers images are held at any
+        time.
+    """
+    # The following members are okay to modify
+    # Number of threads for decoding and filtering, and of processes for the
+    # path search (None: number of CPUs)
+    threads = None
+    workers = None
+    # Capacity of the queues between the stages
+    queue_size = 8
+    max_iterations = 1000
+    inflexibility = 5
+    multi_seed = False
+    bidirectional = False
+
+    async def run(self, sources):
+        """ Yields a TraceResult for every source, as soon as it is traced.
+            Sources are image files (read with PIL) or 2-dimensional arrays,
+            eg. the frames of a stacks.Stack.
+        """
+        loop = asyncio.get_running_loop()
+        cpus = os.cpu_count() or 1
+        threads = self.threads or cpus
+        workers = self.workers or cpus
+        settings = (self.max_iterations, self.inflexibility, self.multi_seed, self.bidirectional)
+
+        images = asyncio.Queue(self.queue_size)
+        edges = asyncio.Queue(self.queue_size)
+        traced = asyncio.Queue(self.queue_size)
+        names = {}
+
+        async def feed():
+            for index, source in enumerate(sources):
+                names[index] = source if isinstance(source, (str, os.PathLike)) else None
+                await images.put((index, source))
+
+        async def stage(function, executor, n, inbox, outbox, *args):
+            # n tasks take items from inbox and put the results into outbox
+            async def work():
+                while True:
+                    item = await inbox.get()
+                    if item is _DONE:
+                        return
+                    index, value = item
+                    if not isinstance(value, _Failed):
+                        try:
+                            value = await loop.run_in_executor(executor, function, value, *args)
+                        except Exception as e:
+                            value = _Failed(e)
+                    await outbox.put((index, value))
+            await asyncio.gather(*[work() for i in range(n)])
+
+        async def chain(stage_task, outbox, n):
+            # Tell the n tasks of the next stage that there are no more items,
+            # also if this stage failed
+            error = None
+            try:
+                await stage_task
+            except Exception as e:
+                error = e
+            for i in range(n):
+                await outbox.put(_DONE)
+            if error is not None:
+                raise error
+
+        results = asyncio.Queue(self.queue_size)
+        with ThreadPoolExecutor(threads) as thread_pool, ProcessPoolExecutor(workers) as process_pool:
+            tasks = [asyncio.ensure_future(chain(*args)) for args in (
+                (feed(), images, threads),
+                (stage(_decode, thread_pool, threads, images, edges), edges, threads),
+                (stage(_filter, thread_pool, threads, edges, traced), traced, workers),
+                (stage(_trace, process_pool, workers, traced, results, settings), results, 1),
+            )]
+
+            try:
+                while True:
+                    item = await results.get()
+                    if item is _DONE:
+                        break
+                    index, value = item
+                    yield self._result(index, names.pop(index, None), value)
+                # Raise errors of the feeding, eg. from the sources
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions = True)
+
+    def _result(self, index, source, value):
+        """ Returns the TraceResult of a traced or failed image """
+        if isinstance(value, _Failed):
+            return TraceResult(index, source, None, "error: %s" % value.error)
+        path, report = value
+        centroid = (np.nan, np.nan)
+        if len(path) > 0:
+            cy, cx = geometry.lineCentroid(path)
+            centroid = (cx, cy)
+        return TraceResult(index, source, path[:,::-1], report, centroid)
+
+    def trace(self, sources):
+        """ Runs the pipeline and returns the results in the order of sources """
+        async def collect():
+            return [result async for result in self.run(sources)]
+        return sorted(asyncio.run(collect()), key = lambda result: result.index)
+
+def _decode(source):
+    """ Returns the image of a source as a float32 array """
+    if isinstance(source, (str, os.PathLike)):
+        with Image.open(source) as im:
+            return np.array(im.convert("I"), dtype = np.float32)
+    return np.asarray(source, dtype = np.float32)
+
+def _filter(image):
+    """ Returns the normalized edge map of an image """
+    return Pathfinder(image)._image
+
+def _trace(edges, settings):
+    """ Traces the path on an edge map and returns the (y, x) path and the
+        report (runs in a worker process)
+    """
+    pathfinder = Pathfinder.fromEdges(edges)
+    pathfinder.max_iterations, pathfinder.inflexibility, pathfinder.multi_seed, \
+        pathfinder.bidirectional = settings
+    try:
+        pathfinder._findPath()
+    except PathfinderException:
+        pass
+    return pathfinder._path, pathfinder._report
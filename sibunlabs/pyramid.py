@@ -0,0 +1,268 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+import time
+
+import numpy as np
+import cv2
+
+from sibunlabs.pathfinder import Pathfinder, LIMIT_REPORTS
+
+class PyramidPathfinder(Pathfinder):
+    """ Pathfinder tracing the path coarse to fine. The path is traced on the
+        edge map of a downsampled image and then refined at every finer level
+        within a narrow band around the upsampled coarser path. The edge map
+        of the finer levels is only calculated (tile by tile) near the path.
+
+        If the trace fails on a level, the next finer level is traced instead,
+        down to the full resolution image. No full resolution edge map is
+        calculated as long as one of the downsampled levels can be traced.
+
+        getPath(), getCentroid() and getRadialPath() work like for Pathfinder.
+        _image holds the (not filtered) full resolution image.
+    """
+    # Never modifiy these members
+    _pyramid = None
+    _level_reports = None
+
+    # The following members are okay to modify
+    # Half width of the band around the upsampled path searched at every finer
+    # level, in pixels of that level
+    band = 3
+    # Sigma of the gaussian blur of the edge map of a level, if the trace on
+    # the edge map itself fails
+    smoothing = 1.0
+
+    def __init__(self, image, levels = 4, stats = None, cache = None):
+        """ Builds an image pyramid with up to levels levels. Level 0 is the
+            image itself, every further level has half the size of the
+            previous one. Levels smaller than 64 pixels are left out.
+
+            stats and cache are passed on to the Pathfinder of every level,
+            see Pathfinder.
+        """
+        self.stats = stats
+        self.cache = cache
+        self._setImage(np.array(image, dtype = np.float32))
+        self._setDefaultWeight()
+        self._buildPyramid(levels)
+
+    def _buildPyramid(self, levels):
+        """ Builds the pyramid of _image with up to levels levels """
+        self._pyramid = [self._image]
+        for level in range(1, levels):
+            if min(self._pyramid[-1].shape)//2 < 64:
+                break
+            self._pyramid.append(cv2.pyrDown(self._pyramid[-1]))
+
+    def reset(self, image, sobel = True):
+        """ Replaces the image by another one of the same shape, rebuilds the
+            pyramid with the same number of levels and forgets the found path.
+            The levels are always filtered, so sobel has to be True.
+        """
+        if not sobel:
+            raise ValueError("PyramidPathfinder always applies the sobel filter")
+        image = np.asarray(image)
+        if image.shape != self._shape:
+            raise ValueError("image must have the shape %s" % (self._shape,))
+
+        np.copyto(self._image, image, casting = 'unsafe')
+        self._buildPyramid(self.levels)
+        self._path = None
+        self._centroid = None
+        self._seed = None
+        self._report = None
+        self._level_reports = None
+
+    @property
+    def levels(self): return len(self._pyramid)
+
+    def _searchPath(self, deadline = None, budget = None, max_radius = None):
+        """ Traces the path on the coarsest possible level and refines it level
+            by level. The limits of trace() apply to all levels together;
+            max_radius is scaled to every level and the path of a search
+            stopped on a downsampled level is scaled to the full resolution.
+        """
+        self._level_reports = []
+        steps = 0
+        stage = "tracing"
+        # The last Pathfinder that searched and its level
+        searched = None
+
+        levels = range(self.levels - 1, -1, -1)
+        if budget is not None and budget <= 0:
+            self._report = "budget"
+            levels = []
+
+        for level in levels:
+            for pathfinder in self._levelPathfinders(level):
+                stage, n = pathfinder._boundedSearch(deadline,
+                    None if budget is None else budget - steps,
+                    None if max_radius is None else max_radius/2**level)
+                steps += n
+                searched = pathfinder, level
+                self._level_reports.append((level, pathfinder._report))
+                self._seed = pathfinder._seed
+                self._report = pathfinder._report
+                if self._report != "OK" and budget is not None and steps >= budget:
+                    # Nothing left for the next try
+                    self._report = "budget"
+                if self._report == "OK" or self._report in LIMIT_REPORTS:
+                    break
+            if self._report == "OK" or self._report in LIMIT_REPORTS:
+                break
+
+        if searched is None:
+            self._path = np.zeros((0, 2), dtype = np.int32)
+            self._seed = None
+            return stage, steps
+
+        pathfinder, level = searched
+        path = pathfinder._path
+        if self._report != "OK":
+            # Like Pathfinder, keep the failed path, in full resolution
+            self._path = path*2**level
+            return stage, steps
+
+        for level in range(level-1, -1, -1):
+            if deadline is not None and time.perf_counter() >= deadline:
+                self._path = path*2**(level+1)
+                self._report = "deadline"
+                return "refine", steps
+            path = self._refine(path, level)
+            self._level_reports.append((level, "refined"))
+
+        self._path = path
+        return stage, steps
+
+    def _levelPathfinders(self, level):
+        """ Yields the Pathfinder tracing the whole image of one level. For a
+            downsampled level, it then yields a second one working on the
+            smoothed edge map, which joins the close double edges a thin
+            membrane can leave after downsampling; it is used if the trace on
+            the first one fails.
+        """
+        pathfinder = self._levelPathfinder(Pathfinder(self._pyramid[level], stats = self.stats,
+            cache = self.cache), level)
+        yield pathfinder
+
+        if level > 0:
+            edges = cv2.GaussianBlur(pathfinder._image, (0, 0), self.smoothing)
+            edges /= edges.max()
+            yield self._levelPathfinder(Pathfinder.fromEdges(edges), level)
+
+    def _levelPathfinder(self, pathfinder, level):
+        """ Applies the settings of this object to the Pathfinder of one
+            level and returns it
+        """
+        scale = 2**level
+        pathfinder.stats = self.stats
+        pathfinder.setWeight(self._weight)
+        pathfinder.max_iterations = self.max_iterations
+        pathfinder.inflexibility = self.inflexibility
+        pathfinder.multi_seed = self.multi_seed
+        pathfinder.bidirectional = self.bidirectional
+        pathfinder.precompute_whiteness = self.precompute_whiteness
+        if self.start_x is not None:
+            pathfinder.start_x = int(self.start_x//scale)
+        if self.start_y is not None:
+            pathfinder.start_y = int(self.start_y//scale)
+        return pathfinder
+
+    def _refine(self, coarse_path, level):
+        """ Moves the upsampled coarse_path, the path of the next coarser
+            level, to the strongest edges of level within the band around it.
+            Returns the (y, x) path of level.
+        """
+        image = self._pyramid[level]
+        height, width = image.shape
+
+        # Only the tiles of the edge map around the path get calculated
+        pathfinder = Pathfinder(image, lazy = True, stats = self.stats)
+        pathfinder.setWeight(self._weight)
+        pathfinder._prepareWhiteness()
+
+        # pyrDown maps the pixels 2i and 2i+1 to pixel i
+        guide = connectPoints(2*coarse_path.astype(np.float64) + 0.5)
+
+        # Normals of the guide, from the direction between the points
+        # inflexibility points before and after every point
+        k = self.inflexibility
+        tangent = np.roll(guide, -k, axis = 0) - np.roll(guide, k, axis = 0)
+        tangent /= np.maximum(np.hypot(tangent[:,0], tangent[:,1]), 1e-9)[:,np.newaxis]
+        normal = np.column_stack((-tangent[:,1], tangent[:,0]))
+
+        # Candidate points along the normals, shape (points, offsets, 2)
+        offsets = np.arange(-self.band, self.band+1)
+        candidates = np.rint(guide[:,np.newaxis,:] + offsets[:,np.newaxis]*normal[:,np.newaxis,:]).astype(np.int32)
+        ry, rx = self._weight.shape[0]//2, self._weight.shape[1]//2
+        np.clip(candidates[...,0], ry, height-ry-1, out = candidates[...,0])
+        np.clip(candidates[...,1], rx, width-rx-1, out = candidates[...,1])
+
+        t = pathfinder.tile_size
+        for ty, tx in set(zip(candidates[...,0].ravel()//t, candidates[...,1].ravel()//t)):
+            pathfinder._computeWhitenessTile(ty, tx)
+        whiteness = pathfinder._whiteness[candidates[...,0], candidates[...,1]]
+
+        # Choose one candidate per point, maximizing the total whiteness while
+        # moving at most one offset from point to point
+        choice = smoothMaximum(whiteness)
+        points = candidates[np.arange(len(candidates)), choice]
+
+        return connectPoints(points).astype(np.int32)
+
+def connectPoints(points):
+    """ Returns the closed 8-connected path through the (y, x) points, filling
+        the gaps between consecutive points with straight lines and removing
+        repeated points. Float points are rounded.
+    """
+    points = np.asarray(points, dtype = np.float64)
+    following = np.roll(points, -1, axis = 0)
+    steps = np.maximum(np.abs(np.rint(following) - np.rint(points)).max(axis = 1), 1).astype(np.int64)
+
+    # Every point i contributes steps[i] points on the line to point i+1
+    index = np.repeat(np.arange(len(points)), steps)
+    t = np.arange(len(index)) - np.repeat(np.cumsum(steps) - steps, steps)
+    t = t/steps[index]
+    path = np.rint(points[index] + t[:,np.newaxis]*(following[index] - points[index]))
+
+    keep = np.any(path != np.roll(path, 1, axis = 0), axis = 1)
+    keep[0] = True
+    return path[keep]
+
+def smoothMaximum(values):
+    """ Returns the index of one column per row of values, such that
+        the indices of consecutive rows differ by at most one and the sum of
+        the chosen values is maximal (dynamic programming)
+    """
+    n, m = values.shape
+    origin = np.empty((n, m), dtype = np.int64)
+    columns = np.arange(m)
+    # Rows: the totals of the columns j-1, j and j+1
+    stacked = np.full((3, m), -np.inf)
+    total = stacked[1]
+    total[:] = values[0]
+    for i in range(1, n):
+        stacked[0,1:] = total[:-1]
+        stacked[2,:-1] = total[1:]
+        best = stacked.argmax(axis = 0)
+        origin[i] = columns + best - 1
+        total[:] = stacked[best, columns] + values[i]
+
+    choice = np.empty(n, dtype = np.int64)
+    choice[-1] = total.argmax()
+    for i in range(n-1, 0, -1):
+        choice[i-1] = origin[i, choice[i]]
+    return choice
@@ -34,4 +34,149 @@ def rfa(r, phi, phi_in_radians = False):
     cj = np.sqrt(aj**2+bj**2)
     phij = np.arctan2(bj, aj)
 
-    return cj, phij
\ No newline at end of file
+    return cj, phij
+
+def rfaBatch(r, phi = None, phi_in_radians = False, n_angles = None, offsets = None):
+    """ Radial Fourier analysis of many profiles at once, using rfft instead of
+        summing up every harmonic.
+
+        r is either a 2-dimensional array with one radial profile per row or a
+        sequence of 1-dimensional profiles of different lengths (eg. the
+        first columns of several getRadialPath() results). phi contains the
+        matching angles with the same layout, or is a 1-dimensional array
+        shared by all rows. If phi is None, the rows of r are expected to be
+        sampled at the uniform angles 2*pi*k/N, starting at 0.
+
+        Rows with uniformly spaced angles are transformed directly. Otherwise
+        all profiles are first resampled onto n_angles uniform angles (by
+        default the length of the longest profile) by periodic linear
+        interpolation.
+
+        Profiles of different lengths can also be given already concatenated:
+        r and phi are then 1-dimensional arrays and profile i consists of
+        r[offsets[i]:offsets[i+1]].
+
+        Returns two arrays cj and phij of shape (number of profiles, N//2).
+    """
+    ragged = offsets is not None or not (isinstance(r, np.ndarray) and r.ndim == 2)
+
+    if ragged:
+        if phi is None:
+            raise ValueError("phi is required for profiles of different lengths")
+        if offsets is None:
+            r_flat, offsets = _concatenate(r)
+            phi_flat, phi_offsets = _concatenate(phi)
+            if not np.array_equal(offsets, phi_offsets):
+                raise ValueError("r and phi must have the same lengths")
+        else:
+            offsets = np.asarray(offsets, dtype = np.int64)
+            r_flat = np.asarray(r, dtype = np.float64)
+            phi_flat = np.asarray(phi, dtype = np.float64)
+            if r_flat.shape != phi_flat.shape or r_flat.shape != (offsets[-1],):
+                raise ValueError("r and phi must have the lengths given by offsets")
+        if n_angles is None:
+            n_angles = np.diff(offsets).max()
+    else:
+        n, N = r.shape
+        if phi is None:
+            return _rfftAnalysis(r, np.zeros(n))
+
+        phi = np.asarray(phi, dtype = np.float64)
+        if phi.ndim == 1:
+            phi = np.broadcast_to(phi, r.shape)
+        if phi.shape != r.shape:
+            raise ValueError("r and phi must have the same shape")
+
+        if phi_in_radians == False:
+            phi = phi/180*np.pi
+
+        # Uniform angles only differ from the default ones by a phase
+        if n_angles is None or n_angles == N:
+            if N > 1 and np.allclose(np.diff(phi, axis=1), 2*np.pi/N):
+                return _rfftAnalysis(r, phi[:,0])
+            n_angles = N
+
+        r_flat = np.asarray(r, dtype = np.float64).ravel()
+        phi_flat = phi.ravel()
+        offsets = np.arange(0, n*N+1, N)
+        phi_in_radians = True
+
+    if phi_in_radians == False:
+        phi_flat = phi_flat/180*np.pi
+
+    resampled = _resampleUniform(r_flat, phi_flat, offsets, n_angles)
+    return _rfftAnalysis(resampled, np.zeros(resampled.shape[0]))
+
+def _concatenate(profiles):
+    """ Concatenates a sequence of 1-dimensional arrays and returns the values
+        together with the offsets of every array
+    """
+    profiles = [np.asarray(p, dtype = np.float64).ravel() for p in profiles]
+    offsets = np.zeros(len(profiles)+1, dtype = np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in profiles])
+    if len(profiles) == 0:
+        return np.zeros(0), offsets
+    return np.concatenate(profiles), offsets
+
+def _rfftAnalysis(r, phi0):
+    """ Calculates cj, phij for rows of r sampled at the angles
+        phi0 + 2*pi*k/N
+    """
+    N = r.shape[1]
+    k_max = N//2
+
+    F = np.fft.rfft(r, axis=1)[:,:k_max]
+    # Move the first sample from angle 0 to angle phi0
+    F *= np.exp(-1j*np.outer(phi0, np.arange(k_max)))
+
+    aj = F.real/N
+    bj = -F.imag/N
+
+    cj = np.sqrt(aj**2+bj**2)
+    phij = np.arctan2(bj, aj)
+
+    return cj, phij
+
+def _resampleUniform(r, phi, offsets, n_angles):
+    """ Resamples the concatenated profiles r(phi), delimited by offsets, onto
+        n_angles uniform angles 2*pi*k/n_angles and returns them as rows of a
+        2-dimensional array.
+    """
+    m = len(offsets)-1
+    lengths = np.diff(offsets)
+    if m == 0:
+        return np.zeros((0, n_angles))
+    if lengths.min() < 1:
+        raise ValueError("every profile needs at least one point")
+
+    # Sort the points of every profile by their angle, with the profiles
+    # shifted into their own angle ranges like for the interpolation below
+    shift = 8*np.pi
+    rows = np.repeat(np.arange(m), lengths)
+    phi = np.mod(phi, 2*np.pi)
+    order = np.argsort(phi + shift*rows, kind = "stable")
+    r = r[order]
+    phi = phi[order]
+
+    # Wrap every profile around by adding its last point in front and its
+    # first point at the end
+    first = offsets[:-1]
+    last = offsets[1:]-1
+    ext_offsets = offsets + 2*np.arange(m+1)
+    ext_r = np.empty(len(r) + 2*m)
+    ext_phi = np.empty(len(r) + 2*m)
+    body = np.arange(len(r)) + 2*rows + 1
+    ext_r[body] = r
+    ext_phi[body] = phi
+    ext_r[ext_offsets[:-1]] = r[last]
+    ext_phi[ext_offsets[:-1]] = phi[last] - 2*np.pi
+    ext_r[ext_offsets[1:]-1] = r[first]
+    ext_phi[ext_offsets[1:]-1] = phi[first] + 2*np.pi
+
+    # Interpolate all profiles in one call, in their own angle ranges
+    ext_rows = np.repeat(np.arange(m), lengths+2)
+    grid = 2*np.pi*np.arange(n_angles)/n_angles
+    x = (grid[np.newaxis,:] + shift*np.arange(m)[:,np.newaxis]).ravel()
+
+    resampled = np.interp(x, ext_phi + shift*ext_rows, ext_r)
+    return resampled.reshape(m, n_angles)
@@ -0,0 +1,263 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Frame by frame access to image stacks (time-lapse movies) too large for
+    the memory: multi-page TIFF files and raw binary stacks.
+
+    Uncompressed frames are views of a memory map of the file, no frame is
+    read before it is used and no copy is made until a Pathfinder converts it.
+    Compressed TIFF pages are decoded with PIL. frames() reads a bounded
+    number of frames ahead, so iterating over a stack of any length keeps only
+    a few frames in memory.
+"""
+
+import abc
+import mmap
+import os
+import queue
+import threading
+
+import numpy as np
+from PIL import Image
+
+# numpy dtypes of the PIL raw modes of uncompressed TIFF pages
+RAWMODES = {
+    "L" : "u1",
+    "I;16" : "<u2",
+    "I;16B" : ">u2",
+    "I;16S" : "<i2",
+    "I;16BS" : ">i2",
+    "I;32" : "<u4",
+    "I;32B" : ">u4",
+    "I;32S" : "<i4",
+    "I;32BS" : ">i4",
+    "F;32F" : "<f4",
+    "F;32BF" : ">f4",
+    "F;64F" : "<f8",
+    "F;64BF" : ">f8",
+}
+
+class Stack(abc.ABC):
+    """ Base class of the stacks. A stack has a length, frames are 2
+        dimensional arrays returned by stack[i], and iterating over it is the
+        same as frames(). Subclasses define __len__ and _frame.
+    """
+    # Never modifiy these members
+    _file = None
+    _map = None
+
+    # The following members are okay to modify
+    # Number of frames read ahead by frames()
+    read_ahead = 2
+
+    @abc.abstractmethod
+    def __len__(self):
+        """ Returns the number of frames """
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("frame %i out of range" % i)
+        return self._frame(i)
+
+    def __iter__(self):
+        return self.frames()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @abc.abstractmethod
+    def _frame(self, i):
+        """ Returns frame i """
+
+    def _region(self, i):
+        """ Returns the (offset, length) of frame i in the file if it is
+            mapped, or None if it has to be decoded
+        """
+        return None
+
+    def frames(self, start = 0, stop = None):
+        """ Yields the frames start to stop-1, reading read_ahead frames
+            ahead: mapped frames are announced to the operating system, other
+            frames are decoded by a background thread.
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        indices = range(start, stop)
+
+        if all(self._region(i) is not None for i in indices):
+            for i in indices:
+                for k in range(i+1, min(i+1+self.read_ahead, stop)):
+                    self._willNeed(*self._region(k))
+                yield self._frame(i)
+            return
+
+        # Decode in the background, at most read_ahead frames ahead
+        frames = queue.Queue(maxsize = max(self.read_ahead, 1))
+        stopped = threading.Event()
+
+        def decode():
+            for i in indices:
+                try:
+                    item = (self._frame(i), None)
+                except Exception as e:
+                    item = (None, e)
+                while not stopped.is_set():
+                    try:
+                        frames.put(item, timeout = 0.1)
+                        break
+                    except queue.Full:
+                        pass
+                if stopped.is_set() or item[1] is not None:
+                    return
+
+        thread = threading.Thread(target = decode, daemon = True)
+        thread.start()
+        try:
+            for i in indices:
+                frame, error = frames.get()
+                if error is not None:
+                    raise error
+                yield frame
+        finally:
+            stopped.set()
+            thread.join()
+
+    def _willNeed(self, offset, length):
+        """ Asks the operating system to read a region of the file ahead """
+        if self._map is None or not hasattr(self._map, "madvise"):
+            return
+        start = offset - offset % mmap.PAGESIZE
+        self._map.madvise(mmap.MADV_WILLNEED, start, offset + length - start)
+
+    def _openMap(self, path):
+        """ Maps the file path, if it is not empty """
+        self._file = open(path, "rb")
+        if os.fstat(self._file.fileno()).st_size > 0:
+            self._map = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+
+    def close(self):
+        """ Closes the file. Frames returned before are invalid afterwards. """
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                # Frames still refer to the map, it is closed with them
+                pass
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+class RawStack(Stack):
+    """ Stack of raw frames of shape (height, width) and dtype stored one after
+        another, starting offset bytes into the file
+    """
+    def __init__(self, path, shape, dtype = np.uint16, offset = 0):
+        self.path = path
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.offset = offset
+        self._frame_bytes = self.shape[0]*self.shape[1]*self.dtype.itemsize
+        self._length = max(os.path.getsize(path) - offset, 0)//self._frame_bytes
+        self._openMap(path)
+
+    def __len__(self):
+        return self._length
+
+    def _region(self, i):
+        return (self.offset + i*self._frame_bytes, self._frame_bytes)
+
+    def _frame(self, i):
+        return np.frombuffer(self._map, dtype = self.dtype, count = self.shape[0]*self.shape[1],
+            offset = self.offset + i*self._frame_bytes).reshape(self.shape)
+
+class TiffStack(Stack):
+    """ Stack of the pages of a multi-page TIFF file. Uncompressed pages with
+        one sample per pixel are mapped, all others are decoded with PIL.
+    """
+    # Never modifiy these members
+    _image = None
+    _pages = None
+    _lock = None
+
+    def __init__(self, path):
+        self.path = path
+        self._image = Image.open(path)
+        self._lock = threading.Lock()
+
+        # The layout of every page: (offset, shape, dtype) or None
+        self._pages = []
+        for i in range(getattr(self._image, "n_frames", 1)):
+            self._image.seek(i)
+            self._pages.append(self._pageLayout(self._image))
+
+        if any(page is not None for page in self._pages):
+            self._openMap(path)
+
+    def __len__(self):
+        return len(self._pages)
+
+    @staticmethod
+    def _pageLayout(image):
+        """ Returns (offset, shape, dtype) of the current page, if it is stored
+            as one uncompressed block
+        """
+        tiles = image.tile
+        if len(tiles) != 1:
+            return None
+        codec, extents, offset, args = tiles[0]
+        width, height = image.size
+        if codec != "raw" or tuple(extents) != (0, 0, width, height) or \
+            args[0] not in RAWMODES or args[1] not in (0, None) or args[2] != 1:
+            return None
+        return (offset, (height, width), np.dtype(RAWMODES[args[0]]))
+
+    def _region(self, i):
+        page = self._pages[i]
+        if page is None:
+            return None
+        offset, shape, dtype = page
+        return (offset, shape[0]*shape[1]*dtype.itemsize)
+
+    def _frame(self, i):
+        page = self._pages[i]
+        if page is not None:
+            offset, shape, dtype = page
+            return np.frombuffer(self._map, dtype = dtype, count = shape[0]*shape[1],
+                offset = offset).reshape(shape)
+
+        with self._lock:
+            self._image.seek(i)
+            return np.array(self._image)
+
+    def close(self):
+        Stack.close(self)
+        if self._image is not None:
+            self._image.close()
+            self._image = None
+
+def openStack(path, shape = None, dtype = np.uint16, offset = 0):
+    """ Opens a TIFF file as TiffStack, any other file as RawStack with the
+        given frame shape (height, width), dtype and offset
+    """
+    if path.lower().endswith((".tif", ".tiff")):
+        return TiffStack(path)
+    if shape is None:
+        raise ValueError("shape is required for raw stacks")
+    return RawStack(path, shape, dtype = dtype, offset = offset)
@@ -0,0 +1,142 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Runs many configurations of the path search on the same images, eg. to
+    choose max_iterations, inflexibility and the weight for a new microscope.
+    Every image is filtered only once, and the whiteness field of every
+    distinct weight is calculated only once per image; all configurations
+    then trace on these shared arrays. Images are distributed among worker
+    processes.
+
+    The result is a table (numpy structured array) with one row per image and
+    configuration, see RESULT_DTYPE.
+"""
+
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from sibunlabs import geometry
+from sibunlabs.pathfinder import Pathfinder, PathfinderException, whitenessField
+
+# Parameters a configuration can set, with the defaults of Pathfinder
+PARAMETERS = ("max_iterations", "inflexibility", "multi_seed", "bidirectional", "weight", "start_x", "start_y")
+
+# One row of the result table: the index of the image and of the
+# configuration, the report of the trace ("error" if the image could not be
+# loaded), the number of points of the path and its centroid (NaN if the path
+# is not closed)
+RESULT_DTYPE = np.dtype([
+    ("image", "<i4"),
+    ("configuration", "<i4"),
+    ("report", "U9"),
+    ("length", "<i4"),
+    ("centroid_x", "<f8"),
+    ("centroid_y", "<f8"),
+])
+
+def grid(**parameters):
+    """ Returns the list of configurations of all combinations of the values
+        of the parameters, eg. grid(inflexibility = [3, 5, 7],
+        max_iterations = [1000, 2000]) gives 6 configurations
+    """
+    for name in parameters:
+        if name not in PARAMETERS:
+            raise ValueError("unknown parameter %s" % name)
+    names = list(parameters)
+    return [dict(zip(names, values)) for values in itertools.product(*[parameters[name] for name in names])]
+
+def _load(image):
+    """ Returns an image file or array as float32 array """
+    if isinstance(image, (str, os.PathLike)):
+        with Image.open(image) as im:
+            return np.array(im.convert("I"), dtype = np.float32)
+    return np.asarray(image, dtype = np.float32)
+
+def _weightKey(weight):
+    weight = np.asarray(weight)
+    return (weight.shape, weight.dtype.str, weight.tobytes())
+
+def sweepImage(image, configurations, edge_dtype = np.float32):
+    """ Traces one image (file or array) with every configuration and returns
+        the rows of the result table for it, with image index 0. edge_dtype
+        is the type of the shared edge map, see Pathfinder.
+    """
+    rows = np.zeros(len(configurations), dtype = RESULT_DTYPE)
+    rows["configuration"] = np.arange(len(configurations))
+    rows["centroid_x"] = np.nan
+    rows["centroid_y"] = np.nan
+
+    try:
+        edges = Pathfinder(_load(image), edge_dtype = edge_dtype)._image
+    except (IOError, OSError, ValueError):
+        rows["report"] = "error"
+        return rows
+
+    # The whiteness fields of the weights used so far
+    fields = {}
+    for i, configuration in enumerate(configurations):
+        pathfinder = Pathfinder.fromEdges(edges)
+        for name, value in configuration.items():
+            if name not in PARAMETERS:
+                raise ValueError("unknown parameter %s" % name)
+            if name == "weight":
+                pathfinder.setWeight(np.asarray(value))
+            else:
+                setattr(pathfinder, name, value)
+
+        key = _weightKey(pathfinder._weight)
+        if key not in fields:
+            fields[key] = whitenessField(edges, pathfinder._weight, pathfinder._weightcount)
+        pathfinder._whiteness = fields[key]
+
+        try:
+            pathfinder._findPath()
+        except PathfinderException:
+            pass
+
+        path = pathfinder._path
+        rows[i]["report"] = pathfinder._report
+        rows[i]["length"] = len(path)
+        if pathfinder._report == "OK":
+            cy, cx = geometry.lineCentroid(path)
+            rows[i]["centroid_x"] = cx
+            rows[i]["centroid_y"] = cy
+
+    return rows
+
+def sweep(images, configurations, workers = None, edge_dtype = np.float32):
+    """ Traces every image (files or arrays) with every configuration (dicts
+        of PARAMETERS, eg. from grid()) and returns the result table, sorted
+        by image and configuration. workers is the number of worker
+        processes (None: number of CPUs, 1: no worker processes), edge_dtype
+        the type of the edge maps (np.uint8 or np.uint16 to save memory).
+    """
+    configurations = list(configurations)
+    if workers == 1:
+        tables = [sweepImage(image, configurations, edge_dtype) for image in images]
+    else:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            tables = list(executor.map(sweepImage, images, itertools.repeat(configurations),
+                itertools.repeat(edge_dtype)))
+
+    for index, table in enumerate(tables):
+        table["image"] = index
+    if len(tables) == 0:
+        return np.zeros(0, dtype = RESULT_DTYPE)
+    return np.concatenate(tables)
@@ -0,0 +1,115 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+""" Synthetic bright field images of cells with a known contour, for tests and
+    benchmarks.
+
+    All contours are (N, 2) float arrays of (x, y) points.
+"""
+
+import numpy as np
+import cv2
+
+from sibunlabs import geometry
+
+KINDS = ("ellipse", "tetragon", "blob")
+
+def ellipseContour(center, axes, angle = 0, n = 360):
+    """ Returns the contour of an ellipse with the half axes axes = (a, b),
+        rotated by angle (in degrees)
+    """
+    t = 2*np.pi*np.arange(n)/n
+    x = axes[0]*np.cos(t)
+    y = axes[1]*np.sin(t)
+    return _place(np.column_stack((x, y)), center, angle)
+
+def tetragonContour(center, size, angle = 0):
+    """ Returns the contour of a rectangle of size = (width, height), rotated
+        by angle (in degrees)
+    """
+    w, h = size[0]/2, size[1]/2
+    corners = np.array([[-w, -h], [w, -h], [w, h], [-w, h]])
+    return _place(corners, center, angle)
+
+def blobContour(center, radius, roughness = 0.1, harmonics = 5, n = 360, rng = None):
+    """ Returns the contour of an irregular blob, whose radius is modulated by
+        random harmonics with a total relative amplitude of roughness
+    """
+    rng = np.random.RandomState(0) if rng is None else rng
+    t = 2*np.pi*np.arange(n)/n
+    amplitudes = rng.uniform(0, 1, harmonics)
+    amplitudes *= roughness/amplitudes.sum()
+    phases = rng.uniform(0, 2*np.pi, harmonics)
+    k = np.arange(2, harmonics+2)
+    r = radius*(1 + (amplitudes[:,np.newaxis]*np.cos(k[:,np.newaxis]*t + phases[:,np.newaxis])).sum(axis = 0))
+    return _place(np.column_stack((r*np.cos(t), r*np.sin(t))), center, 0)
+
+def _place(points, center, angle):
+    """ Rotates points by angle (in degrees) and moves them to center """
+    a = angle/180*np.pi
+    rotation = np.array([[np.cos(a), -np.sin(a)], [np.sin(a), np.cos(a)]])
+    return points.dot(rotation.T) + np.asarray(center, dtype = np.float64)
+
+def renderCell(contour, shape, background = 128, noise = 0.0, blur = 1.0, rng = None):
+    """ Draws contour like a cell in a bright field image: a dark membrane
+        with a bright halo around it. noise is the standard deviation of added
+        gaussian noise, blur the sigma of a gaussian blur. Returns a float32
+        image of the given shape (height, width).
+    """
+    rng = np.random.RandomState(0) if rng is None else rng
+    image = np.full(shape, background, dtype = np.float32)
+
+    # Draw with 4 bits of sub-pixel precision
+    points = np.round(contour*16).astype(np.int32).reshape(-1, 1, 2)
+    cv2.polylines(image, [points], True, background + 40, 7, cv2.LINE_AA, 4)
+    cv2.polylines(image, [points], True, background - 70, 3, cv2.LINE_AA, 4)
+
+    if blur > 0:
+        image = cv2.GaussianBlur(image, (0, 0), blur)
+    if noise > 0:
+        image += rng.normal(0, noise, shape).astype(np.float32)
+
+    return image
+
+def syntheticCell(kind = "ellipse", size = 400, radius = None, noise = 0.0, blur = 1.0, seed = 0):
+    """ Returns a square image of size x size pixels with one synthetic cell of
+        the given kind ("ellipse", "tetragon" or "blob") near its center, and
+        a dict with the ground truth: its contour, centroid (x, y), area and
+        perimeter.
+    """
+    rng = np.random.RandomState(seed)
+    if radius is None:
+        radius = size/4
+    center = (size/2 + rng.uniform(-2, 2), size/2 + rng.uniform(-2, 2))
+
+    if kind == "ellipse":
+        contour = ellipseContour(center, (radius, 0.7*radius), rng.uniform(0, 180),
+            n = max(int(2*np.pi*radius), 16))
+    elif kind == "tetragon":
+        contour = tetragonContour(center, (2*radius, 1.7*radius), rng.uniform(-10, 10))
+    elif kind == "blob":
+        contour = blobContour(center, radius, rng = rng, n = max(int(2*np.pi*radius), 16))
+    else:
+        raise ValueError("kind must be one of %s" % (KINDS,))
+
+    image = renderCell(contour, (size, size), noise = noise, blur = blur, rng = rng)
+    truth = {
+        "contour" : contour,
+        "centroid" : tuple(geometry.polygonCentroid(contour)),
+        "area" : geometry.area(contour),
+        "perimeter" : geometry.perimeter(contour),
+    }
+
+    return image, truth
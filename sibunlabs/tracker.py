@@ -0,0 +1,135 @@
+#   This file is part of sibunlabs.
+#
+#   sibunlabs is free software: you can redistribute it and/or modify
+#   it under the terms of the GNU Lesser General Public License as published by
+#   the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   sibunlabs is distributed in the hope that it will be useful,
+#   but WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#   GNU Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public License
+#   along with sibunlabs.  If not, see <http://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from sibunlabs import geometry
+from sibunlabs.pathfinder import Pathfinder, PathfinderException
+
+class Tracker:
+    """ Follows one cell through the frames of a time-lapse movie. Every frame
+        is first traced within the bounding box of the previous contour,
+        starting at the previous centroid, and only searched from scratch if
+        that fails.
+    """
+    # Never modifiy these members
+    _path = None
+    _centroid = None
+
+    # The following members are okay to modify
+    # Pixels added around the previous contour to get the search region
+    margin = 20
+    max_iterations = 1000
+    inflexibility = 5
+    multi_seed = False
+    bidirectional = False
+
+    # Set after every frame: the report of the trace and if the warm start
+    # within the previous region succeeded
+    report = None
+    warm = False
+
+    def __init__(self, start_x = None, start_y = None):
+        """ start_x and start_y are used for the first frame and whenever the
+            cell is lost, like Pathfinder.start_x/start_y.
+        """
+        self.start_x = start_x
+        self.start_y = start_y
+
+    def track(self, frames):
+        """ Yields one path per frame, as an (N, 2) array of (x, y) points
+            like Pathfinder.getPath(). If no closed path is found in a frame,
+            an empty path is yielded and the next frame is searched from
+            scratch.
+        """
+        for frame in frames:
+            frame = np.asarray(frame)
+            path = None
+            self.warm = False
+
+            if self._path is not None:
+                path = self._traceWarm(frame)
+                self.warm = path is not None
+            if path is None:
+                path = self._traceFull(frame)
+
+            if path is None:
+                self._path = None
+                self._centroid = None
+                yield np.zeros((0, 2), dtype = np.int32)
+            else:
+                self._path = path
+                self._centroid = geometry.lineCentroid(path)
+                yield path
+
+    def reset(self):
+        """ Forgets the previous contour, the next frame is searched from
+            scratch
+        """
+        self._path = None
+        self._centroid = None
+
+    def _traceWarm(self, frame):
+        """ Traces the cell within the bounding box of the previous contour.
+            Returns None if no closed path is found or if it touches the border
+            of the search region.
+        """
+        height, width = frame.shape
+        x0, y0 = np.maximum(self._path.min(axis = 0) - self.margin, 0)
+        x1 = min(self._path[:,0].max() + self.margin + 1, width)
+        y1 = min(self._path[:,1].max() + self.margin + 1, height)
+
+        pathfinder = Pathfinder(frame[y0:y1, x0:x1])
+        start = np.clip(np.round(self._centroid).astype(int) - (x0, y0), 0,
+            (x1 - x0 - 1, y1 - y0 - 1))
+        path = self._trace(pathfinder, int(start[0]), int(start[1]))
+        if path is None:
+            return None
+
+        # A contour reaching the border of the region was probably cut off
+        if path[:,0].min() <= 2 or path[:,1].min() <= 2 or \
+            path[:,0].max() >= x1 - x0 - 3 or path[:,1].max() >= y1 - y0 - 3:
+            return None
+
+        return path + (x0, y0)
+
+    def _traceFull(self, frame):
+        """ Traces the cell on the whole frame """
+        return self._trace(Pathfinder(frame), self.start_x, self.start_y)
+
+    def _trace(self, pathfinder, start_x, start_y):
+        """ Runs the pathfinder and returns the (x, y) path, or None if it is
+            not closed
+        """
+        pathfinder.max_iterations = self.max_iterations
+        pathfinder.inflexibility = self.inflexibility
+        pathfinder.multi_seed = self.multi_seed
+        pathfinder.bidirectional = self.bidirectional
+        if start_x is not None:
+            pathfinder.start_x = start_x
+        if start_y is not None:
+            pathfinder.start_y = start_y
+
+        try:
+            path = pathfinder.getPath()
+        except PathfinderException:
+            self.report = pathfinder._report
+            return None
+
+        self.report = pathfinder._report
+        if self.report != "OK":
+            return None
+
+        return path.astype(np.int64)
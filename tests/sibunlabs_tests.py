@@ -16,10 +16,14 @@
 from nose.tools import *
 
 import os
+import csv
+import subprocess
+import sys
 
 from PIL import Image, ImageSequence
 import numpy as np
 import scipy as sp
+import cv2
 
 import sibunlabs
 
@@ -34,12 +38,12 @@ def example_files():
         (os.path.join(*["bin", "example-cells", "cell_tetragon.png"]), {
             'points' : [(201,127)],
             'nopoints' : [(0,0)],
-            'center' : (197, 196),
+            'center' : (200, 192),
         }),
         (os.path.join(*["bin", "example-cells", "cell_real_1.png"]), {
             'points' : [(102, 29), (169,92)],
             'nopoints' : [(0,0), (29, 102)],
-            'center' : (97, 99),
+            'center' : (99, 97),
         }),
     ]
 
@@ -120,4 +124,893 @@ def test_special_rfa():
     cj2, phij2 = sibunlabs.special.rfa(r, phi/np.pi*180, False)
 
     assert cj1.all() == cj2.all()
-    assert phij1.all() == phij2.all()
\ No newline at end of file
+    assert phij1.all() == phij2.all()
+
+def test_precomputedWhiteness():
+    for file, conditions in example_files():
+        im = Image.open(file)
+        im = im.convert("I")
+
+        pathfinder = sibunlabs.Pathfinder(im)
+        pathfinder.setWeight(np.array([
+            [0, 1, 0, 1, 0],
+            [1, 1, 2, 1, 1],
+            [0, 2, 3, 2, 0],
+            [1, 1, 2, 1, 1],
+            [0, 1, 0, 1, 0],
+        ]))
+
+        for y in range(2, pathfinder.height-3, 7):
+            for x in range(2, pathfinder.width-3, 7):
+                pathfinder.precompute_whiteness = False
+                expected = pathfinder._getWhiteness(x = x, y = y)
+                pathfinder.precompute_whiteness = True
+                assert abs(pathfinder._getWhiteness(x = x, y = y) - expected) < 1e-9
+
+        im.close()
+
+    # Only the tiles along the path are calculated, like the whole field
+    image, truth = sibunlabs.synthetic.syntheticCell("ellipse", 1024, radius = 100)
+    pathfinder = sibunlabs.Pathfinder(image)
+    path = pathfinder.getPath().astype(int)
+    assert 0 < pathfinder._whiteness_tiles.sum() < pathfinder._whiteness_tiles.size//4
+    field = sibunlabs.pathfinder.whitenessField(pathfinder._image, pathfinder._weight, pathfinder._weightcount)
+    assert np.array_equal(pathfinder._whiteness[path[:,1], path[:,0]], field[path[:,1], path[:,0]])
+
+def test_pathStore():
+    store = sibunlabs.pathfinder.PathStore((10, 10), 2, [(1, 2), (3, 4)])
+    store.append((5, 6))
+    store.append((1, 2))
+
+    assert len(store) == 4
+    assert (1, 2) in store
+    assert (2, 1) not in store
+    assert store.index((1, 2)) == 0
+    assert store.index((5, 6)) == 2
+    assert store.toArray().tolist() == [[1, 2], [3, 4], [5, 6], [1, 2]]
+
+    store.clear()
+    assert len(store) == 0
+    assert (1, 2) not in store
+
+def test_reversePathJoin():
+    # The enlarged oval bites itself on the first pass and is only closed by
+    # tracing back from the start point.
+    im = Image.open(os.path.join(*["bin", "example-cells", "cell_oval.png"]))
+    im = im.convert("I")
+    imarr = cv2.resize(np.array(im, dtype = np.float32), (2000, 2000),
+        interpolation = cv2.INTER_CUBIC)
+
+    pathfinder = sibunlabs.Pathfinder(imarr)
+    pathfinder.max_iterations = 10000
+
+    path = pathfinder.getPath()
+    assert len(set(map(tuple, path.tolist()))) == len(path)
+    assert np.abs(np.diff(path, axis = 0)).max() == 1
+    assert sibunlabs.pathfinder.isAdjacent(path[-1], path[0])
+
+    im.close()
+
+def test_special_rfaBatch():
+    def profile(phi, a):
+        return 1 + a*np.sin(phi) + 0.1*np.cos(phi) + 0.2*np.sin(3*phi)
+
+    N = 720
+    phi = 2*np.pi*np.arange(N)/N
+    r = np.array([profile(phi, a) for a in (0.1, -0.1, 0.2)])
+
+    cj, phij = sibunlabs.special.rfaBatch(r, phi/np.pi*180)
+    assert cj.shape == (3, N//2)
+    for i in range(0, 3):
+        cj1, phij1 = sibunlabs.special.rfa(r[i], phi, True)
+        assert np.allclose(cj[i], cj1)
+        assert np.allclose(phij[i][cj1 > 1e-9], phij1[cj1 > 1e-9])
+
+    # Non-uniform profiles of different lengths get resampled
+    rng = np.random.RandomState(0)
+    angles = [np.sort(rng.uniform(0, 360, n)) for n in (300, 500, 1000)]
+    profiles = [profile(a/180*np.pi, 0.1) for a in angles]
+    cj, phij = sibunlabs.special.rfaBatch(profiles, angles, n_angles = 360)
+    assert cj.shape == (3, 180)
+    assert np.allclose(cj[:,0], 1, atol = 1e-3)
+    assert np.allclose(cj[:,1], np.sqrt(0.05**2 + 0.05**2), atol = 1e-3)
+    assert np.allclose(cj[:,3], 0.1, atol = 1e-3)
+
+def test_multiSeed():
+    for file, conditions in example_files():
+        im = Image.open(file)
+        im = im.convert("I")
+
+        pathfinder = sibunlabs.Pathfinder(im)
+        pathfinder.multi_seed = True
+
+        pathlist = pathfinder.getPath().tolist()
+        assert pathfinder._report == "OK"
+        for point in conditions['points']:
+            assert list(point) in pathlist
+        for point in conditions['nopoints']:
+            assert list(point) not in pathlist
+
+        im.close()
+
+def test_geometry():
+    square = np.array([[0, 0], [0, 2], [2, 2], [2, 0]])
+    triangle = np.array([[0, 0], [3, 0], [0, 3]])
+
+    assert sibunlabs.geometry.perimeter(square) == 8
+    assert sibunlabs.geometry.area(square) == 4
+    assert np.allclose(sibunlabs.geometry.lineCentroid(square), [1, 1])
+    assert np.allclose(sibunlabs.geometry.polygonCentroid(triangle), [1, 1])
+
+    coords, offsets = sibunlabs.geometry.concatenatePaths([square, triangle, square + 10])
+    assert np.allclose(sibunlabs.geometry.perimeter(coords, offsets), [8, 6 + np.sqrt(18), 8])
+    assert np.allclose(sibunlabs.geometry.area(coords, offsets), [4, 4.5, 4])
+    assert np.allclose(sibunlabs.geometry.polygonCentroid(coords, offsets), [[1, 1], [1, 1], [11, 11]])
+    assert np.allclose(sibunlabs.geometry.lineCentroid(coords, offsets)[2], [11, 11])
+
+def test_field():
+    images = []
+    for file in ["cell_tetragon.png", "cell_oval.png"]:
+        im = Image.open(os.path.join(*["bin", "example-cells", file]))
+        images.append(np.array(im.convert("I"), dtype = np.float32))
+        im.close()
+
+    field = sibunlabs.Field(np.hstack(images))
+    cells = field.trace()
+
+    assert len(cells) == 2
+    for cell in cells:
+        assert cell.closed
+    assert abs(cells[0].centroid[0] - 200) <= 1 and abs(cells[0].centroid[1] - 192) <= 1
+    assert cells[1].centroid[0] > 400
+
+    # The traces of a pool give the same cells
+    pooled = field.trace(workers = 2)
+    for cell, other in zip(cells, pooled):
+        assert np.array_equal(cell.path, other.path)
+
+    # bidirectional reaches the traces: a stopped trace then keeps the chain
+    # through the start point instead of the path starting there
+    field.max_iterations = 100
+    single = field.trace()
+    field.bidirectional = True
+    both = field.trace()
+    for cell, other in zip(single, both):
+        assert cell.report == other.report == "max_it"
+        assert tuple(cell.path[0]) in set(map(tuple, other.path[1:].tolist()))
+
+def test_tracker():
+    im = Image.open(os.path.join(*["bin", "example-cells", "cell_real_1.png"]))
+    imarr = np.array(im.convert("I"), dtype = np.float32)
+    im.close()
+
+    frames = [np.roll(imarr, (2*i, 3*i), axis = (0, 1)) for i in range(0, 5)]
+    tracker = sibunlabs.Tracker()
+
+    first = None
+    for i, path in enumerate(tracker.track(frames)):
+        assert tracker.report == "OK"
+        assert tracker.warm == (i > 0)
+        if first is None:
+            first = path
+        # The start point moves with the seed, the contour with the cell
+        assert set(map(tuple, path.tolist())) == set(map(tuple, (first + (3*i, 2*i)).tolist()))
+
+def test_lazyEdges():
+    for file, conditions in example_files():
+        im = Image.open(file)
+        imarr = np.array(im.convert("I"), dtype = np.float32)
+        im.close()
+
+        path = sibunlabs.Pathfinder(imarr).getPath()
+
+        # With the exact range, the lazy edge map equals the full one
+        pathfinder = sibunlabs.Pathfinder(imarr, lazy = True,
+            edge_range = sibunlabs.pathfinder.edgeRange(imarr))
+        pathfinder.tile_size = 32
+        assert np.array_equal(pathfinder.getPath(), path)
+        assert not pathfinder._edge_tiles.all()
+
+        # The estimated range is good enough to find the path
+        pathfinder = sibunlabs.Pathfinder(imarr, lazy = True)
+        pathlist = pathfinder.getPath().tolist()
+        for point in conditions['points']:
+            assert list(point) in pathlist
+
+def test_reset():
+    im = Image.open(os.path.join(*["bin", "example-cells", "cell_tetragon.png"]))
+    imarr = np.array(im.convert("I"), dtype = np.float32)
+    im.close()
+
+    frames = [np.roll(imarr, 5*i, axis = 1) for i in range(0, 3)]
+    pathfinder = sibunlabs.Pathfinder(frames[0])
+
+    buffers = None
+    for frame in frames:
+        pathfinder.reset(frame)
+        path = pathfinder.getPath()
+
+        fresh = sibunlabs.Pathfinder(frame)
+        assert np.array_equal(path, fresh.getPath())
+        assert np.array_equal(pathfinder._image, fresh._image)
+
+        # The same buffers are used for every frame
+        if buffers is None:
+            buffers = dict(pathfinder._buffers)
+        for name in buffers:
+            assert pathfinder._buffers[name] is buffers[name]
+
+    # Path stores are only made for the traced start points
+    assert [key for key in pathfinder._stores if not isinstance(key, tuple)] == [3]
+    pathfinder.multi_seed = True
+    pathfinder.reset(frames[0])
+    pathfinder.getPath()
+    assert sorted(key for key in pathfinder._stores if not isinstance(key, tuple)) == [0, 1, 2, 3]
+
+def test_synthetic():
+    for kind in sibunlabs.synthetic.KINDS:
+        image, truth = sibunlabs.synthetic.syntheticCell(kind, 300, noise = 3.0)
+        assert image.shape == (300, 300)
+
+        pathfinder = sibunlabs.Pathfinder(image)
+        path = pathfinder.getPath()
+        centroid = pathfinder.getCentroid()
+
+        assert abs(centroid[0] - truth["centroid"][0]) <= 1
+        assert abs(centroid[1] - truth["centroid"][1]) <= 1
+        assert abs(sibunlabs.geometry.area(path)/truth["area"] - 1) < 0.15
+
+def test_stats():
+    total = []
+    for file, conditions in example_files():
+        im = Image.open(file)
+        im = im.convert("I")
+
+        stats = sibunlabs.PathfinderStats()
+        pathfinder = sibunlabs.Pathfinder(im, stats = stats)
+        path = pathfinder.getPath()
+
+        for stage in ["preprocessing", "whiteness", "startpoint", "tracing"]:
+            assert stats.timings[stage] > 0
+        assert stats.counters["steps"] == len(path) - 1
+        assert stats.counters["whiteness_evaluations"] == 3*stats.counters["steps"]
+        assert stats.counters["report_OK"] == 1
+        total.append(stats)
+
+        im.close()
+
+    total = sum(total)
+    assert total.counters["paths"] == 2
+    assert total.counters["report_OK"] == 2
+
+def test_batch():
+    import shutil
+    import tempfile
+    from sibunlabs import batch
+
+    directory = tempfile.mkdtemp()
+    try:
+        for file, conditions in example_files():
+            shutil.copy(file, directory)
+        output = os.path.join(directory, "results.csv")
+        settings = {"max_iterations" : 1000, "inflexibility" : 5,
+            "multi_seed" : False, "harmonics" : 4}
+
+        files = batch.findImages([directory])
+        assert len(files) == 2
+        assert batch.run(files, output, settings, workers = 1) == 2
+
+        # Simulate a crash while writing the second row
+        with open(output) as f:
+            lines = f.readlines()
+        with open(output, "w") as f:
+            f.writelines(lines[:2] + [lines[2][:10]])
+
+        assert batch.run(files, output, settings, workers = 2) == 1
+        with open(output) as f:
+            rows = list(csv.DictReader(f))
+        assert sorted(row["file"] for row in rows) == files
+        for row in rows:
+            assert row["status"] == "OK"
+            assert float(row["c0"]) > 0
+
+        # A failed path search gets its report, an unreadable image is retried
+        row = batch.processImage(files[0], dict(settings, max_iterations = 20))
+        assert row["status"] == "max_it"
+        broken = os.path.join(directory, "broken.png")
+        with open(broken, "wb") as f:
+            f.write(b"no image")
+        assert batch.run(files + [broken], output, settings, workers = 1) == 1
+        assert batch.run(files + [broken], output, settings, workers = 1) == 1
+        with open(output) as f:
+            rows = list(csv.DictReader(f))
+        assert len(rows) == 3 and rows[-1]["status"].startswith("error")
+        # The rows of the retried image are removed without a temporary file
+        # left behind
+        os.remove(broken)
+        assert batch.run(files, output, settings, workers = 1) == 0
+        with open(output) as f:
+            assert len(list(csv.DictReader(f))) == 2
+        assert [f for f in os.listdir(directory) if f.endswith(".tmp")] == []
+
+        # Other harmonics do not fit the columns of the file
+        with open(output) as f:
+            before = f.read()
+        assert_raises(ValueError, batch.run, files, output, dict(settings, harmonics = 8))
+        with open(output) as f:
+            assert f.read() == before
+    finally:
+        shutil.rmtree(directory)
+
+def test_pyramid():
+    # Too long for the default max_iterations at full resolution
+    image, truth = sibunlabs.synthetic.syntheticCell("ellipse", 2000, radius = 600, noise = 3.0)
+
+    pathfinder = sibunlabs.Pathfinder(image)
+    assert_raises(sibunlabs.MaxIterationReached, pathfinder.getPath)
+    assert pathfinder._report == "max_it"
+
+    pathfinder = sibunlabs.PyramidPathfinder(image)
+    assert pathfinder.levels == 4
+    path = pathfinder.getPath()
+    centroid = pathfinder.getCentroid()
+
+    assert pathfinder._report == "OK"
+    assert pathfinder._level_reports[-1] == (0, "refined")
+    assert abs(centroid[0] - truth["centroid"][0]) <= 3
+    assert abs(centroid[1] - truth["centroid"][1]) <= 3
+    assert abs(sibunlabs.geometry.area(path)/truth["area"] - 1) < 0.05
+    # The path is closed and 8-connected
+    steps = np.abs(np.diff(np.vstack((path, path[:1])), axis = 0)).max(axis = 1)
+    assert np.all(steps == 1)
+
+    # trace() searches the pyramid as well, with the limits for all levels
+    result = sibunlabs.PyramidPathfinder(image).trace(timeout = 60)
+    assert result.closed and np.array_equal(result.path, path)
+    result = sibunlabs.PyramidPathfinder(image).trace(budget = 50)
+    assert (result.status, result.steps, len(result.path)) == ("budget", 50, 51)
+
+    # A budget used up before a level or between the tries of a level keeps
+    # the path of the last search
+    result = sibunlabs.PyramidPathfinder(image).trace(budget = 0)
+    assert (result.status, result.steps, result.path.shape) == ("budget", 0, (0, 2))
+    small, truth = sibunlabs.synthetic.syntheticCell("ellipse", 600, radius = 250, noise = 3.0)
+    coarse_to_fine = sibunlabs.PyramidPathfinder(small)
+    first = sibunlabs.Pathfinder(coarse_to_fine._pyramid[-1]).trace()
+    assert first.status == "oob"
+    result = coarse_to_fine.trace(budget = first.steps + 1)
+    assert result.status == "budget" and result.steps == first.steps + 1
+    assert coarse_to_fine._level_reports == [(3, "oob"), (3, "budget")]
+    assert len(result.path) == 2 and np.all(result.path % 8 == 0)
+
+    # reset() rebuilds the pyramid, the levels share the cache and settings
+    import tempfile
+    other, truth = sibunlabs.synthetic.syntheticCell("blob", 2000, radius = 500, noise = 3.0)
+    pathfinder.reset(other)
+    assert np.array_equal(pathfinder.getPath(), sibunlabs.PyramidPathfinder(other).getPath())
+    with tempfile.TemporaryDirectory() as directory:
+        cache = sibunlabs.Cache(directory)
+        sibunlabs.PyramidPathfinder(other, cache = cache).getPath()
+        stats = sibunlabs.PathfinderStats()
+        pathfinder = sibunlabs.PyramidPathfinder(other, stats = stats, cache = cache)
+        pathfinder.bidirectional = True
+        pathfinder.getPath()
+        assert stats.counters["edge_cache_hits"] > 0 and "path_cache_hits" not in stats.counters
+
+def test_directionTable():
+    pathfinder = sibunlabs.Pathfinder(np.zeros((20, 20)), sobel = False)
+    pathfinder.inflexibility = 2
+
+    # Direction by the slope of the path, with the borders of the diagonal
+    # directions included
+    def slopeDirection(y, x):
+        if x == 0:
+            return 0 if y < 0 else 4
+        if y == 0:
+            return 2 if x > 0 else 6
+        s = abs(y/x)
+        vertical = 0 if y < 0 else 4
+        horizontal = 2 if x > 0 else 6
+        if s > 2:
+            return vertical
+        if s < 0.5:
+            return horizontal
+        return {(0, 2) : 1, (4, 2) : 3, (4, 6) : 5, (0, 6) : 7}[(vertical, horizontal)]
+
+    for y in range(-6, 7):
+        for x in range(-6, 7):
+            path = sibunlabs.pathfinder.PathStore((20, 20), 2, [(10, 10), (10+y, 10+x)])
+            direction, yi, xi = pathfinder._getDirection(path)
+            assert direction == slopeDirection(y, x)
+            assert (yi, xi) == (10+y, 10+x)
+
+    # The last of equally white candidates wins
+    pathfinder._whiteness = np.zeros((20, 20))
+    path = sibunlabs.pathfinder.PathStore((20, 20), 3, [(10, 8), (10, 10)])
+    pathfinder._whiteness[9:12, 11] = 0.5
+    assert pathfinder._searchNextpoint(3, path) == (11, 11)
+    pathfinder._whiteness[11, 11] = 0.25
+    assert pathfinder._searchNextpoint(3, path) == (10, 11)
+
+def test_descriptorStore():
+    import shutil
+    import tempfile
+    from sibunlabs.descriptors import DescriptorStore
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "store")
+        rng = np.random.RandomState(0)
+        data = rng.rand(5000, 8).astype(np.float32)
+
+        with DescriptorStore(path, harmonics = 8, writable = True) as store:
+            store.chunk_size = 1000
+            assert store.append(data[:3000], labels = np.arange(3000)) == 0
+            assert store.append(data[3000:], names = ["cell"]*2000) == 3000
+
+            image, truth = sibunlabs.synthetic.syntheticCell("blob", 300)
+            pathfinder = sibunlabs.Pathfinder(image)
+            assert store.appendPathfinder(pathfinder, label = 7, name = "blob") == 5000
+            assert len(store) == 5001
+
+        # Simulate a crash after writing the descriptor of a cell
+        with open(os.path.join(path, "descriptors.f32"), "ab") as f:
+            f.write(data[0].tobytes())
+
+        store = DescriptorStore(path)
+        assert len(store) == 5001
+        assert store.metadata["label"][0] == 0
+        assert store.metadata["label"][3000] == -1
+        assert store.metadata["name"][3000] == b"cell"
+        assert store.metadata["label"][5000] == 7
+        assert_almost_equal(store.metadata["centroid"][5000][0], pathfinder.getCentroid()[0])
+        # The same amplitudes as the feature table and sibunlabs-batch
+        table = sibunlabs.features.features([pathfinder.getPath()], harmonics = 8)
+        assert np.allclose(store.descriptors[5000], [table[0]["c%i" % j] for j in range(8)], rtol = 1e-5)
+
+        queries = rng.rand(20, 8).astype(np.float32)
+        store.chunk_size = 20*700
+        distances, indices = store.query(queries, k = 4)
+        everything = np.asarray(store.descriptors, dtype = np.float64)
+        for q, d, i in zip(queries, distances, indices):
+            expected = np.sqrt(((everything - q)**2).sum(axis = 1))
+            assert np.array_equal(i, np.argsort(expected)[:4])
+            assert np.allclose(d, expected[i])
+
+        # The cell cut off above is removed when the store is written again
+        store = DescriptorStore(path, writable = True)
+        store.close()
+        assert os.path.getsize(os.path.join(path, "descriptors.f32")) == 5001*8*4
+    finally:
+        shutil.rmtree(directory)
+
+def test_stacks():
+    import shutil
+    import tempfile
+    from sibunlabs import batch, stacks
+
+    # Only the stacks with a length and frames can be created
+    assert_raises(TypeError, stacks.Stack)
+
+    directory = tempfile.mkdtemp()
+    try:
+        frames = [sibunlabs.synthetic.syntheticCell("ellipse", 120, seed = k)[0].astype(np.uint16)
+            for k in range(5)]
+        images = [Image.fromarray(frame) for frame in frames]
+        tiff = os.path.join(directory, "movie.tif")
+        images[0].save(tiff, save_all = True, append_images = images[1:])
+        compressed = os.path.join(directory, "compressed.tif")
+        images[0].save(compressed, save_all = True, append_images = images[1:], compression = "tiff_lzw")
+        raw = os.path.join(directory, "movie.raw")
+        with open(raw, "wb") as f:
+            f.write(b"header")
+            np.stack(frames).tofile(f)
+
+        for stack in (stacks.openStack(tiff), stacks.openStack(compressed),
+            stacks.openStack(raw, (120, 120), np.uint16, offset = 6)):
+            with stack:
+                assert len(stack) == 5
+                stack.read_ahead = 1
+                for frame, expected in zip(stack, frames):
+                    assert np.array_equal(frame, expected)
+                assert np.array_equal(stack[-2], frames[3])
+                # Stop in the middle of a stack
+                for frame in stack.frames(1, 4):
+                    break
+
+        # Uncompressed frames are views of the mapped file
+        with stacks.openStack(tiff) as stack:
+            assert stack._region(0) is not None
+            assert not stack[0].flags.owndata
+
+        items = batch.expandStacks([tiff, raw], {"shape" : (120, 120), "dtype" : "uint16", "offset" : 6})
+        assert items == [(tiff, i) for i in range(5)] + [(raw, i) for i in range(5)]
+        row = batch.processImage(items[7], {"max_iterations" : 1000, "inflexibility" : 5,
+            "multi_seed" : False, "harmonics" : 2, "raw" : {"shape" : (120, 120), "dtype" : "uint16", "offset" : 6}})
+        assert row["file"] == raw + "#2"
+        assert row["status"] == "OK"
+        for stack in batch._stacks.values():
+            stack.close()
+        batch._stacks.clear()
+    finally:
+        shutil.rmtree(directory)
+
+def test_pipeline():
+    import asyncio
+    from sibunlabs.pipeline import Pipeline
+
+    images = [sibunlabs.synthetic.syntheticCell("ellipse", 200, seed = k)[0] for k in range(4)]
+    files = [file for file, conditions in example_files()]
+    sources = images[:2] + files + ["missing.png"] + images[2:]
+
+    pipeline = Pipeline()
+    pipeline.threads = 2
+    pipeline.workers = 2
+    pipeline.queue_size = 2
+    results = pipeline.trace(sources)
+
+    assert [result.index for result in results] == list(range(len(sources)))
+    assert results[4].report.startswith("error")
+    for result, source in zip(results, sources):
+        if result.index == 4:
+            continue
+        pathfinder = sibunlabs.Pathfinder(np.array(Image.open(source).convert("I")) if isinstance(source, str) else source)
+        pathfinder.getPath()
+        assert result.report == pathfinder._report
+        assert np.array_equal(result.path, pathfinder.getPath())
+        assert_almost_equal(result.centroid[0], pathfinder.getCentroid()[0])
+
+    # Stop after the first result
+    async def first():
+        async for result in pipeline.run(iter(images)):
+            return result
+    assert asyncio.run(first()).closed
+
+def test_cache():
+    import shutil
+    import tempfile
+    from sibunlabs.cache import Cache
+
+    directory = tempfile.mkdtemp()
+    try:
+        cache = Cache(directory)
+        stats = sibunlabs.PathfinderStats()
+        image, truth = sibunlabs.synthetic.syntheticCell("blob", 200)
+
+        first = sibunlabs.Pathfinder(image, cache = cache)
+        path = first.getPath()
+        assert len(cache.entries()) == 2
+
+        second = sibunlabs.Pathfinder(image.astype(np.float64), stats = stats, cache = cache)
+        assert isinstance(second._image, np.memmap)
+        assert np.array_equal(second._image, first._image)
+        assert np.array_equal(second.getPath(), path)
+        assert second._report == first._report
+        assert second._seed == first._seed
+        assert stats.counters["edge_cache_hits"] == 1
+        assert stats.counters["path_cache_hits"] == 1
+
+        # Other parameters, other path
+        third = sibunlabs.Pathfinder(image, stats = stats, cache = cache)
+        third.inflexibility = 3
+        third.getPath()
+        assert stats.counters["path_cache_hits"] == 1
+        assert len(cache.entries()) == 3
+
+        # reset() takes the edge map from the cache too
+        third.reset(sibunlabs.synthetic.syntheticCell("ellipse", 200)[0])
+        third.reset(image)
+        assert stats.counters["edge_cache_hits"] == 3
+        assert np.array_equal(third._image, first._image)
+
+        # The least recently used entries are removed first
+        cache.getEdges(first._cache_key)
+        cache.max_bytes = first._image.nbytes + 1000
+        cache.evict()
+        assert cache.getEdges(first._cache_key) is not None
+        assert cache.size() <= cache.max_bytes
+        cache.clear()
+        assert cache.size() == 0
+    finally:
+        shutil.rmtree(directory)
+
+def test_sweep():
+    images = [sibunlabs.synthetic.syntheticCell(kind, 200)[0] for kind in ("ellipse", "blob")]
+    configurations = sibunlabs.sweep.grid(inflexibility = [3, 5], weight = [np.ones((3, 3)), np.ones((5, 5))])
+    assert len(configurations) == 4
+
+    table = sibunlabs.sweep.sweep(images + ["missing.png"], configurations, workers = 1)
+    assert len(table) == 12
+    assert list(table["image"]) == [0]*4 + [1]*4 + [2]*4
+    assert list(table["report"][8:]) == ["error"]*4
+
+    # The same as a new Pathfinder for every configuration
+    for row in table[:8]:
+        configuration = configurations[row["configuration"]]
+        pathfinder = sibunlabs.Pathfinder(images[row["image"]])
+        pathfinder.inflexibility = configuration["inflexibility"]
+        pathfinder.setWeight(configuration["weight"])
+        try:
+            pathfinder._findPath()
+        except sibunlabs.pathfinder.PathfinderException:
+            pass
+        assert row["report"] == pathfinder._report
+        assert row["length"] == len(pathfinder._path)
+
+    assert_raises(ValueError, sibunlabs.sweep.grid, sobel = [True])
+
+def test_withoutCv2():
+    # Importing special does not load cv2 or PIL
+    code = "import sys, sibunlabs.special, sibunlabs; sibunlabs.special.rfa; " \
+        "print(sorted(m for m in ('cv2', 'PIL', 'sibunlabs.pathfinder') if m in sys.modules))"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd = root, stdout = subprocess.PIPE).stdout
+    assert output.decode().strip() == "[]"
+    assert sibunlabs.Pathfinder is sibunlabs.pathfinder.Pathfinder
+    assert_raises(AttributeError, getattr, sibunlabs, "missing")
+
+    image = sibunlabs.synthetic.syntheticCell("blob", 200)[0].astype(np.float32)
+    for x, y in ((1, 0), (0, 1)):
+        assert np.allclose(sibunlabs.pathfinder.numpySobel(image, x, y),
+            cv2.Sobel(image, cv2.CV_32F, x, y), atol = 1e-3)
+
+    expected = sibunlabs.Pathfinder(image)
+    path = expected.getPath()
+    cv2_module = sibunlabs.pathfinder.cv2
+    try:
+        sibunlabs.pathfinder.cv2 = None
+        pathfinder = sibunlabs.Pathfinder(image)
+        assert np.allclose(pathfinder._image, expected._image, atol = 1e-5)
+        assert np.array_equal(pathfinder.getPath(), path)
+        lazy = sibunlabs.Pathfinder(image, lazy = True)
+        assert np.array_equal(lazy.getPath(), path)
+    finally:
+        sibunlabs.pathfinder.cv2 = cv2_module
+
+def test_quantizedEdges():
+    import shutil
+    import tempfile
+
+    for file, properties in example_files():
+        im = np.array(Image.open(file).convert("I"))
+        expected = sibunlabs.Pathfinder(im)
+        path = np.array(expected.getPath())
+        for dtype in (np.uint16, np.uint8):
+            pathfinder = sibunlabs.Pathfinder(im, edge_dtype = dtype)
+            assert pathfinder._image.dtype == dtype
+            assert np.array_equal(pathfinder._image == 0, expected._image == 0)
+            quantized = np.array(pathfinder.getPath())
+            assert pathfinder._report == expected._report
+            assert pathfinder._whiteness.dtype.kind == "i"
+            # Float ties are broken by rounding errors, otherwise the paths
+            # are the same
+            if dtype == np.uint16 and not file.endswith("cell_real_1.png"):
+                assert np.array_equal(quantized, path)
+            distances = np.hypot(*(quantized[:,np.newaxis,:] - path[np.newaxis,:,:]).transpose(2, 0, 1))
+            assert distances.min(axis = 0).max() <= 1.5
+            assert distances.min(axis = 1).max() <= 1.5
+
+    # The same whiteness with and without precomputing, in lazy mode, after
+    # reset() and from the cache
+    im = np.array(Image.open(os.path.join(*["bin", "example-cells", "cell_oval.png"])).convert("I"))
+    pathfinder = sibunlabs.Pathfinder(im, edge_dtype = np.uint16)
+    path = pathfinder.getPath()
+    x, y = int(path[0][0]), int(path[0][1])
+    assert pathfinder._getWhiteness(x = x, y = y) == pathfinder._whiteness[y, x]
+    pathfinder.precompute_whiteness = False
+    pathfinder._whiteness = None
+    window = pathfinder._image[y-1:y+2, x-1:x+2].astype(np.int64)
+    assert window.min() > 0
+    assert pathfinder._getWhiteness(x = x, y = y) == window.sum()
+
+    lazy = sibunlabs.Pathfinder(im, lazy = True, edge_dtype = np.uint16)
+    assert np.array_equal(lazy.getPath(), sibunlabs.Pathfinder(im, lazy = True).getPath())
+
+    other = sibunlabs.Pathfinder(np.array(Image.open(os.path.join(*["bin", "example-cells",
+        "cell_tetragon.png"])).convert("I")), edge_dtype = np.uint16)
+    other.reset(im)
+    assert other._image.dtype == np.uint16
+    assert np.array_equal(other.getPath(), path)
+
+    directory = tempfile.mkdtemp()
+    try:
+        cache = sibunlabs.Cache(directory)
+        sibunlabs.Pathfinder(im, cache = cache).getPath()
+        cached = sibunlabs.Pathfinder(im, cache = cache, edge_dtype = np.uint16)
+        assert cached._image.dtype == np.uint16
+        assert np.array_equal(cached.getPath(), path)
+        assert np.array_equal(sibunlabs.Pathfinder(im, cache = cache, edge_dtype = np.uint16)._image,
+            cached._image)
+    finally:
+        shutil.rmtree(directory)
+
+    assert_raises(ValueError, sibunlabs.Pathfinder, im, edge_dtype = np.int16)
+
+def test_chainCode():
+    import shutil
+    import tempfile
+    from sibunlabs import chaincode
+
+    paths = []
+    for file, properties in example_files():
+        path = sibunlabs.Pathfinder(Image.open(file).convert("I")).getPath()
+        start, codes = chaincode.encode(path)
+        assert codes.dtype == np.uint8 and codes.max() < 8
+        assert np.array_equal(chaincode.decode(start, codes), path)
+        assert len(chaincode.packCodes(codes)) == chaincode.packedSize(len(codes))
+        assert np.array_equal(chaincode.unpackCodes(chaincode.packCodes(codes), len(codes)), codes)
+        paths.append(path)
+
+    square = [(0, 0), (1, 0), (1, 1), (0, 1)]
+    assert list(chaincode.encode(square)[1]) == [0, 6, 4]
+    assert_raises(ValueError, chaincode.encode, [(0, 0), (2, 0)])
+    assert_raises(ValueError, chaincode.encode, [(0, 0), (0, 0)])
+
+    directory = tempfile.mkdtemp()
+    try:
+        assert_raises(IOError, sibunlabs.ContourStore, directory)
+        with sibunlabs.ContourStore(directory, writable = True) as store:
+            assert store.append(paths) == 0
+            assert store.append([square]) == len(paths)
+            assert len(store) == len(paths) + 1
+
+        # A crash while appending leaves codes without an index record
+        with open(os.path.join(directory, chaincode.CODES), "ab") as f:
+            f.write(b"\x01\x02")
+        with open(os.path.join(directory, chaincode.INDEX), "ab") as f:
+            f.write(b"\x03")
+        sibunlabs.ContourStore(directory, writable = True).close()
+
+        store = sibunlabs.ContourStore(directory)
+        contours = paths + [np.array(square)]
+        assert list(store.lengths) == [len(path) for path in contours]
+        assert np.array_equal(store[-1], square)
+        coords, offsets = store.paths([2, 0, 1])
+        for k, i in enumerate([2, 0, 1]):
+            assert np.array_equal(coords[offsets[k]:offsets[k+1]], contours[i])
+            assert np.array_equal(store[i], contours[i])
+        coords, offsets = store.paths()
+        assert np.allclose(sibunlabs.geometry.area(coords, offsets),
+            [sibunlabs.geometry.area(path) for path in contours])
+    finally:
+        shutil.rmtree(directory)
+
+def test_features():
+    from sibunlabs import features
+
+    pathfinders = [sibunlabs.Pathfinder(Image.open(file).convert("I")) for file, properties in example_files()]
+    paths = [pathfinder.getPath() for pathfinder in pathfinders]
+    # A rectangle of 4x2 rotated by 90 degrees, and a single point
+    rectangle = np.array([(0, 0), (0, 4), (2, 4), (2, 0)])
+    contours = paths + [rectangle, np.array([(5, 7)])]
+
+    table = features.features(contours, harmonics = 8)
+    coords, offsets = sibunlabs.geometry.concatenatePaths(contours)
+    chunked = features.features(coords, offsets, harmonics = 8, chunk_size = 100)
+    for name in table.dtype.names:
+        assert np.allclose(chunked[name], table[name], equal_nan = True)
+    assert len(features.features([])) == 0
+
+    assert list(table["points"]) == [len(c) for c in contours]
+    assert np.allclose(table["perimeter"], sibunlabs.geometry.perimeter(coords, offsets))
+    assert np.allclose(table["area"], sibunlabs.geometry.area(coords, offsets))
+    centroids = sibunlabs.geometry.lineCentroid(coords, offsets)
+    assert np.allclose(table["centroid_x"], centroids[:,0])
+    assert np.allclose(table["centroid_y"], centroids[:,1])
+    assert table[-1]["centroid_x"] == 5 and table[-1]["centroid_y"] == 7
+    assert np.isnan(table[-1]["mu20"])
+
+    # Moments of the rectangle: width**2/12 and height**2/12
+    row = table[-2]
+    assert np.allclose((row["mu20"], row["mu11"], row["mu02"]), (4/12, 0, 16/12))
+    assert np.allclose(row["orientation"], np.pi/2)
+    assert np.allclose((row["x_min"], row["y_min"], row["x_max"], row["y_max"]), (0, 0, 2, 4))
+    assert np.allclose(row["circularity"], 4*np.pi*8/12**2)
+
+    # The same centroid and harmonics as per cell, like sibunlabs-batch
+    for pathfinder, row in zip(pathfinders, table):
+        assert np.allclose((row["centroid_x"], row["centroid_y"]), pathfinder.getCentroid())
+        radial_path = pathfinder.getRadialPath()
+        cj, phij = sibunlabs.special.rfaBatch([radial_path[:,0]], [radial_path[:,1]], n_angles = 360)
+        assert np.allclose([row["c%i" % j] for j in range(8)], cj[0,:8])
+        assert np.allclose([row["phi%i" % j] for j in range(8)], phij[0,:8])
+        assert np.allclose(row["r_mean"], radial_path[:,0].mean())
+        assert np.allclose(row["r_max"], radial_path[:,0].max())
+
+def test_trace():
+    import tempfile
+
+    file = example_files()[0][0]
+    image = Image.open(file).convert("I")
+    pathfinder = sibunlabs.Pathfinder(image)
+    result = pathfinder.trace(timeout = 60, budget = 10**6, max_radius = 10**4)
+    assert result.closed and not result.stopped
+    assert result.stage == "tracing"
+    assert np.array_equal(result.path, sibunlabs.Pathfinder(image).getPath())
+
+    # Stopped after 50 steps with the partial contour, which getPath() keeps
+    pathfinder = sibunlabs.Pathfinder(image)
+    result = pathfinder.trace(budget = 50)
+    assert (result.status, result.stage, result.steps) == ("budget", "tracing", 50)
+    assert result.stopped and len(result.path) == 51
+    assert np.array_equal(pathfinder.getPath(), result.path)
+
+    # The steps of stopped traces are counted
+    for bidirectional in (False, True):
+        stats = sibunlabs.PathfinderStats()
+        pathfinder = sibunlabs.Pathfinder(image, stats = stats)
+        pathfinder.bidirectional = bidirectional
+        assert pathfinder.trace(budget = 50).status == "budget"
+        assert stats.counters["steps"] == 50
+        assert stats.counters["whiteness_evaluations"] == 150
+
+    result = sibunlabs.Pathfinder(image).trace(budget = 0)
+    assert (result.status, result.steps, len(result.path)) == ("budget", 0, 1)
+    result = sibunlabs.Pathfinder(image).trace(timeout = 0)
+    assert (result.status, result.stage, len(result.path)) == ("deadline", "startpoint", 0)
+    result = sibunlabs.Pathfinder(image).trace(max_radius = 20)
+    assert result.status == "radius"
+
+    # Stopped while repairing a self bite
+    image, truth = sibunlabs.synthetic.syntheticCell("ellipse", 128, noise = 20)
+    result = sibunlabs.Pathfinder(image).trace()
+    assert result.closed and result.stage == "reverse"
+    stats = sibunlabs.PathfinderStats()
+    result = sibunlabs.Pathfinder(image, stats = stats).trace(budget = result.steps - 10)
+    assert (result.status, result.stage) == ("budget", "reverse")
+    assert stats.counters["reverse_repairs"] == 1 and stats.counters["reverse_steps"] > 0
+
+    # The stage is the one of the seed whose path is kept, here still tracing
+    # while the seed stopped last repairs a self bite
+    noisy, truth = sibunlabs.synthetic.syntheticCell("ellipse", 128, noise = 30, seed = 1)
+    pathfinder = sibunlabs.Pathfinder(noisy)
+    pathfinder.multi_seed = True
+    result = pathfinder.trace(budget = 140)
+    assert (result.status, result.seed, result.stage) == ("budget", 2, "tracing")
+
+    # Bounded searches are not cached, even if not stopped
+    with tempfile.TemporaryDirectory() as directory:
+        cache = sibunlabs.Cache(directory)
+        assert sibunlabs.Pathfinder(image, cache = cache).trace(budget = 50).status == "budget"
+        assert sibunlabs.Pathfinder(image, cache = cache).trace(max_radius = 10**4).closed
+        result = sibunlabs.Pathfinder(image, cache = cache).trace()
+        assert result.closed and result.stage == "reverse"
+        assert sibunlabs.Pathfinder(image, cache = cache).trace(budget = 50).stage == "cache"
+
+def test_bidirectional():
+    from sibunlabs.pathfinder import PathStore
+
+    # Two stores sharing one grid
+    forward = PathStore((10, 10), 4, [(1, 1), (1, 2)])
+    backward = PathStore(None, 4, [(1, 1), (2, 1)], labels = forward._labels, sign = -1)
+    assert (1, 1) in forward and (1, 1) not in backward and (2, 1) in backward
+    assert forward.label((2, 1)) == -2 and backward.label((1, 2)) == -2
+    assert backward.index((2, 1)) == 1
+    backward.clear()
+    assert forward._labels.min() == 0 and forward.index((1, 1)) == 0
+
+    for file, conditions in example_files():
+        image = Image.open(file).convert("I")
+        pathfinder = sibunlabs.Pathfinder(image)
+        pathfinder.bidirectional = True
+        path = pathfinder.getPath()
+        assert pathfinder._report == "OK"
+        steps = np.abs(np.diff(np.vstack((path, path[:1])), axis = 0)).max(axis = 1)
+        assert np.all(steps == 1)
+        area = sibunlabs.geometry.area(sibunlabs.Pathfinder(image).getPath())
+        assert abs(sibunlabs.geometry.area(path)/area - 1) < 0.01
+
+        # The backward half leaves no labels in the reused stores
+        pathfinder.reset(image)
+        assert np.array_equal(pathfinder.getPath(), path)
+        assert min(store._labels.min() for store in pathfinder._stores.values()) == 0
+
+    # Closed in one pass where tracing in one direction bites itself
+    image, truth = sibunlabs.synthetic.syntheticCell("ellipse", 128, noise = 20)
+    single = sibunlabs.Pathfinder(image).trace()
+    pathfinder = sibunlabs.Pathfinder(image)
+    pathfinder.bidirectional = True
+    both = pathfinder.trace()
+    assert single.stage == "reverse" and both.stage == "tracing"
+    assert both.closed and both.steps < single.steps
+    assert abs(sibunlabs.geometry.area(both.path)/truth["area"] - 1) < 0.1